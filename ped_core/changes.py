@@ -1,7 +1,9 @@
 # Copyright 2015 James P Goodwin ped tiny python editor
-""" undo module for the ped python editor, implements a simple undo mechanism """
+""" change module for the ped python editor, tracks the lines changed since each view last redrew """
 
 import sys
+import copy
+import bisect
 
 
 class Change:
@@ -49,26 +51,146 @@ class Change:
         else:
             return False
 
+class ChangedLines:
+    """ the changed lines for one view as a sorted list of disjoint, non adjacent spans kept in two parallel lists
+    of start and end lines so adding a span and testing a line are binary searches """
+    def __init__(self):
+        """ construct an empty set of spans """
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        """ return the number of spans """
+        return len(self.starts)
+
+    def __copy__(self):
+        """ copy the spans """
+        result = ChangedLines()
+        result.starts = list(self.starts)
+        result.ends = list(self.ends)
+        return result
+
+    def add(self, start_line, end_line ):
+        """ add the span start_line to end_line merging it with any spans it overlaps or touches """
+        lo = bisect.bisect_left(self.ends,start_line-1)
+        hi = bisect.bisect_right(self.starts,end_line+1)
+        if lo < hi:
+            start_line = min(start_line,self.starts[lo])
+            end_line = max(end_line,self.ends[hi-1])
+        self.starts[lo:hi] = [start_line]
+        self.ends[lo:hi] = [end_line]
+
+    def shift(self, line, count ):
+        """ move the spans to follow count lines inserted at line, or -count lines deleted at line if count is negative,
+        the spans that end before line are left alone and the ones after the lines deleted just move """
+        idx = bisect.bisect_left(self.ends,line)
+        if count > 0:
+            if idx < len(self.starts) and self.starts[idx] < line:
+                self.ends[idx] += count
+                idx += 1
+            for k in range(idx,len(self.starts)):
+                self.starts[k] += count
+                self.ends[k] += count
+            return
+        after = line-count
+        hi = bisect.bisect_right(self.starts,after)
+        # spans that overlap the lines deleted are clipped to them, the one before can now touch the one after
+        starts = []
+        ends = []
+        if idx and self.ends[idx-1] == line-1:
+            idx -= 1
+        for k in range(idx,hi):
+            start_line = self.starts[k]
+            end_line = max(line-1,self.ends[k]+count)
+            if start_line >= line:
+                start_line = max(line,start_line+count)
+            if end_line < start_line:
+                continue
+            if ends and start_line <= ends[-1]+1:
+                ends[-1] = max(ends[-1],end_line)
+            else:
+                starts.append(start_line)
+                ends.append(end_line)
+        for k in range(hi,len(self.starts)):
+            self.starts[k] += count
+            self.ends[k] += count
+        if ends and hi < len(self.starts) and self.starts[hi] <= ends[-1]+1:
+            ends[-1] = max(ends[-1],self.ends[hi])
+            hi += 1
+        self.starts[idx:hi] = starts
+        self.ends[idx:hi] = ends
+
+    def is_changed(self, line ):
+        """ tests to see if a line is in one of the spans """
+        idx = bisect.bisect_right(self.starts,line)-1
+        return idx >= 0 and self.ends[idx] >= line
+
+    def next_changed(self, line ):
+        """ return the first changed line at or after line or -1 if there isn't one """
+        idx = bisect.bisect_left(self.ends,line)
+        if idx < len(self.starts):
+            return max(line,self.starts[idx])
+        return -1
+
+    def changes(self):
+        """ return the spans as a list of Change objects """
+        return [Change(start_line,end_line) for start_line,end_line in zip(self.starts,self.ends)]
+
+    def clear(self):
+        """ forget all the spans """
+        self.starts = []
+        self.ends = []
+
 class ChangeManager:
-    """ manager for a list of changed lines for a given context so we can use it to do minimal redraw """
+    """ manager for the changed lines of each view of a given context so we can use it to do minimal redraw,
+    changes can be batched for bulk edits so they are merged once at the end, lines inserted and deleted are
+    also logged as shifts numbered by serial so views can move what they already show instead of redrawing it """
+    max_shifts = 1024
+
     def __init__(self):
         """ construct an ChangeManager, no arguments """
-        self.change_list = []
         self.views = {}
+        self.batch = None
+        self.batch_end = -1
+        self.batch_depth = 0
+        self.shifts = []
+        self.serial = 0
+        self.shift_floor = 0
+        # shift made in a batch that the next ones are added to, runs of lines inserted or deleted together become one
+        self.pending = None
+
+    def __copy__(self):
+        """ copy the changed lines of every view, used for snapshots that are read from other threads, the shift
+        log is only ever appended to or replaced so it is shared """
+        self.flush_shift()
+        result = ChangeManager()
+        for view in self.views:
+            result.views[view] = copy.copy(self.views[view])
+        result.shifts = self.shifts
+        result.serial = self.serial
+        result.shift_floor = self.shift_floor
+        return result
 
-    def __del__(self):
-        self.change_list = None
+    def snapshot(self, view = None ):
+        """ return a read only ChangeManager for a snapshot of the file, it shares the shift log and is handed the
+        changed lines of view, which start over with none here, so it is O(1) however many views and spans there are """
+        self.flush_shift()
+        result = ChangeManager()
+        if view in self.views:
+            result.views[view] = self.views[view]
+            self.views[view] = ChangedLines()
+        result.shifts = self.shifts
+        result.serial = self.serial
+        result.shift_floor = self.shift_floor
+        return result
 
     def __str__(self):
-        if self.change_list:
-            return "["+",".join([str(f) for f in self.change_list])+"]"
-        else:
-            return "[]"
+        return "{"+",".join(["%s:[%s]"%(view,",".join([str(c) for c in self.views[view].changes()])) for view in self.views])+"}"
 
     def add_view(self,view):
         """ adds a new view to this change manager """
         if view not in self.views:
-            self.views[view] = self.change_list
+            self.views[view] = ChangedLines()
 
     def remove_view(self,view):
         """ removes a view from this change manager """
@@ -77,54 +199,127 @@ class ChangeManager:
 
     def has_changes(self,view):
         """ returns true if there are pending changes """
-        if self.views[view]:
-            return True
-        else:
-            return False
+        self.flush_shift()
+        return len(self.views[view]) > 0
 
     def is_changed(self, view, line ):
-        """ returns true if a line is marked as changed at or after the revNo passed """
-        if not self.views[view]:
-            return False
+        """ returns true if a line is marked as changed for this view """
+        self.flush_shift()
+        return self.views[view].is_changed(line)
 
-        for c in self.views[view]:
-            if c.is_changed(line):
-                return True
-        return False
+    def next_changed(self, view, line ):
+        """ returns the first line at or after line that is marked as changed for this view, or -1 if there isn't one """
+        self.flush_shift()
+        return self.views[view].next_changed(line)
+
+    def view_changed(self, view, start_line, end_line ):
+        """ mark a range of lines as changed for this view only, used when one view moves without the lines changing """
+        self.flush_shift()
+        self.views[view].add(start_line,end_line)
+
+    def changed_lines(self, view, start_line = 0, end_line = sys.maxsize ):
+        """ generator for the changed lines for this view from start_line up to and including end_line """
+        line = self.next_changed(view,start_line)
+        while line >= 0 and line <= end_line:
+            yield line
+            line = self.next_changed(view,line+1)
 
     def flush(self, view):
-        """ reset the change list to empty used when the whole page is going to need refresh no matter what """
-        self.views[view] = None
-        all_none = True
+        """ reset the changes for this view used when the whole page is going to need refresh no matter what """
+        self.flush_shift()
+        self.views[view].clear()
+
+    def start_batch(self):
+        """ start collecting changes to be merged all at once by end_batch, batches nest """
+        if not self.batch_depth:
+            self.batch = []
+            self.batch_end = -1
+        self.batch_depth += 1
+
+    def end_batch(self):
+        """ end a batch, when the outermost batch ends the collected changes are sorted, merged and applied to each view """
+        self.batch_depth -= 1
+        if self.batch_depth:
+            return
+        self.flush_shift()
+        self.apply_batch()
+        self.batch = None
+
+    def apply_batch(self):
+        """ sort and merge the collected changes and apply them to each view """
+        batch = self.batch
+        self.batch = []
+        self.batch_end = -1
+        batch.sort()
+        merged = ChangedLines()
+        for start_line, end_line in batch:
+            if merged.ends and start_line <= merged.ends[-1]+1:
+                merged.ends[-1] = max(merged.ends[-1],end_line)
+            else:
+                merged.starts.append(start_line)
+                merged.ends.append(end_line)
+        for start_line, end_line in zip(merged.starts,merged.ends):
+            for v in self.views:
+                self.views[v].add(start_line,end_line)
+
+    def shifted(self, line, count ):
+        """ record that count lines were inserted at line, or -count lines deleted if count is negative, the
+        changed lines of every view move with them, in a batch a shift that carries on from the last one, lines
+        inserted after the ones just inserted or deleted where lines were just deleted, is added to it so
+        the views are only moved once for the run """
+        if self.batch != None:
+            if self.pending and self.batch_end < line:
+                p_line, p_count = self.pending
+                if count > 0 and p_count > 0 and p_line <= line <= p_line+p_count:
+                    self.pending = (p_line,p_count+count)
+                    return
+                if count < 0 and p_count < 0 and line <= p_line <= line-count:
+                    self.pending = (line,p_count+count)
+                    return
+            self.flush_shift()
+            if self.batch and line <= self.batch_end:
+                self.apply_batch()
+            self.pending = (line,count)
+            return
+        self.shift(line,count)
+
+    def flush_shift(self):
+        """ apply the shift collected in a batch """
+        if self.pending:
+            line, count = self.pending
+            self.pending = None
+            self.shift(line,count)
+
+    def shift(self, line, count ):
+        """ log a shift and move the changed lines of every view with it """
+        self.serial += 1
+        self.shifts.append((self.serial,line,count))
+        if len(self.shifts) > 2*ChangeManager.max_shifts:
+            self.shift_floor = self.shifts[-ChangeManager.max_shifts-1][0]
+            self.shifts = self.shifts[-ChangeManager.max_shifts:]
         for v in self.views:
-            if self.views[v]:
-                all_none = False
+            self.views[v].shift(line,count)
+
+    def get_shifts(self, since ):
+        """ return the list of (line,count) shifts after serial since up to our serial, or None if they
+        have been dropped from the log """
+        self.flush_shift()
+        if since < self.shift_floor:
+            return None
+        result = []
+        for serial, line, count in reversed(self.shifts):
+            if serial <= since:
                 break
-        if all_none:
-            self.change_list = []
+            if serial <= self.serial:
+                result.append((line,count))
+        result.reverse()
+        return result
 
     def changed(self, start_line = 0, end_line = sys.maxsize ):
         """ mark a range of lines as changed or by default mark them all as changed """
-        nc = Change(start_line,end_line)
-        new_change_list = []
-        for c in self.change_list:
-            if nc.is_equal(c) or nc.is_contained(c):
-                continue
-            elif nc.is_adjacent(c):
-                if c.start_line < nc.start_line:
-                    nc = Change(c.start_line,end_line)
-                else:
-                    nc = Change(start_line,c.end_line)
-            elif nc.is_overlapped( c ):
-                if c.start_line < nc.start_line:
-                    nc = Change(c.start_line,nc.end_line)
-                else:
-                    nc = Change(nc.start_line,c.end_line)
-            elif c.is_contained(nc):
-                nc = Change(c.start_line,c.end_line)
-            else:
-                new_change_list.append(Change(c.start_line,c.end_line))
-        new_change_list.insert(0,nc)
-        self.change_list = new_change_list
+        if self.batch != None:
+            self.batch.append((start_line,end_line))
+            self.batch_end = max(self.batch_end,end_line)
+            return
         for v in self.views:
-            self.views[v] = self.change_list
+            self.views[v].add(start_line,end_line)
@@ -5,10 +5,7 @@ from ped_dialog.message_dialog import message
 import re
 from pygments.lexers import CLexer,CppLexer
 from pygments.token import Token
-from ped_core.mode import Tokens,render
-import copy
-
-lexer = None
+from ped_core.mode import Tokens,render,TokenAttrs,get_lexer
 
 def get_tabs(editor):
     """ return the tab stops for this type of file """
@@ -16,23 +13,28 @@ def get_tabs(editor):
 
 def detect_mode(editor):
     """ hook called to detect if this mode should be used for a file, returns True if it should be used, False otherwise """
-    global lexer
     workfile = editor.getWorkfile()
-    if re.search(r"(\.c$)|(\.c\:\(r.*\)$)",workfile.getFilename()):
-        lexer = CLexer()
-        return True
-    elif re.search(r"(\.cpp$)|(\.cpp\:\(r.*\)$)",workfile.getFilename()):
-        lexer = CppLexer()
-        return True
-    elif re.search(r"(\.h$)|(\.h\:\(r.*\)$)",workfile.getFilename()):
-        lexer = CLexer()
-        return True
-    elif re.search(r"(\.hpp$)|(\.hpp\:\(r.*\)$)",workfile.getFilename()):
-        lexer = CppLexer()
+    if re.search(r"(\.(c|cpp|h|hpp)$)|(\.(c|cpp|h|hpp)\:\(r.*\)$)",workfile.getFilename()):
         return True
     else:
         return False
 
+def get_tokens(workfile):
+    """ return the tokens for this file, the lexer is picked when they are made, C++ for .cpp and .hpp files and C
+    otherwise, and only again when the file gets a new name """
+    filename = workfile.getFilename()
+    tokens = getattr(workfile,"cpp_mode_tokens",None)
+    if tokens:
+        if tokens.getKey() == filename:
+            return tokens
+        tokens.detach(workfile)
+    if re.search(r"(\.(cpp|hpp)$)|(\.(cpp|hpp)\:\(r.*\)$)",filename):
+        tokens = Tokens(get_lexer(CppLexer),filename)
+    else:
+        tokens = Tokens(get_lexer(CLexer),filename)
+    setattr(workfile,"cpp_mode_tokens",tokens)
+    return tokens
+
 def handle(editor,ch):
     """ hook called for each keystroke, can be used for auto-indent or auto-complete """
     if ch == 10:
@@ -75,37 +77,30 @@ def finish(editor):
     wf = editor.getWorkfile()
     if wf:
         if hasattr(wf,"cpp_mode_tokens"):
+            wf.cpp_mode_tokens.detach(wf)
             del wf.cpp_mode_tokens
             wf.cpp_mode_tokens = None
             delattr(wf,"cpp_mode_tokens")
 
+token_attrs = TokenAttrs([Token.Keyword,Token.Operator.Word,Token.Name.Builtin.Pseudo],
+                         [Token.Text,Token.String,Token.Literal],
+                         [Token.Comment])
+
 def redraw(editor):
     """ redraw the colorization based on the current token set, regenerate it if needed """
-    workfile = editor.getWorkfile()
-
-    if hasattr(workfile,"cpp_mode_tokens"):
-        tokens = workfile.cpp_mode_tokens
-    else:
-        tokens = Tokens()
-        setattr(workfile,"cpp_mode_tokens",tokens)
+    tokens = get_tokens(editor.getWorkfile())
 
     if not tokens:
         return False
 
-    if not tokens.getTokens() or tokens.getModref() != workfile.getModref():
-        tokens.refresh(editor,copy.copy(lexer))
+    if not tokens.ready(editor):
+        tokens.refresh(editor)
         return False
 
-    render(editor,tokens,
-            [Token.Keyword,Token.Operator.Word,Token.Name.Builtin.Pseudo],
-            [Token.Text,Token.String,Token.Literal],
-            [Token.Comment])
+    render(editor,tokens,token_attrs)
 
     return True
 
-def name():
-    """ hook to return this mode's human readable name """
-    if lexer:
-        return lexer.name
-    else:
-        return ""
+def name(editor):
+    """ hook to return this mode's human readable name, the name of the lexer for the editor's file """
+    return get_tokens(editor.getWorkfile()).getLexer().name
@@ -13,6 +13,7 @@ from ped_dialog.message_dialog import message
 from ped_dialog.replace_dialog import replace,confirm_replace
 from ped_dialog.confirm_dialog import confirm
 from ped_dialog import file_dialog
+from ped_dialog import dialog
 from ped_core import undo
 from ped_core import python_mode
 from ped_core import java_mode
@@ -26,6 +27,11 @@ from ped_core import keytab
 from ped_core import keymap
 from ped_core import extension_manager
 from ped_core import changes
+from ped_core import line_cache
+from ped_core import tab_stops
+from ped_core import shadow_screen
+from ped_core import wrap_index
+from ped_core.line_buffer import EditLine, FileLine, MemLine, ArrayLineBuffer, RopeLineBuffer, scan_lines
 import traceback
 import locale
 import codecs
@@ -33,76 +39,14 @@ import tempfile
 import threading
 import logging
 import time
+import mmap
+import collections
+import stat
+from array import array
 
 locale.setlocale(locale.LC_ALL,'')
 def_encoding = locale.getpreferredencoding()
 
-class EditLine:
-    """ Interface for each editable line in a file, a fly-weight object """
-    def __init__(self):
-        """ should initialize any content or references to external objects """
-        pass
-
-    def length(self):
-        """ return the length of the line """
-        pass
-
-    def flush(self):
-        """ flush cached length if you have one """
-        pass
-
-    def getContent(self):
-        """ should return line representing this line in the source file """
-        pass
-
-class FileLine(EditLine):
-    """ Instance of a line in a file that hasn't been changed, stored on disk """
-    def __init__(self, parent, pos, len = -1 ):
-        """ FileLine(s) are pointers to a line on disk the EditFile reference and offset are stored """
-        EditLine.__init__(self)
-        self.parent = parent
-        self.pos = pos
-        self.len = len
-
-    def length(self):
-        """ return length of line """
-        if self.len < 0:
-            self.len = len(self.parent.expand_tabs(self.getContent()))
-        return self.len
-
-    def flush(self):
-        """ flush cached length """
-        self.len = -1
-
-    def getContent(self):
-        """ gets the file from its parent, seeks to position, reads line and returns it """
-        working = self.parent.getWorking()
-        working.seek(self.pos,0)
-        txt = working.readline().rstrip()
-        return txt
-
-    def __del__(self):
-        self.parent = None
-
-class MemLine(EditLine):
-    """ Instance of a line in memory that has been edited """
-    def __init__(self, content ):
-        """ MemLine(s) are in memory strings that represent a line that has been edited, it is initialized from the original file content"""
-        EditLine.__init__(self)
-        self.content = content
-
-    def length(self):
-        """ return the length of the content """
-        return len(self.content)
-
-    def flush(self):
-        """ flush cached length """
-        pass
-
-    def getContent(self):
-        """ just return the string reference """
-        return self.content
-
 class ReadOnlyError(Exception):
     """ Exception when modification to readonly file attempted """
     pass
@@ -114,6 +58,10 @@ class EditFile:
 
     default_readonly = False
     default_backuproot = "~"
+    default_line_buffer = RopeLineBuffer
+    backup_dirs = set()
+    index_block_size = 1048576
+    default_undo_journal = True
 
     def __init__(self, filename=None ):
         """ takes an optional filename to either load or create """
@@ -123,6 +71,7 @@ class EditFile:
         self.backuproot = EditFile.default_backuproot
         # set the default tab stops
         self.tabs = [ 4, 8 ]
+        self.tab_stops = tab_stops.get_tab_stops(self.tabs)
         # set the changed flag to false
         self.changed = False
         # read only flag
@@ -135,8 +84,20 @@ class EditFile:
         self.modref = 0
         # the file object
         self.working = None
+        # modification time of the file on disk when we opened it
+        self.mtime = None
+        # the file the working map was made from, kept open to copy ranges from when saving
+        self.working_file = None
+        # the line ending used by the file
+        self.newline = "\n"
+        # bytes copied and bytes encoded by the last save
+        self.save_stats = (0,0)
+        # background thread indexing the rest of a large file
+        self.indexer = None
+        # cache of expanded line content
+        self.line_cache = line_cache.LineCache()
         # the lines in this file
-        self.lines = []
+        self.lines = EditFile.default_line_buffer(self)
         # load the file
         if filename:
             self.load()
@@ -146,20 +107,41 @@ class EditFile:
         result = EditFile()
         result.filename = self.filename
         result.tabs = self.tabs
+        result.tab_stops = self.tab_stops
         result.changed = self.changed
         result.readonly = True
         result.undo_mgr = copy.copy(self.undo_mgr)
-        result.change_mgr = copy.copy(self.change_mgr)
+        result.change_mgr = self.change_mgr.snapshot()
         result.modref = self.modref
-        result.lines = []
-        for l in self.lines:
-            if isinstance(l,MemLine):
-                result.lines.append(copy.deepcopy(l))
-            elif isinstance(l,FileLine):
-                result.lines.append(FileLine(result,l.pos,l.len))
-        result.working = None
-        if self.working:
+        result.lines = self.lines.copy(result)
+        result.working = self.working
+        if self.working and not isinstance(self.working,mmap.mmap):
+            result.working = open(self.working.name,"r",buffering=1,encoding="utf-8")
+        result.mtime = self.mtime
+        result.newline = self.newline
+        return result
+
+    def snapshot(self, view = None):
+        """ return a read only EditFile that sees the lines as they are now, the line table is shared copy on write
+        so this is O(1) no matter how big or how edited the file is, used by background readers like the tokenizers,
+        the snapshot's modref is the version of the file it was taken from, the changed lines of view are handed
+        to the snapshot and flushed here """
+        result = EditFile()
+        result.filename = self.filename
+        result.tabs = self.tabs
+        result.tab_stops = self.tab_stops
+        result.changed = self.changed
+        result.readonly = True
+        result.undo_mgr = None
+        result.change_mgr = self.change_mgr.snapshot(view)
+        result.modref = self.modref
+        result.working = self.working
+        if self.working and not isinstance(self.working,mmap.mmap):
             result.working = open(self.working.name,"r",buffering=1,encoding="utf-8")
+        result.mtime = self.mtime
+        result.newline = self.newline
+        result.line_cache = line_cache.LineCache(0)
+        result.lines = self.lines.snapshot(result)
         return result
 
     def __del__(self):
@@ -172,8 +154,9 @@ class EditFile:
         """ set the tab stops for this file to something new """
         if tabs != self.tabs:
             self.tabs = tabs
-            for l in self.lines:
-                l.flush()
+            self.tab_stops = tab_stops.get_tab_stops(tabs)
+            self.lines.flush()
+            self.line_cache.clear()
 
     def get_tabs(self):
         """ return the list of tab stops """
@@ -183,6 +166,17 @@ class EditFile:
         """ return the file object """
         return self.working
 
+    def readLine(self, pos):
+        """ read the line starting at byte offset pos in the working file, only the bytes of that line are decoded """
+        working = self.working
+        if not isinstance(working,mmap.mmap):
+            working.seek(pos,0)
+            return working.readline().rstrip()
+        end = working.find(b"\n",pos)
+        if end < 0:
+            end = len(working)
+        return working[pos:end].decode("utf-8","surrogateescape").rstrip()
+
     def getModref(self):
         """ modref is a serial number that is incremented for each change to a file, used to detect changes externally """
         return self.modref
@@ -195,6 +189,12 @@ class EditFile:
         """ returns our undo_manager """
         return self.undo_mgr
 
+    def getUndoStats(self):
+        """ return a tuple of (number of transactions, number of actions, bytes) held by our undo manager """
+        if self.undo_mgr:
+            return self.undo_mgr.stats()
+        return (0,0,0)
+
     def isChanged(self):
         """ true if there are unsaved changes, false otherwise """
         return self.changed
@@ -216,64 +216,131 @@ class EditFile:
         self.filename = filename
 
     def numLines(self):
-        """ get the number of lines in this file """
+        """ get the number of lines in this file, grows while the file is being indexed """
+        self.mergeIndex()
         return len(self.lines)
 
     def open(self):
-        """ open the file or create it if it doesn't exist """
+        """ open the file or create it if it doesn't exist, existing files are mapped read only
+        and used in place, edited lines live in memory so no working copy is made """
         abs_name = os.path.abspath(self.filename)
-        abs_path = os.path.dirname(abs_name)
+        self.working = None
+        self.mtime = None
         if os.path.exists(abs_name):
-            self.working = tempfile.NamedTemporaryFile(mode="w+",buffering=1,encoding="utf-8",prefix="ped_",dir=EditFile.get_backup_dir(self.backuproot))
-            shutil.copyfile(abs_name,self.working.name)
+            f = open(abs_name,"rb")
+            fstat = os.fstat(f.fileno())
+            if fstat.st_size:
+                self.working = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+                self.working_file = f
+                end = self.working.find(b"\n")
+                if end > 0 and self.working[end-1:end] == b"\r":
+                    self.newline = "\r\n"
+                else:
+                    self.newline = "\n"
+            else:
+                f.close()
+            self.mtime = fstat.st_mtime
             if not self.readonly:
                 self.setReadOnly(not os.access(abs_name,os.W_OK))
-        elif not self.readonly:
-            self.working = tempfile.NamedTemporaryFile(mode="w+",buffering=1,encoding="utf-8",prefix="ped_",dir=EditFile.get_backup_dir(self.backuproot))
-        else:
+        elif self.readonly:
             raise Exception("File %s does not exist!"%(self.filename))
         self.filename = abs_name
-        self.working.seek(0,0)
 
     def isModifiedOnDisk(self):
         """ return true if the file we're editing has been modified since we started """
         if os.path.exists(self.filename):
+            if self.mtime == None:
+                return True
             disk_stat = os.stat(self.filename)
-            temp_stat = os.stat(self.working.name)
-            return disk_stat.st_mtime > temp_stat.st_mtime
+            return disk_stat.st_mtime > self.mtime
         else:
             return False
 
     def close(self):
-        """ close the file """
-        if self.working:
+        """ close the file, a map is shared with any copies so we just drop our reference to it """
+        if self.indexer:
+            self.indexer.stop_index()
+            self.indexer = None
+        if self.working and not isinstance(self.working,mmap.mmap):
             self.working.close()
+        if self.working_file:
+            self.working_file.close()
+            self.working_file = None
         self.working = None
         self.lines = None
 
     def load(self):
-        """ open the file and load the lines into the array """
+        """ open the file and index the first block of lines, the rest of a large file is indexed in the background """
+        if self.indexer:
+            self.indexer.stop_index()
+            self.indexer = None
         self.open()
-        self.lines = []
-        pos = 0
-        lidx = 0
-        while True:
-            line = self.working.readline()
-            if not line:
-                break
-            line = line.rstrip()
-            lidx = lidx + 1
-            self.lines.append(FileLine(self,pos,len(self.expand_tabs(line))))
-            pos = self.working.tell()
+        self.lines = EditFile.default_line_buffer(self)
+        self.line_cache.clear()
+        if self.working:
+            offsets, pos = scan_lines(self.working,0,EditFile.index_block_size)
+            self.lines.append_offsets(offsets)
+            if pos < len(self.working):
+                self.indexer = IndexThread(self.working,pos,EditFile.index_block_size)
+                self.indexer.start_index()
+        if not self.indexer:
+            self.trimLines()
+        self.changed = False
+        self.modref = 0
+        self.attachUndoJournal()
+
+    def attachUndoJournal(self):
+        """ give our undo manager a journal in the backup directory to spill old undo transactions to, a journal
+        left by an earlier session is picked up if the file hasn't changed since it was last saved """
+        if not EditFile.default_undo_journal or not self.undo_mgr or self.readonly or not self.filename:
+            return
+        size = 0
+        if self.working:
+            size = len(self.working)
+        path = EditFile.backup_path(self.filename,self.backuproot)+".undo"
+        self.undo_mgr.set_journal(undo.UndoJournal(path,self,size,self.mtime))
+
+    def trimLines(self):
+        """ drop the blank lines at the end of the file and make sure there is at least one line """
         while len(self.lines) and not self.lines[-1].getContent().strip():
             del self.lines[-1]
         if not len(self.lines):
             self.lines.append(MemLine(""))
-        self.changed = False
-        self.modref = 0
+
+    def mergeIndex(self):
+        """ add any lines found by the background indexer to the lines, marking them changed so they get displayed """
+        indexer = self.indexer
+        if not indexer:
+            return
+        done = indexer.done
+        while indexer.pending:
+            offsets = indexer.pending.popleft()
+            start = len(self.lines)
+            self.lines.append_offsets(offsets)
+            self.modref += 1
+            if self.change_mgr:
+                self.change_mgr.changed(start,len(self.lines))
+        if done:
+            self.indexer = None
+            self.trimLines()
+
+    def isIndexing(self):
+        """ return true if the file is still being indexed in the background """
+        self.mergeIndex()
+        return self.indexer != None
+
+    def waitForLine(self, line ):
+        """ wait until line has been indexed or the whole file has been indexed, line < 0 waits for the whole file """
+        while self.indexer:
+            indexer = self.indexer
+            self.mergeIndex()
+            if not self.indexer or (line >= 0 and line < len(self.lines)):
+                return
+            indexer.wait()
 
     def hasChanges(self,view):
         """ return true if there are pending screen updates """
+        self.mergeIndex()
         return self.change_mgr.has_changes(view)
 
     def isLineChanged(self,view,line):
@@ -283,6 +350,15 @@ class EditFile:
         else:
             return True
 
+    def nextChangedLine(self,view,line):
+        """ return the first changed line at or after line, or the number of lines if there are none after it """
+        if self.change_mgr:
+            changed = self.change_mgr.next_changed(view,line)
+            if changed >= 0 and changed < len(self.lines):
+                return changed
+            return len(self.lines)
+        return line
+
     def flushChanges(self,view):
         """ reset the change tracking for full screen redraw events """
         if self.change_mgr:
@@ -290,29 +366,35 @@ class EditFile:
 
     def _deleteLine(self,line,changed = True):
         """ delete a line """
+        self.waitForLine(line)
         if self.undo_mgr:
             self.undo_mgr.get_transaction().push(self._insertLine,(line,self.lines[line],self.changed))
+        self.line_cache.invalidate(self.lines.identity(line))
         del self.lines[line]
         self.changed = changed
         self.modref += 1
         if self.change_mgr:
-            self.change_mgr.changed(line,len(self.lines))
+            self.change_mgr.shifted(line,-1)
 
     def _insertLine(self,line,lineObj,changed = True):
         """ insert a line """
+        self.waitForLine(line)
         if self.undo_mgr:
             self.undo_mgr.get_transaction().push(self._deleteLine,(line,self.changed))
         self.lines.insert(line,lineObj)
         self.changed = changed
         self.modref += 1
         if self.change_mgr:
-            self.change_mgr.changed(line,len(self.lines))
+            self.change_mgr.shifted(line,1)
+            self.change_mgr.changed(line,line)
 
 
     def _replaceLine(self,line,lineObj,changed = True):
         """ replace a line """
+        self.waitForLine(line)
         if self.undo_mgr:
             self.undo_mgr.get_transaction().push(self._replaceLine,(line,self.lines[line],self.changed))
+        self.line_cache.invalidate(self.lines.identity(line))
         self.lines[line] = lineObj
         self.changed = changed
         self.modref += 1
@@ -322,6 +404,7 @@ class EditFile:
 
     def _appendLine(self,lineObj,changed = True):
         """ add a line """
+        self.waitForLine(-1)
         if self.undo_mgr:
             self.undo_mgr.get_transaction().push(self._deleteLine,(len(self.lines),self.changed))
         self.lines.append(lineObj)
@@ -338,31 +421,38 @@ class EditFile:
     def length(self, line ):
         """ return the length of the line """
         if line < len(self.lines):
-            return self.lines[line].length()
+            return self.lines.length(line)
         else:
             return 0
 
     def getLine( self, line, pad = 0, trim = False ):
-        """ get a line """
+        """ get a line, expanded lines are cached by their identity in the line buffer """
         if line < len(self.lines):
-            orig = self.lines[line].getContent()
+            key = self.lines.identity(line)
+            orig = self.line_cache.get(key)
+            if orig == None:
+                orig = self.expand_tabs(self.lines.getContent(line))
+                self.line_cache.put(key,orig)
         else:
             orig = ""
         if trim:
             orig = orig.rstrip()
         if pad > len(orig):
             orig = orig + ' '*(pad-len(orig))
-        return self.expand_tabs(orig)
+        return orig
 
     def getLines( self, line_start = 0, line_end = -1):
         """ get a list of a range of lines """
         if line_end < 0:
+            self.waitForLine(-1)
             line_end = len(self.lines)
+        else:
+            self.waitForLine(line_end-1)
         if line_end > len(self.lines):
             line_end = len(self.lines)
         lines = []
         while line_start < line_end:
-            lines.append(self.expand_tabs(self.lines[line_start].getContent()))
+            lines.append(self.expand_tabs(self.lines.getContent(line_start)))
             line_start += 1
         return lines
 
@@ -371,6 +461,7 @@ class EditFile:
         if self.isReadOnly():
             raise ReadOnlyError()
 
+        self.waitForLine(line)
         if line < len(self.lines):
             self._deleteLine(line)
 
@@ -379,6 +470,7 @@ class EditFile:
         if self.isReadOnly():
             raise ReadOnlyError()
 
+        self.waitForLine(line)
         if line >= len(self.lines):
             lidx = len(self.lines)
             while lidx <= line:
@@ -392,6 +484,7 @@ class EditFile:
         if self.isReadOnly():
             raise ReadOnlyError()
 
+        self.waitForLine(line)
         if line >= len(self.lines):
             lidx = len(self.lines)
             while lidx <= line:
@@ -407,97 +500,219 @@ class EditFile:
         if not os.path.exists(base):
             base = os.path.expanduser("~")
         pedbackup = os.path.join(base,".pedbackup")
-        if not os.path.exists(pedbackup):
-            os.mkdir(pedbackup)
+        if pedbackup not in EditFile.backup_dirs:
+            if not os.path.exists(pedbackup):
+                os.mkdir(pedbackup)
+            EditFile.backup_dirs.add(pedbackup)
         return pedbackup
 
+    @staticmethod
+    def backup_path( filename, base = "~" ):
+        """ return the path of the backup for filename under ~/.pedbackup without creating anything """
+        base = os.path.expanduser(base)
+        if not os.path.exists(base):
+            base = os.path.expanduser("~")
+        (filepath,rest) = os.path.split(os.path.abspath(filename))
+        return os.path.join(base,".pedbackup",*([part for part in filepath.split("/") if part]+[rest]))
+
     @staticmethod
     def make_backup_dir( filename, base = "~" ):
         """ make a backup directory under ~/.pedbackup for filename and return it's name """
-        pedbackup = EditFile.get_backup_dir( base )
+        EditFile.get_backup_dir( base )
+        path = EditFile.backup_path( filename, base )
+        pedbackup = os.path.dirname(path)
+        if pedbackup not in EditFile.backup_dirs:
+            os.makedirs(pedbackup,exist_ok=True)
+            EditFile.backup_dirs.add(pedbackup)
+
+        return path
+
+    def copyRange(self, o, start, end ):
+        """ copy the bytes from start to end of the working file to the unbuffered file o, using copy_file_range
+        when we have the file the map was made from, otherwise writing straight out of the map """
+        if self.working_file and hasattr(os,"copy_file_range"):
+            try:
+                while start < end:
+                    copied = os.copy_file_range(self.working_file.fileno(),o.fileno(),end-start,start)
+                    if not copied:
+                        break
+                    start += copied
+            except OSError:
+                pass
+        view = memoryview(self.working)
+        try:
+            while start < end:
+                start += o.write(view[start:min(end,start+1048576)])
+        finally:
+            view.release()
+
+    def writeLines(self, filename ):
+        """ write the lines to filename and sync it to disk, runs of unchanged lines are copied from the working file
+        and only edited lines are encoded, returns a tuple of the number of bytes copied, the number of bytes encoded
+        and an array('q') of the offsets of the lines in the new file """
+        working = self.working
+        size = len(working) if working else 0
+        newline = self.newline.encode("utf-8")
+        counts = [0,0]
+        run = [-1,-1,0]
+        offsets = array('q')
+        pending = bytearray()
+        o = open(filename,"wb",buffering=0)
+
+        def flush():
+            """ write out the encoded lines """
+            if pending:
+                o.write(pending)
+                del pending[:]
+
+        def copy_run(start, end):
+            """ extend the current run of unchanged bytes to end or copy it out and start a new one at start """
+            if start >= 0 and start == run[1]:
+                run[1] = end
+                return
+            if run[0] >= 0:
+                flush()
+                self.copyRange(o,run[0],run[1])
+                counts[0] += run[1]-run[0]
+                if run[1] == size and working[size-1:size] != b"\n":
+                    pending.extend(newline)
+                    counts[1] += len(newline)
+            run[0] = start
+            run[1] = end
+            run[2] = counts[0]+counts[1]-start
 
-        (filepath,rest) = os.path.split(os.path.abspath(filename))
-        for part in filepath.split("/"):
-            if part:
-                pedbackup = os.path.join(pedbackup,part)
-                if not os.path.exists(pedbackup):
-                    os.mkdir(pedbackup)
+        try:
+            for ids, overlay in self.lines.blocks():
+                if not len(ids):
+                    continue
+                # a block of increasing offsets with one newline between each pair is a single range of the file
+                if min(ids) >= 0 and working[ids[0]:ids[-1]].count(b"\n") == len(ids)-1 and list(ids) == sorted(ids):
+                    end = working.find(b"\n",ids[-1])
+                    copy_run(ids[0],size if end < 0 else end+1)
+                    offsets.extend(map(run[2].__add__,ids))
+                    continue
+                for pos in ids:
+                    if pos >= 0:
+                        end = working.find(b"\n",pos)
+                        copy_run(pos,size if end < 0 else end+1)
+                        offsets.append(pos+run[2])
+                    else:
+                        copy_run(-1,-1)
+                        offsets.append(counts[0]+counts[1])
+                        txt = overlay[-pos].getContent().encode("utf-8","surrogateescape") + newline
+                        pending.extend(txt)
+                        counts[1] += len(txt)
+                        if len(pending) > 1048576:
+                            flush()
+            copy_run(-1,-1)
+            flush()
+            os.fsync(o.fileno())
+        finally:
+            o.close()
+        return (counts[0], counts[1], offsets)
+
+    def getSaveStats(self):
+        """ return a tuple of the bytes copied from the working file and the bytes encoded from edited lines by the last save """
+        return self.save_stats
 
-        return os.path.join(pedbackup,rest)
+    def backupFile(self, filename ):
+        """ keep the current contents of filename in the backup directory, a hard link is used if possible """
+        backup_path = EditFile.make_backup_dir(filename,self.backuproot)
+        if os.path.lexists(backup_path):
+            os.remove(backup_path)
+        try:
+            os.link(filename,backup_path)
+        except OSError:
+            try:
+                os.rename(filename,backup_path)
+            except OSError:
+                shutil.copy2(filename,backup_path)
+        return backup_path
+
+    def saveLines(self, filename, backup ):
+        """ write the lines to a temp file beside filename, optionally back up the old file, swap the new file in and
+        then map it and index it from the offsets we wrote instead of loading it again """
+        filename = os.path.abspath(filename)
+        exists = os.path.exists(filename)
+        if exists:
+            fstat = os.stat(filename)
+            (fd,save_name) = tempfile.mkstemp(prefix="."+os.path.basename(filename)+".",suffix=".sav",dir=os.path.dirname(filename))
+            os.close(fd)
+        else:
+            save_name = filename
+        try:
+            (copied,encoded,offsets) = self.writeLines(save_name)
+            if exists:
+                os.chmod(save_name,stat.S_IMODE(fstat.st_mode))
+                if backup:
+                    self.backupFile(filename)
+                os.replace(save_name,filename)
+        except:
+            if exists and os.path.exists(save_name):
+                os.remove(save_name)
+            raise
+        self.close()
+        self.filename = filename
+        self.open()
+        self.lines = EditFile.default_line_buffer(self,offsets)
+        self.line_cache.clear()
+        self.trimLines()
+        self.changed = False
+        self.modref = 0
+        return (copied,encoded)
 
     def save( self, filename = None ):
         """ save the file, if filename is passed it'll be saved to that filename and reopened """
+        self.waitForLine(-1)
+        journal = None
+        if self.undo_mgr:
+            journal = self.undo_mgr.journal
         if filename:
             if filename == self.filename and self.isReadOnly():
                 raise ReadOnlyError()
-
-            o = open(filename,"w",buffering=1,encoding="utf-8")
-            for l in self.lines:
-                txt = l.getContent()+'\n'
-                o.write(txt)
-            o.close()
-            self.close()
-            self.filename = filename
-            self.load()
+            if os.path.abspath(filename) != self.filename:
+                # the old file's journal doesn't get this history, the new file's is attached once it is saved
+                journal = None
+                if self.undo_mgr:
+                    self.undo_mgr.set_journal(None)
+            if self.undo_mgr:
+                self.undo_mgr.checkpoint()
+            self.save_stats = self.saveLines(filename,False)
         else:
             if self.isReadOnly():
                 raise ReadOnlyError()
             if not self.changed:
                 return
-            o = open(self.filename+".sav","w",buffering=1,encoding="utf-8")
-            for l in self.lines:
-                txt = l.getContent()+'\n'
-                o.write(txt)
-            o.close()
-            self.working.close()
-            if os.path.exists(self.filename):
-                fstat = os.stat(self.filename)
-                backup_path = EditFile.make_backup_dir(self.filename,self.backuproot)
-                retval = shutil.move(self.filename,backup_path)
-                os.rename(self.filename+".sav",self.filename)
-                os.chmod(self.filename,fstat.st_mode)
-            else:
-                os.rename(self.filename+".sav",self.filename)
-            self.load()
+            if self.undo_mgr:
+                self.undo_mgr.checkpoint()
+            self.save_stats = self.saveLines(self.filename,True)
+        if journal != None:
+            journal.mark(len(self.working) if self.working else 0,self.mtime)
+        else:
+            self.attachUndoJournal()
 
     def get_tab_stop(self, idx, before=False ):
         """ return the next tab stop before or after a given offset """
-        prev = 0
-        for stop in self.tabs:
-            if stop > idx:
-                if before:
-                    return prev
-                else:
-                    return stop
-            prev = stop
-
-        incr = self.tabs[-1]-self.tabs[-2]
-        while stop <= idx:
-            prev = stop
-            stop += incr
-
         if before:
-            return prev
+            return self.tab_stops.prev_stop(idx)
         else:
-            return stop
+            return self.tab_stops.next_stop(idx)
 
     def expand_tabs(self, content ):
         """ expand tabs in a line """
-        idx = 0
-        while idx < len(content):
-            if content[idx] == '\t':
-                stop = self.get_tab_stop(idx)
-                content = content[0:idx] + ' '*(stop-idx) + content[idx+1:]
-                idx += (stop-idx)
-            else:
-                idx += 1
-        return content
+        return self.tab_stops.expand(content)
+
+    def column_map(self, content ):
+        """ return the display column of each character in content, see TabStops.column_map """
+        return self.tab_stops.column_map(content)
 
 
 class Editor:
     """ class that implements the text editor, operates on a file abstraction EditFile """
 
     modes = [python_mode,cpp_mode,java_mode,guess_mode]
+    # memory cap for each editor's cache of encoded strings
+    encode_cache_bytes = 262144
 
     def __init__(self, parent, scr, filename, workfile = None, showname = True, wrap = False ):
         """ takes parent curses screen we're popped up over, scr our curses window, filename we should edit, optionally an already open EditFile """
@@ -507,6 +722,7 @@ class Editor:
             self.workfile = EditFile(filename)
         self.workfile.change_mgr.add_view(self)
         self.undo_mgr = self.workfile.getUndoMgr()
+        self.undo_base = None
         self.parent = parent
         self.scr = scr
         if scr:
@@ -533,13 +749,18 @@ class Editor:
         self.mode = None
         self.showname = showname
         self.wrap = wrap
-        self.wrap_lines = []
-        self.unwrap_lines = []
+        self.wrap_index = None
         self.wrap_modref = -1
         self.wrap_width = -1
         self.show_cursor = True
         self.prev_pos = (0,0)
         self.focus = True
+        self.drawn = None
+        self.drawn_view = None
+        # what was last written to the window and the encoded strings written
+        self.shadow = None
+        self.dialogs_seen = dialog.Dialog.opened
+        self.encode_cache = line_cache.LineCache(Editor.encode_cache_bytes)
         self.invalidate_all()
         curses.raw()
         curses.meta(1)
@@ -564,10 +785,9 @@ class Editor:
         result.last_search = self.last_search
         result.last_search_dir = self.last_search_dir
         result.mode = self.mode
-        result.wrap_lines = copy.copy(self.wrap_lines)
-        result.unwrap_lines = copy.copy(self.unwrap_lines)
-        result.wrap_modref = self.wrap_modref
-        result.wrap_width = self.wrap_width
+        result.wrap_index = None
+        result.wrap_modref = -1
+        result.wrap_width = -1
         result.show_cursor = self.show_cursor
         result.focus = self.focus
         result.prev_pos = copy.copy(self.prev_pos)
@@ -579,6 +799,8 @@ class Editor:
         # let the mode clean up if it needs to
         if self.workfile and self.workfile.change_mgr:
             self.workfile.change_mgr.remove_view(self)
+        if self.wrap_index:
+            self.wrap_index.detach()
 
         if self.mode:
             self.mode.finish(self)
@@ -590,31 +812,47 @@ class Editor:
         """ by default it is a no-op but editors overriding this can hook the close to clean things up """
         pass
 
+    undo_fields = 21
+    undo_max_delta = 8
+
     def pushUndo(self):
-        """ push an undo action onto the current transaction """
-        self.undo_mgr.get_transaction().push(self.applyUndo,(self.line,
-                                                             self.pos,
-                                                             self.vpos,
-                                                             self.left,
-                                                             self.prev_cmd,
-                                                             self.cmd_id,
-                                                             self.home_count,
-                                                             self.end_count,
-                                                             self.line_mark,
-                                                             self.span_mark,
-                                                             self.rect_mark,
-                                                             self.search_mark,
-                                                             self.mark_pos_start,
-                                                             self.mark_line_start,
-                                                             self.last_search,
-                                                             self.last_search_dir,
-                                                             clipboard.clip,
-                                                             clipboard.clip_type,
-                                                             self.show_cursor,
-                                                             self.focus,
-                                                             self.wrap))
-    def applyUndo(self,*args):
-        """ called by undo to unwind one undo action """
+        """ push an undo action onto the current transaction, the cursor state is recorded as a delta against the
+        last full state recorded so runs of cursor movement share one copy of the state """
+        state = (self.line,
+                 self.pos,
+                 self.vpos,
+                 self.left,
+                 self.prev_cmd,
+                 self.cmd_id,
+                 self.home_count,
+                 self.end_count,
+                 self.line_mark,
+                 self.span_mark,
+                 self.rect_mark,
+                 self.search_mark,
+                 self.mark_pos_start,
+                 self.mark_line_start,
+                 self.last_search,
+                 self.last_search_dir,
+                 clipboard.clip,
+                 clipboard.clip_type,
+                 self.show_cursor,
+                 self.focus,
+                 self.wrap)
+        base = self.undo_base
+        delta = ()
+        if base:
+            delta = tuple([(idx,state[idx]) for idx in range(0,Editor.undo_fields) if state[idx] != base[idx]])
+        if not base or len(delta) > Editor.undo_max_delta:
+            base = self.undo_base = state
+            delta = ()
+        self.undo_mgr.get_transaction().push(self.applyUndo,(base,delta),True)
+
+    def applyUndo(self,base,delta):
+        """ called by undo to unwind one undo action, base is the full state and delta the fields that differ from it """
+        state = list(base)
+        for idx,value in delta:
+            state[idx] = value
         ( self.line,
         self.pos,
         self.vpos,
@@ -635,7 +873,7 @@ class Editor:
         clipboard.clip_type,
         self.show_cursor,
         self.focus,
-        self.wrap ) = args
+        self.wrap ) = state
         self.invalidate_screen()
         self.invalidate_mark()
 
@@ -643,13 +881,16 @@ class Editor:
         """ undo the last transaction, actually undoes the open transaction and the prior closed one """
         line = self.line
         left = self.left
-        self.undo_mgr.undo_transaction() # undo the one we're in... probably empty
+        if self.undo_mgr.stats()[0]:
+            self.undo_mgr.undo_transaction() # undo the one we're in... probably empty
         self.undo_mgr.undo_transaction() # undo the previous one... probably not empty
         if self.line != line or self.left != left:
             self.invalidate_screen()
 
     def setWin(self,win):
         """ install a new window to render to """
+        if win is not self.scr:
+            self.shadow = None
         self.scr = win
 
     def getModref(self):
@@ -715,27 +956,27 @@ class Editor:
     def filePos(self, line, pos ):
         """ translate display line, pos to file line, pos """
         if self.wrap:
-            if line < len(self.wrap_lines):
-                return (self.wrap_lines[line][0],self.wrap_lines[line][1]+pos)
+            r_line, segment = self.getWrapIndex().toLine(line)
+            if r_line < self.wrap_index.numLines():
+                return (r_line,segment*self.wrap_index.width+pos)
             else:
-                return (self.numLines()+(line-len(self.wrap_lines)),pos)
+                return (r_line,pos)
         else:
             return (line,pos)
 
     def scrPos(self, line, pos ):
         """ translate file pos to screen pos """
         if self.wrap:
-            nlines = len(self.unwrap_lines)
+            index = self.getWrapIndex()
+            nlines = index.numLines()
             if line >= nlines:
-                r_line,r_pos = self.scrPos(self.numLines()-1,self.getLength(self.numLines()-1)-1)
-                return (r_line+(line-self.numLines())+1,pos)
-            sline = self.unwrap_lines[line]
-            while sline < len(self.wrap_lines) and self.wrap_lines[sline][0] == line:
-                if pos >= self.wrap_lines[sline][1] and pos < self.wrap_lines[sline][2]:
-                    return (sline,pos-self.wrap_lines[sline][1])
-                sline = sline + 1
-            else:
-                return (sline-1,pos - self.wrap_lines[sline-1][1])
+                r_line,r_pos = self.scrPos(nlines-1,self.getLength(nlines-1)-1)
+                return (r_line+(line-nlines)+1,pos)
+            rows = index.lineRows(line)
+            segment = pos//index.width
+            if pos < 0 or segment >= rows:
+                segment = rows-1
+            return (index.toRow(line)+segment,pos-segment*index.width)
         else:
             return (line,pos)
 
@@ -744,8 +985,10 @@ class Editor:
         if self.wrap:
             if display:
                 orig = ""
-                if line < len(self.wrap_lines):
-                    orig = self.workfile.getLine(self.wrap_lines[line][0])[self.wrap_lines[line][1]:self.wrap_lines[line][2]]
+                r_line, segment = self.getWrapIndex().toLine(line)
+                if r_line < self.wrap_index.numLines():
+                    start = segment*self.wrap_index.width
+                    orig = self.workfile.getLine(r_line)[start:start+self.wrap_index.width]
                 if trim:
                     orig = orig.rstrip()
                 if pad > len(orig):
@@ -758,8 +1001,9 @@ class Editor:
         """ get the length of a line """
         length = 0
         if self.wrap and display:
-            if line < len(self.wrap_lines):
-                length = self.workfile.length(self.wrap_lines[line][0])
+            r_line, segment = self.getWrapIndex().toLine(line)
+            if r_line < self.wrap_index.numLines():
+                length = self.workfile.length(r_line)
         else:
             length = self.workfile.length(line)
 
@@ -768,36 +1012,73 @@ class Editor:
     def numLines(self,display=False):
         """ get the number of lines in the editor """
         if self.wrap and display:
-            return len(self.wrap_lines)
+            return self.getWrapIndex().numRows()
 
         return self.workfile.numLines()
 
+    def getWrapIndex(self):
+        """ return the wrap index, it is built the first time it is needed """
+        if not self.wrap_index:
+            self.rewrap(True)
+        return self.wrap_index
+
     def rewrap(self, force = False):
-        """ compute the wrapped line array """
-        if self.wrap and (force or self.workfile.getModref() != self.wrap_modref or self.wrap_width != self.max_x):
-            self.wrap_modref = self.workfile.getModref()
+        """ bring the wrap index up to date with the file, only the lines that changed since the last rewrap are
+        wrapped again, the whole file is only wrapped again if the width changes or the index can't follow the changes """
+        if not self.wrap:
+            return
+        index = self.wrap_index
+        moved = None
+        if not force and index and index.workfile is self.workfile and self.wrap_width == self.max_x:
+            moved = index.update()
+        if moved == None:
+            if index:
+                index.detach()
             self.wrap_width = self.max_x
-            self.wrap_lines = []
-            self.unwrap_lines = []
-            for l in range(0,self.workfile.numLines()):
-                line_len = self.workfile.length(l)
-                start = 0
-                self.unwrap_lines.append(len(self.wrap_lines))
-                if not line_len:
-                    self.wrap_lines.append((l,0,0))
-                else:
-                    while start < line_len:
-                        self.wrap_lines.append((l,start,min(line_len,start+self.wrap_width)))
-                        start += self.wrap_width
+            self.wrap_index = wrap_index.WrapIndex(self.workfile,self.wrap_width)
+            moved = True
+        self.wrap_modref = self.workfile.getModref()
+        if moved:
             self.invalidate_after_cursor()
 
     def addstr(self,row,col,str,attr = curses.A_NORMAL):
-        """ write properly encoded string to screen location """
+        """ write properly encoded string to screen location, only the part that differs from what the shadow screen
+        says is already there is written """
+        shadow = self.shadow
+        if shadow:
+            if row >= 0 and row < shadow.height and col >= 0 and col+len(str) <= shadow.width:
+                span = shadow.update(row,col,str,attr)
+                if not span:
+                    return 0
+                start,end = span
+                col += start
+                str = str[start:end]
+            else:
+                # curses wraps what doesn't fit onto the following rows
+                shadow.clear()
+        encoded = self.encode_cache.get(str)
+        if encoded == None:
+            encoded = codecs.encode(str,"utf-8","replace")
+            self.encode_cache.put(str,encoded)
+        if shadow:
+            shadow.count(len(str),len(encoded))
         try:
-            return self.scr.addstr(row,col,codecs.encode(str,"utf-8"),attr)
+            return self.scr.addstr(row,col,encoded,attr)
         except:
             return 0
 
+    def invalidate_shadow(self):
+        """ forget what is on the window so the next redraw writes every cell, used when something else may have drawn over it """
+        if self.shadow:
+            self.shadow.clear()
+
+    def getRenderStats(self):
+        """ return the shadow screen stats for this editor (frames, writes, skipped writes, cells written, bytes written,
+        seconds for the last frame) or None if it hasn't drawn yet """
+        if self.shadow:
+            return self.shadow.stats()
+        return None
+
     def window_pos(self,line,pos):
         sc_line,sc_pos = self.scrPos(line,pos)
         return((sc_line-self.line)+1,sc_pos-self.left)
@@ -949,6 +1230,7 @@ class Editor:
                 self.left += self.pos-right_x
                 self.pos = right_x
             self.invalidate_screen()
+            self.invalidate_shadow()
 
     def move(self):
         """ update the previous cursor position from the current """
@@ -958,6 +1240,60 @@ class Editor:
         """ get the previous cursor position """
         return self.prev_pos
 
+    def shift_screen(self, exposed, row, count ):
+        """ insert count blank rows at screen row, or delete -count rows if count is negative, the rows below
+        move and exposed, the list of rows left blank, is updated """
+        rows = self.max_y-1
+        self.scr.move(row,0)
+        self.scr.insdelln(count)
+        if self.shadow:
+            self.shadow.shift(row,count)
+        moved = []
+        for r in exposed:
+            if r >= row:
+                if count < 0 and r < row-count:
+                    continue
+                r += count
+            if r >= 1 and r <= rows:
+                moved.append(r)
+        if count > 0:
+            moved.extend(range(row,min(rows,row+count-1)+1))
+        else:
+            moved.extend(range(max(row,rows+count+1),rows+1))
+        exposed[:] = moved
+
+    def scroll_screen(self):
+        """ move the lines already on the screen to follow the lines inserted and deleted in the file and the
+        scrolling done since the last redraw, using the terminal's line insert and delete, then touch the rows that
+        were left blank so only they are repainted """
+        drawn = self.drawn
+        self.drawn = None
+        if not drawn:
+            return
+        (scr,line,left,max_y,max_x,wrap,serial) = drawn
+        change_mgr = self.workfile.change_mgr
+        if not change_mgr:
+            return
+        shifts = change_mgr.get_shifts(serial)
+        if (scr != self.scr or left != self.left or max_y != self.max_y or max_x != self.max_x or wrap != self.wrap or
+            shifts == None or (shifts and self.wrap)):
+            self.invalidate_screen()
+            return
+        rows = self.max_y-1
+        exposed = []
+        for (s_line,count) in shifts:
+            if s_line < line+rows:
+                self.shift_screen(exposed,max(1,s_line-line+1),count)
+        delta = self.line - line
+        if abs(delta) >= rows:
+            self.invalidate_screen()
+            return
+        if delta:
+            self.shift_screen(exposed,1,-delta)
+        for r in exposed:
+            f_line,f_pos = self.filePos(self.line+r-1,0)
+            change_mgr.view_changed(self,f_line,f_line)
+
     def redraw(self):
         """ redraw  the editor as needed """
         try:
@@ -966,6 +1302,14 @@ class Editor:
 
             self.max_y,self.max_x = self.scr.getmaxyx()
             self.scr.keypad(1)
+            if not self.shadow or self.shadow.size() != (self.max_y,self.max_x):
+                self.shadow = shadow_screen.ShadowScreen(self.max_y,self.max_x)
+            elif self.dialogs_seen != dialog.Dialog.opened:
+                # dialogs draw into the same screen memory as the editor
+                self.shadow.clear()
+            self.dialogs_seen = dialog.Dialog.opened
+            self.shadow.begin_frame()
+            self.scroll_screen()
             if self.workfile.isChanged():
                 changed = "*"
             elif self.workfile.isReadOnly():
@@ -974,7 +1318,7 @@ class Editor:
                 changed = " "
 
             if self.mode:
-                changed = changed + " " + self.mode.name()
+                changed = changed + " " + self.mode.name(self)
             filename = self.workfile.getFilename()
             if not self.showname:
                 filename = ""
@@ -1013,6 +1357,10 @@ class Editor:
             self.draw_cursor()
             if mode_redraw:
                 self.flushChanges()
+            if self.workfile.change_mgr:
+                self.drawn = (self.scr,self.line,self.left,self.max_y,self.max_x,self.wrap,self.workfile.change_mgr.serial)
+            self.drawn_view = self.view_state()
+            self.shadow.end_frame()
         except:
             raise
 
@@ -1034,6 +1382,13 @@ class Editor:
         self.rewrap()
         self.goto(insert_line,offset+len(c))
 
+    def insert_run(self, run ):
+        """ insert a run of typed ahead printable characters as one edit, same as handling each key in turn """
+        self.prev_cmd = self.cmd_id
+        self.cmd_id = cmd_names.CMD_INSERT
+        self.insert(run)
+        return keytab.KEYTAB_NOKEY
+
     def delc(self):
         """ deletes one character at the cursor position """
         self.pushUndo()
@@ -1091,6 +1446,8 @@ class Editor:
         if pos < 0:
             pos = 0
 
+        self.workfile.waitForLine(line)
+
         (line,pos) = self.scrPos(line,pos)
 
         if line >= self.line and line <= self.line+(self.max_y-2):
@@ -1135,6 +1492,7 @@ class Editor:
     def endfile(self):
         """ go to the end of the file """
         self.pushUndo()
+        self.workfile.waitForLine(-1)
 
         ldisp = (self.numLines(True)-1)-self.line
         if ldisp < self.max_y-2:
@@ -1190,7 +1548,6 @@ class Editor:
         if offset < 0:
             offset = 0
         self.line = offset
-        self.invalidate_screen()
 
 
     def pagedown(self):
@@ -1205,7 +1562,6 @@ class Editor:
         ldisp = (self.numLines(True)-1)-self.line
         if self.vpos > ldisp:
             self.vpos = ldisp
-        self.invalidate_screen()
 
 
     def cup(self):
@@ -1217,7 +1573,6 @@ class Editor:
             self.vpos -= 1
         elif self.line:
             self.line -= 1
-            self.invalidate_screen()
 
         self.goto(self.getLine(),self.getPos())
 
@@ -1231,7 +1586,6 @@ class Editor:
                 self.vpos += 1
             elif self.line <= self.numLines(True)-self.max_y:
                 self.line += 1
-                self.invalidate_screen()
             rept = rept - 1
 
         self.goto(self.getLine(),self.getPos())
@@ -1418,9 +1772,15 @@ class Editor:
         line,pos = self.filePos(self.line,self.left)
         self.workfile.touchLine(self.getLine(),line+self.max_y)
 
+    def view_state(self):
+        """ return the part of the editor's state that decides what is on the screen besides the file contents, the
+        cursor, focus and the flags in the status line count too """
+        return (self.scr,self.line,self.left,self.max_y,self.max_x,self.wrap,self.vpos,self.pos,self.focus,
+                self.show_cursor,keymap.is_recording(),self.workfile.isChanged(),self.workfile.isReadOnly())
+
     def has_changes(self):
-        """ return true if there are any pending changes """
-        return self.workfile.hasChanges(self)
+        """ return true if there are any pending changes, or the view or cursor has moved since the last redraw """
+        return self.workfile.hasChanges(self) or self.view_state() != self.drawn_view
 
     def mark_span(self):
         """ mark a span of characters that can start and end in the middle of a line """
@@ -1508,9 +1868,13 @@ class Editor:
                     line_idx += 1
             if delete:
                 line_idx = mark_line_start
-                while line_idx <= mark_line_end:
-                    self.workfile.deleteLine(mark_line_start)
-                    line_idx += 1
+                self.workfile.change_mgr.start_batch()
+                try:
+                    while line_idx <= mark_line_end:
+                        self.workfile.deleteLine(mark_line_start)
+                        line_idx += 1
+                finally:
+                    self.workfile.change_mgr.end_batch()
                 self.rewrap()
         elif self.span_mark:
             if not nocopy:
@@ -1534,10 +1898,14 @@ class Editor:
                 else:
                     first_line = self.getContent(mark_line_start)
                     last_line = self.getContent(mark_line_end)
-                    while line_idx <= mark_line_end:
-                        self.workfile.deleteLine(mark_line_start)
-                        line_idx += 1
-                    self.workfile.insertLine(mark_line_start,first_line[0:mark_pos_start] + last_line[mark_pos_end+1:])
+                    self.workfile.change_mgr.start_batch()
+                    try:
+                        while line_idx <= mark_line_end:
+                            self.workfile.deleteLine(mark_line_start)
+                            line_idx += 1
+                        self.workfile.insertLine(mark_line_start,first_line[0:mark_pos_start] + last_line[mark_pos_end+1:])
+                    finally:
+                        self.workfile.change_mgr.end_batch()
                     self.rewrap()
         elif self.rect_mark:
             if not nocopy:
@@ -1596,9 +1964,13 @@ class Editor:
             if clipboard.clip_type == clipboard.LINE_CLIP:
                 target = self.getLine()
                 pos = self.getPos()
-                for line in clipboard.clip:
-                    self.workfile.insertLine(target,line)
-                    target += 1
+                self.workfile.change_mgr.start_batch()
+                try:
+                    for line in clipboard.clip:
+                        self.workfile.insertLine(target,line)
+                        target += 1
+                finally:
+                    self.workfile.change_mgr.end_batch()
                 self.rewrap()
                 self.goto(target,pos)
             elif clipboard.clip_type == clipboard.SPAN_CLIP:
@@ -1744,7 +2116,6 @@ class Editor:
                 self.redraw()
                 return
         self.workfile.save()
-        self.undo_mgr.flush_undo()
         self.goto(self.getLine(),self.getPos())
         self.invalidate_all()
         self.redraw()
@@ -1990,19 +2361,32 @@ class Editor:
                 else:
                     self.mode = None
 
-            self.redraw()
+            # while there are keys waiting skip the redraw so a burst of input is drawn once
+            if not keymap.keypending(self.scr):
+                self.redraw()
 
             if start_ch:
                 ch = start_ch
                 start_ch = None
             else:
+                if blocking:
+                    keymap.wait_for_input(self.scr)
                 ch = keymap.getch(self.scr)
             try:
                 self.undo_mgr.new_transaction()
                 if self.mode:
                     ch = self.mode.handle(self,ch)
                 modref = self.workfile.getModref()
-                ret_seq = self.handle(ch)
+                # printable keys queued up behind this one are inserted together in one transaction, only when
+                # they would have been inserted one at a time by Editor.handle, subclasses see every key
+                run = None
+                if (type(self).handle is Editor.handle and not self.workfile.isReadOnly() and
+                    not extension_manager.is_extension(cmd_names.CMD_INSERT)):
+                    run = keymap.get_typeahead(self.scr,ch)
+                if run:
+                    ret_seq = self.insert_run(run)
+                else:
+                    ret_seq = self.handle(ch)
                 if self.wrap and modref != self.workfile.getModref():
                     self.rewrap()
                 if ret_seq or not blocking:
@@ -2061,6 +2445,7 @@ class StreamThread:
                 lidx += 1
             finally:
                 self.ef.lines_lock.release()
+                keymap.wakeup()
                 time.sleep( 0 )
 
         try:
@@ -2080,6 +2465,64 @@ class StreamThread:
             self.stream = None
         self.thread = None
         self.read_worker_stop = False
+        keymap.wakeup()
+
+class IndexThread:
+    """ Thread to find the line offsets in the rest of a large working file a block at a time, the owning EditFile merges
+    the blocks of offsets as they become available """
+    def __init__(self, working, pos, block_size ):
+        self.working = working
+        self.pos = pos
+        self.block_size = block_size
+        self.pending = collections.deque()
+        self.done = False
+        self.cond = threading.Condition()
+        self.thread = None
+        self.index_worker_stop = False
+
+    def start_index( self ):
+        self.thread = threading.Thread(target = self.index_worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wait( self ):
+        """ wait for the next block of offsets or for indexing to finish """
+        self.cond.acquire()
+        try:
+            if not self.pending and not self.done:
+                self.cond.wait()
+        finally:
+            self.cond.release()
+
+    def stop_index( self ):
+        self.index_worker_stop = True
+        if self.thread and self.thread.is_alive():
+            self.thread.join()
+        self.thread = None
+        self.working = None
+
+    def index_worker( self ):
+        working = self.working
+        size = len(working)
+        pos = self.pos
+        limit = pos
+        while pos < size and not self.index_worker_stop:
+            limit = min(size,limit+self.block_size)
+            offsets, pos = scan_lines(working,pos,limit)
+            if len(offsets):
+                self.cond.acquire()
+                try:
+                    self.pending.append(offsets)
+                    self.cond.notify_all()
+                finally:
+                    self.cond.release()
+                keymap.wakeup()
+        self.cond.acquire()
+        try:
+            self.done = True
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
 
 class StreamFile(EditFile):
     """ Class reads a stream to the end and writes it to a temp file which
@@ -2098,6 +2541,7 @@ class StreamFile(EditFile):
         self.backuproot = EditFile.default_backuproot
         # set the default tab stops
         self.tabs = [ 4, 8 ]
+        self.tab_stops = tab_stops.get_tab_stops(self.tabs)
         # set the changed flag to false
         self.changed = False
         # read only flag
@@ -2110,8 +2554,20 @@ class StreamFile(EditFile):
         self.modref = 0
         # the file object
         self.working = None
+        # modification time of the file on disk when we opened it
+        self.mtime = None
+        # the file the working map was made from, kept open to copy ranges from when saving
+        self.working_file = None
+        # the line ending used by the file
+        self.newline = "\n"
+        # bytes copied and bytes encoded by the last save
+        self.save_stats = (0,0)
+        # background thread indexing the rest of a large file
+        self.indexer = None
+        # cache of expanded line content
+        self.line_cache = line_cache.LineCache()
         # the lines in this file
-        self.lines = []
+        self.lines = EditFile.default_line_buffer(self)
         # load the file
         self.load()
 
@@ -2174,6 +2630,13 @@ class StreamFile(EditFile):
             if self.isReadOnly():
                 raise ReadOnlyError()
 
+    def snapshot(self, view = None):
+        try:
+            self.lines_lock.acquire()
+            return EditFile.snapshot(self,view)
+        finally:
+            self.lines_lock.release()
+
     def set_tabs(self, tabs):
         try:
             self.lines_lock.acquire()
@@ -2251,10 +2714,9 @@ class StreamEditor(Editor):
         result.last_search = self.last_search
         result.last_search_dir = self.last_search_dir
         result.mode = self.mode
-        result.wrap_lines = copy.copy(self.wrap_lines)
-        result.unwrap_lines = copy.copy(self.unwrap_lines)
-        result.wrap_modref = self.wrap_modref
-        result.wrap_width = self.wrap_width
+        result.wrap_index = None
+        result.wrap_modref = -1
+        result.wrap_width = -1
         result.show_cursor = self.show_cursor
         result.focus = self.focus
         result.prev_pos = copy.copy(self.prev_pos)
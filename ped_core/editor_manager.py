@@ -75,7 +75,8 @@ class BaseFrame:
             self.win = None
 
     def redraw(self,force=True):
-        """ redraw the frame updating the frame and the embedded editor as needed, force == True causes full redraw """
+        """ redraw the frame updating the frame and the embedded editor as needed, force == True causes full redraw,
+        returns True if anything was drawn, windows are only staged with noutrefresh the caller does the doupdate """
         if self.changed or force:
             if self.lborder:
                 off = 0
@@ -86,6 +87,8 @@ class BaseFrame:
                         pass
                     off += 1
             self.changed = False
+            return True
+        return False
 
 
     def setlborder( self, flag ):
@@ -136,16 +139,20 @@ class EditorFrame ( BaseFrame ):
 
     def redraw(self,force=True):
         """ redraw the frame updating the frame and the embedded editor as needed, force == True causes full redraw """
-        BaseFrame.redraw( self, force )
+        drawn = BaseFrame.redraw( self, force )
         if self.editor:
             self.editor.setWin(self.win)
-            if self.editor.has_changes() or force:
+            # a frame that was drawn again needs its editor drawn over it
+            if self.editor.has_changes() or force or drawn:
                 if force:
                     self.editor.invalidate_screen()
+                    self.editor.invalidate_shadow()
                 self.editor.redraw()
                 self.win.leaveok(1)
-                self.win.refresh()
+                self.win.noutrefresh()
                 self.win.leaveok(0)
+                return True
+        return drawn
 
     def resize(self,x,y,width,height):
         """ resizes the window, and adjusts the size of the embedded editor """
@@ -180,13 +187,14 @@ class DialogFrame ( BaseFrame ):
 
     def redraw(self,force=True):
         """ redraw the frame updating the frame and the embedded editor as needed, force == True causes full redraw """
-        BaseFrame.redraw( self, force )
-        if self.dialog:
+        drawn = BaseFrame.redraw( self, force )
+        if self.dialog and drawn:
             self.dialog.setparent(self.win)
             self.dialog.render()
             self.win.leaveok(1)
-            self.win.refresh()
+            self.win.noutrefresh()
             self.win.leaveok(0)
+        return drawn
 
     def resize(self,x,y,width,height):
         """ resizes the window, and adjusts the size of the embedded editor """
@@ -202,6 +210,9 @@ class DialogFrame ( BaseFrame ):
 
 class EditorManager:
     """ class manages a collection of editors and editor frames that tile the full terminal service """
+    # least number of seconds between redraws while there are keys waiting to be handled
+    pending_redraw_interval = 0.05
+
     def __init__(self,scr):
         """ constructed with scr == curses screen or window object to manage within """
         (self.max_y,self.max_x) = scr.getmaxyx()
@@ -210,6 +221,7 @@ class EditorManager:
         self.current = 0
         self.current_frame = 0
         self.scr = scr
+        self.last_redraw = 0
 
     def __del__(self):
         if self.editors:
@@ -581,17 +593,30 @@ class EditorManager:
             return
 
     def redraw(self, force = False):
-        """ redraw the editor manager and all the subframes, do minimal updates unless force is True """
+        """ redraw the editor manager and all the subframes, do minimal updates unless force is True, frames with
+        nothing to draw are skipped and the ones that are drawn go out to the terminal together in one doupdate """
+        self.last_redraw = time.time()
+        drawn = force
         for f in self.frames:
             if isinstance(f,EditorFrame):
                 new_cursor_state = (f == self.frames[self.current_frame])
                 old_cursor_state = f.editor.showcursor(new_cursor_state)
                 f.editor.setfocus(new_cursor_state)
                 force = force or (old_cursor_state != new_cursor_state)
-            f.redraw(force)
-        self.scr.leaveok(1)
-        self.scr.refresh()
-        self.scr.leaveok(0)
+            if f.redraw(force):
+                drawn = True
+        if drawn:
+            self.scr.leaveok(1)
+            self.scr.noutrefresh()
+            self.scr.leaveok(0)
+            curses.doupdate()
+
+    def redraw_due(self):
+        """ true if it is time to redraw, while there are keys waiting redraws are held off for pending_redraw_interval
+        so a burst of input is drawn once but something still shows up when a key is held down """
+        if not keymap.keypending(self.scr):
+            return True
+        return time.time() - self.last_redraw >= EditorManager.pending_redraw_interval
 
 
     def main(self,blocking = True):
@@ -603,7 +628,11 @@ class EditorManager:
         self.scr.keypad(1)
 
         while len(self.editors):
-            self.redraw(force)
+            if force or self.redraw_due():
+                self.redraw(force)
+            if blocking:
+                # sleep until there is a key or another thread has something to show
+                keymap.wait_for_input(self.scr)
 #            if force:
 #                self.scr.noutrefresh()
 #            force = True
@@ -620,6 +649,7 @@ class EditorManager:
             else:
                 # run the dialog non blocking mode to have it process keystrokes returns unhandled ones
                 (seq, values) = self.frames[self.current_frame].dialog.main(False)
+                self.frames[self.current_frame].changed = True
                 cmd_id, seq = keymap.mapseq(keymap.keymap_manager,seq)
             if extension_manager.is_extension(cmd_id):
                 if not extension_manager.invoke_extension( cmd_id, self, seq ):
@@ -3,11 +3,8 @@
 from ped_core import editor_common
 from ped_dialog.message_dialog import message
 import re
-from pygments.lexers import get_lexer_for_filename
 from pygments.token import Token
-from ped_core.mode import Tokens, render
-
-lexer = None
+from ped_core.mode import Tokens, render, TokenAttrs, detect_lexer
 
 def get_tabs(editor):
     """ return the tab stops for this type of file """
@@ -15,18 +12,20 @@ def get_tabs(editor):
 
 def detect_mode(editor):
     """ hook called to detect if this mode should be used for a file, returns True if it should be used, False otherwise """
-    workfile = editor.getWorkfile()
-    global lexer
-    try:
-        filename = workfile.getFilename()
-        if filename:
-            lexer = get_lexer_for_filename(filename,{})
-        else:
-            lexer = get_lexer_for_filename("unknown.txt",{})
-        return True
-    except Exception as e:
-        lexer = get_lexer_for_filename("unknown.txt",{})
-        return True
+    return True
+
+def get_tokens(workfile):
+    """ return the tokens for this file, the lexer is picked when they are made so it is only looked up again
+    when the file gets a new name """
+    filename = workfile.getFilename()
+    tokens = getattr(workfile,"guess_mode_tokens",None)
+    if tokens:
+        if tokens.getKey() == filename:
+            return tokens
+        tokens.detach(workfile)
+    tokens = Tokens(detect_lexer(filename,workfile.getLine(0)),filename)
+    setattr(workfile,"guess_mode_tokens",tokens)
+    return tokens
 
 def handle(editor,ch):
     """ hook called for each keystroke, can be used for auto-indent or auto-complete """
@@ -38,38 +37,30 @@ def finish(editor):
     wf = editor.getWorkfile()
     if wf:
         if hasattr(wf,"guess_mode_tokens"):
+            wf.guess_mode_tokens.detach(wf)
             del wf.guess_mode_tokens
             wf.guess_mode_tokens = None
             delattr(wf,"guess_mode_tokens")
 
+token_attrs = TokenAttrs([Token.Name.Tag,Token.Name.Decorator,Token.Keyword.Declaration,Token.Operator.Word,Token.Name.Builtin.Pseudo,Token.Keyword,Token.Keyword.Namespace],
+                         [Token.Text,Token.String,Token.Literal.String,Token.Literal.String.Single,Token.Literal.String.Double,Token.Literal.String.Doc],
+                         [Token.Comment,Token.Comment.Hashbang,Token.Comment.Multiline,Token.Comment.Single])
+
 def redraw(editor):
     """ redraw the colorization based on the current token set, regenerate it if needed """
-    workfile = editor.getWorkfile()
-
-    if hasattr(workfile,"guess_mode_tokens"):
-        tokens = workfile.guess_mode_tokens
-    else:
-        tokens = Tokens()
-        setattr(workfile,"guess_mode_tokens",tokens)
+    tokens = get_tokens(editor.getWorkfile())
 
     if not tokens:
         return False
 
-    if not tokens.getTokens() or tokens.getModref() != workfile.getModref():
-        detect_mode(editor)
-        tokens.refresh(editor,lexer)
+    if not tokens.ready(editor):
+        tokens.refresh(editor)
         return False
 
-    render(editor,tokens,
-            [Token.Name.Tag,Token.Name.Decorator,Token.Keyword.Declaration,Token.Operator.Word,Token.Name.Builtin.Pseudo,Token.Keyword,Token.Keyword.Namespace],
-            [Token.Text,Token.String,Token.Literal.String,Token.Literal.String.Single,Token.Literal.String.Double,Token.Literal.String.Doc],
-            [Token.Comment,Token.Comment.Hashbang,Token.Comment.Multiline,Token.Comment.Single])
+    render(editor,tokens,token_attrs)
 
     return True
 
-def name():
-    """ hook to return this mode's human readable name """
-    if lexer:
-        return lexer.name
-    else:
-        return ""
+def name(editor):
+    """ hook to return this mode's human readable name, the name of the lexer for the editor's file """
+    return get_tokens(editor.getWorkfile()).getLexer().name
@@ -5,7 +5,7 @@ from ped_dialog.message_dialog import message
 import re
 from pygments.lexers import JavaLexer
 from pygments.token import Token
-from ped_core.mode import Tokens, render
+from ped_core.mode import Tokens, render, TokenAttrs, get_lexer
 
 def get_tabs(editor):
     """ return the tab stops for this type of file """
@@ -61,10 +61,15 @@ def finish(editor):
     wf = editor.getWorkfile()
     if wf:
         if hasattr(wf,"java_mode_tokens"):
+            wf.java_mode_tokens.detach(wf)
             del wf.java_mode_tokens
             wf.java_mode_tokens = None
             delattr(wf,"java_mode_tokens")
 
+token_attrs = TokenAttrs([Token.Name.Decorator,Token.Keyword,Token.Operator.Word,Token.Name.Builtin.Pseudo],
+                         [Token.Text,Token.String,Token.Literal],
+                         [Token.Comment])
+
 def redraw(editor):
     """ redraw the colorization based on the current token set, regenerate it if needed """
     workfile = editor.getWorkfile()
@@ -78,16 +83,13 @@ def redraw(editor):
     if not tokens:
         return False
 
-    if not tokens.getTokens() or tokens.getModref() != workfile.getModref():
-        tokens.refresh(editor,JavaLexer())
+    if not tokens.ready(editor):
+        tokens.refresh(editor,get_lexer(JavaLexer))
         return False
 
-    render( editor, tokens,
-            [Token.Name.Decorator,Token.Keyword,Token.Operator.Word,Token.Name.Builtin.Pseudo],
-            [Token.Text,Token.String,Token.Literal],
-            [Token.Comment])
+    render( editor, tokens, token_attrs )
     return True
 
-def name():
+def name(editor = None):
     """ hook to return this mode's human readable name """
     return "java_mode"
@@ -8,6 +8,8 @@ from ped_core import cmd_names
 from ped_core import keytab
 import pprint
 import time
+import select
+import signal
 
 # default keymap for the editor manager
 keymap_manager = {
@@ -110,6 +112,13 @@ playback = False
 macro = []
 macro_idx = 0
 keydef_map = {}
+# pipe that other threads write to to wake up the main loop
+wake_pipe = None
+wake_pending = False
+# set by the SIGWINCH handler, the terminal size is picked up in the main loop
+resized = False
+# most typed ahead characters that are applied as one run
+typeahead_limit = 65536
 
 def insert_keydef( km, oseq, kt ):
     """ insert into the keydef_map an ordinal sequence and a keytab key to map it to """
@@ -193,22 +202,85 @@ def is_playback():
     return playback
 
 def keypending( scr ):
-    """ return true if getch is going to return a real key """
+    """ return true if getch is going to return a real key, never blocks, scr is left in nodelay mode since all of
+    the key reads go through getch and the waiting is done in wait_for_input """
+    scr.nodelay(1)
     ch = scr.getch()
     if ch >= 0:
         curses.ungetch(ch)
     return (ch >= 0)
 
 def getch( scr ):
-    """ wrapper to fetch keys from a curses screen or window """
+    """ wrapper to fetch keys from a curses screen or window, never blocks use wait_for_input to wait for keys """
     global playback
     if playback:
         return 0
     else:
-        time.sleep(0.01)
         ch = scr.getch()
         return ch
 
+def on_resize( signum, frame ):
+    """ SIGWINCH handler, note the resize and wake up the main loop """
+    global resized
+    resized = True
+    wakeup()
+
+def open_wake_pipe():
+    """ create the wakeup pipe and take over SIGWINCH so a resize wakes the main loop """
+    global wake_pipe
+    if not wake_pipe:
+        wake_pipe = os.pipe()
+        os.set_blocking(wake_pipe[0],False)
+        os.set_blocking(wake_pipe[1],False)
+        try:
+            signal.signal(signal.SIGWINCH,on_resize)
+        except (ValueError,AttributeError):
+            pass
+    return wake_pipe
+
+def wakeup():
+    """ wake up the main loop if it is waiting for input, called from other threads when they have something
+    to show, only one wakeup is outstanding at a time """
+    global wake_pending
+    if wake_pipe and not wake_pending:
+        wake_pending = True
+        try:
+            os.write(wake_pipe[1],b"w")
+        except OSError:
+            pass
+
+def wait_for_input( scr, timeout = None ):
+    """ block until there is a key to read from the terminal or wakeup is called, returns right away if a key
+    is already buffered or a macro is playing back, timeout is in seconds, None waits forever """
+    global wake_pending, resized
+    if playback or keypending( scr ):
+        return
+    wake_r, wake_w = open_wake_pipe()
+    try:
+        tty = sys.__stdin__.fileno()
+    except (AttributeError,ValueError,OSError):
+        tty = 0
+    if not resized:
+        try:
+            select.select([tty,wake_r],[],[],timeout)
+        except (OSError,ValueError):
+            pass
+    # drain before clearing the flag so a wakeup that comes in meanwhile is either read here or written again
+    try:
+        while os.read(wake_r,512):
+            pass
+    except OSError:
+        pass
+    wake_pending = False
+    if resized:
+        resized = False
+        try:
+            cols, lines = os.get_terminal_size(tty)
+            # resizeterm queues a KEY_RESIZE for the main loop to handle
+            curses.resizeterm(lines,cols)
+        except (OSError,curses.error):
+            pass
+
 def get_keyseq( scr, ch ):
     """ get the full key sequence to be mapped, parameter is the first key of the sequence """
     global playback, recording
@@ -216,7 +288,7 @@ def get_keyseq( scr, ch ):
     if playback:
         return playback_seq()
 
-    if 0<ch<256 and curses.ascii.isprint(ch):
+    if is_printable(ch):
         seq = chr(ch)
     else:
         map = keydef_map
@@ -240,6 +312,37 @@ def get_keyseq( scr, ch ):
 
     return seq
 
+def is_printable( ch ):
+    """ true if the raw key ch is a printable character that just gets inserted """
+    return isinstance(ch,int) and 0<ch<256 and curses.ascii.isprint(ch)
+
+def get_typeahead( scr, ch ):
+    """ if ch is a printable key and more printable keys are queued up behind it, as when text is pasted or a key
+    is held down, return them all as one string, the first key that isn't printable is pushed back for the next
+    getch, returns None if there is no run or a macro is playing back """
+    global playback, recording
+
+    if playback or not is_printable(ch):
+        return None
+
+    run = [chr(ch)]
+    while len(run) < typeahead_limit:
+        ch = scr.getch()
+        if not is_printable(ch):
+            if ch >= 0:
+                curses.ungetch(ch)
+            break
+        run.append(chr(ch))
+
+    if len(run) == 1:
+        return None
+
+    if recording:
+        for c in run:
+            record_seq( c )
+
+    return "".join(run)
+
 def mapkey( scr, keymap_xlate, ch ):
     """ complete fetching the key sequence and get the command and return character as a tuple (cmd_id, retkey) """
     seq = get_keyseq( scr, ch )
@@ -0,0 +1,595 @@
+# Copyright 2009 James P Goodwin ped tiny python editor
+""" module that implements the line storage for an EditFile, unchanged lines are kept as offsets into the working file """
+from array import array
+from itertools import accumulate, chain
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def scan_lines( data, pos, limit ):
+    """ scan data, a bytes like object, for line starts beginning at pos and return an array('q') of the offsets of
+    each line whose newline is before limit and the offset of the first line not yet returned, a line running to the
+    end of the data is only returned when limit reaches the end, the newlines in the block are found in bulk """
+    offsets = array('q')
+    size = len(data)
+    if pos >= size:
+        return (offsets, pos)
+    last = data.rfind(b"\n",pos,limit)
+    if last >= 0:
+        if numpy:
+            ends = numpy.flatnonzero(numpy.frombuffer(data,dtype=numpy.uint8,count=last+1-pos,offset=pos) == 10)
+            starts = numpy.empty(len(ends),dtype=numpy.int64)
+            starts[0] = pos
+            starts[1:] = ends[:-1] + (pos+1)
+            offsets.frombytes(starts.tobytes())
+        else:
+            offsets.extend(accumulate(chain([pos],[len(l)+1 for l in data[pos:last].split(b"\n")[:-1]])))
+        pos = last + 1
+    if limit >= size and pos < size:
+        offsets.append(pos)
+        pos = size
+    return (offsets, pos)
+
+class EditLine:
+    """ Interface for each editable line in a file, a fly-weight object """
+    def __init__(self):
+        """ should initialize any content or references to external objects """
+        pass
+
+    def length(self):
+        """ return the length of the line """
+        pass
+
+    def flush(self):
+        """ flush cached length if you have one """
+        pass
+
+    def getContent(self):
+        """ should return line representing this line in the source file """
+        pass
+
+class FileLine(EditLine):
+    """ Instance of a line in a file that hasn't been changed, stored on disk, these are only created on demand by the line buffer """
+    def __init__(self, parent, pos, len = -1 ):
+        """ FileLine(s) are pointers to a line on disk the EditFile reference and offset are stored, the line runs from pos to the next newline """
+        EditLine.__init__(self)
+        self.parent = parent
+        self.pos = pos
+        self.len = len
+
+    def length(self):
+        """ return length of line """
+        if self.len < 0:
+            self.len = len(self.parent.expand_tabs(self.getContent()))
+        return self.len
+
+    def flush(self):
+        """ flush cached length """
+        self.len = -1
+
+    def getContent(self):
+        """ gets the line from its parent's working file at our offset and returns it """
+        return self.parent.readLine(self.pos)
+
+class MemLine(EditLine):
+    """ Instance of a line in memory that has been edited """
+    def __init__(self, content ):
+        """ MemLine(s) are in memory strings that represent a line that has been edited, it is initialized from the original file content"""
+        EditLine.__init__(self)
+        self.content = content
+
+    def length(self):
+        """ return the length of the content """
+        return len(self.content)
+
+    def flush(self):
+        """ flush cached length """
+        pass
+
+    def getContent(self):
+        """ just return the string reference """
+        return self.content
+
+class LineBuffer:
+    """ Interface for the storage of the lines of an EditFile, it behaves like a list of EditLine objects """
+    def __init__(self, parent):
+        """ parent is the EditFile that owns the working file the lines point into """
+        self.parent = parent
+
+    def __len__(self):
+        """ return the number of lines """
+        pass
+
+    def __getitem__(self, idx):
+        """ return an EditLine for line idx """
+        pass
+
+    def __setitem__(self, idx, lineObj):
+        """ replace line idx with an EditLine """
+        pass
+
+    def __delitem__(self, idx):
+        """ delete line idx """
+        pass
+
+    def __iter__(self):
+        """ iterate over the lines as EditLine objects """
+        for idx in range(0,len(self)):
+            yield self[idx]
+
+    def insert(self, idx, lineObj):
+        """ insert an EditLine before line idx """
+        pass
+
+    def append(self, lineObj):
+        """ add an EditLine to the end """
+        self.insert(len(self),lineObj)
+
+    def append_offsets(self, offsets):
+        """ add unchanged lines to the end given an array of their offsets in the working file """
+        for pos in offsets:
+            self.append(FileLine(self.parent,pos))
+
+    def getContent(self, idx):
+        """ return the content of line idx without creating a line object """
+        return self[idx].getContent()
+
+    def length(self, idx):
+        """ return the expanded length of line idx """
+        return self[idx].length()
+
+    def identity(self, idx):
+        """ return a key for line idx that stays the same while the line is unchanged even if lines are inserted or deleted before it """
+        pass
+
+    def blocks(self):
+        """ yield tuples of an array of the identities of the lines and a dictionary of the edited lines in that array keyed by
+        minus their identity, covering all of the lines in order, offsets of unchanged lines are >= 0 """
+        pass
+
+    def flush(self):
+        """ forget all of the cached lengths, used when the tab stops change """
+        for l in self:
+            l.flush()
+
+    def copy(self, parent):
+        """ return a copy of this buffer that reads through a different EditFile """
+        pass
+
+    def snapshot(self, parent):
+        """ return a read only view of the lines as they are now that reads through a different EditFile, later changes
+        to this buffer don't show up in the snapshot """
+        return self.copy(parent)
+
+class ArrayLineBuffer(LineBuffer):
+    """ Line buffer that keeps unchanged lines as parallel arrays of working file offsets and cached lengths,
+    edited lines are kept in a sparse overlay and are marked in the offset array with a negative key """
+    def __init__(self, parent, offsets = None):
+        """ parent is the owning EditFile, offsets is an optional array('q') of line offsets in the working file """
+        LineBuffer.__init__(self, parent)
+        if offsets == None:
+            offsets = array('q')
+        self.offsets = offsets
+        self.lengths = array('i',[-1])*len(offsets)
+        self.mem = {}
+        self.mem_key = 0
+        self.shared = False
+
+    def _own(self):
+        """ copy the arrays if they are shared with a snapshot before we change them """
+        if self.shared:
+            self.offsets = array('q',self.offsets)
+            self.lengths = array('i',self.lengths)
+            self.mem = dict(self.mem)
+            self.shared = False
+
+    def _key(self, lineObj):
+        """ store an edited line in the overlay and return the negative key that marks it """
+        self.mem_key += 1
+        self.mem[self.mem_key] = lineObj
+        return -self.mem_key
+
+    def _index(self, idx):
+        """ normalize a possibly negative index """
+        if idx < 0:
+            idx += len(self.offsets)
+        if idx < 0 or idx >= len(self.offsets):
+            raise IndexError("line index out of range")
+        return idx
+
+    def __len__(self):
+        """ return the number of lines """
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        """ return an EditLine for line idx, unchanged lines are returned as a new FileLine """
+        idx = self._index(idx)
+        pos = self.offsets[idx]
+        if pos < 0:
+            return self.mem[-pos]
+        return FileLine(self.parent,pos,self.lengths[idx])
+
+    def __setitem__(self, idx, lineObj):
+        """ replace line idx with an EditLine """
+        idx = self._index(idx)
+        self._own()
+        pos = self.offsets[idx]
+        if pos < 0:
+            del self.mem[-pos]
+        if isinstance(lineObj,FileLine):
+            self.offsets[idx] = lineObj.pos
+            self.lengths[idx] = lineObj.len
+        else:
+            self.offsets[idx] = self._key(lineObj)
+            self.lengths[idx] = -1
+
+    def __delitem__(self, idx):
+        """ delete line idx """
+        idx = self._index(idx)
+        self._own()
+        pos = self.offsets[idx]
+        if pos < 0:
+            del self.mem[-pos]
+        del self.offsets[idx]
+        del self.lengths[idx]
+
+    def insert(self, idx, lineObj):
+        """ insert an EditLine before line idx """
+        self._own()
+        if isinstance(lineObj,FileLine):
+            self.offsets.insert(idx,lineObj.pos)
+            self.lengths.insert(idx,lineObj.len)
+        else:
+            self.offsets.insert(idx,self._key(lineObj))
+            self.lengths.insert(idx,-1)
+
+    def append_offsets(self, offsets):
+        """ add unchanged lines to the end given an array of their offsets in the working file """
+        self._own()
+        self.lengths.extend(array('i',[-1])*len(offsets))
+        self.offsets.extend(offsets)
+
+    def identity(self, idx):
+        """ return the working file offset of an unchanged line or the negative overlay key of an edited one """
+        return self.offsets[idx]
+
+    def blocks(self):
+        """ yield tuples of an array of the identities of the lines and a dictionary of the edited lines in that array keyed by
+        minus their identity, covering all of the lines in order, offsets of unchanged lines are >= 0 """
+        for start in range(0,len(self.offsets),1024):
+            yield (self.offsets[start:start+1024], self.mem)
+
+    def getContent(self, idx):
+        """ return the content of line idx without creating a line object """
+        pos = self.offsets[idx]
+        if pos < 0:
+            return self.mem[-pos].getContent()
+        return self.parent.readLine(pos)
+
+    def length(self, idx):
+        """ return the expanded length of line idx, computing and caching it if needed """
+        pos = self.offsets[idx]
+        if pos < 0:
+            return self.mem[-pos].length()
+        length = self.lengths[idx]
+        if length < 0:
+            length = len(self.parent.expand_tabs(self.parent.readLine(pos)))
+            self.lengths[idx] = length
+        return length
+
+    def flush(self):
+        """ forget all of the cached lengths, used when the tab stops change """
+        self._own()
+        self.lengths = array('i',[-1])*len(self.offsets)
+
+    def copy(self, parent):
+        """ return a copy of this buffer that reads through a different EditFile """
+        result = ArrayLineBuffer(parent,array('q',self.offsets))
+        result.lengths = array('i',self.lengths)
+        result.mem = dict(self.mem)
+        result.mem_key = self.mem_key
+        return result
+
+    def snapshot(self, parent):
+        """ return a read only view of the lines as they are now, the arrays are shared until either side changes them
+        so taking the snapshot is O(1) and the first change after it copies the arrays """
+        result = ArrayLineBuffer(parent)
+        result.offsets = self.offsets
+        result.lengths = self.lengths
+        result.mem = self.mem
+        result.mem_key = self.mem_key
+        result.shared = True
+        self.shared = True
+        return result
+
+class LineChunk:
+    """ a run of consecutive lines in a RopeLineBuffer, offsets and cached lengths are parallel arrays like in ArrayLineBuffer,
+    the edited lines in the chunk are kept in mem, owner is the token of the buffer allowed to change the chunk in place """
+    __slots__ = ("offsets","lengths","mem","owner")
+    def __init__(self, owner, offsets = None, lengths = None, mem = None):
+        """ offsets is an array('q') of line offsets or negative overlay keys, lengths is the matching array('i') of cached lengths """
+        if offsets == None:
+            offsets = array('q')
+        if lengths == None:
+            lengths = array('i',[-1])*len(offsets)
+        if mem == None:
+            mem = {}
+        self.offsets = offsets
+        self.lengths = lengths
+        self.mem = mem
+        self.owner = owner
+
+class RopeLineBuffer(LineBuffer):
+    """ Line buffer that keeps lines in a list of bounded size chunks indexed by a Fenwick tree of the chunk sizes,
+    so finding, inserting or deleting a line only touches one chunk and costs O(log n) in the number of lines,
+    a chunk that grows to twice chunk_size is split and one that shrinks below half of it is merged with a
+    neighbour, snapshots share the chunks and a chunk is only copied when it is first changed after a snapshot """
+    chunk_size = 512
+
+    def __init__(self, parent, offsets = None):
+        """ parent is the owning EditFile, offsets is an optional array('q') of line offsets in the working file """
+        LineBuffer.__init__(self, parent)
+        self.chunks = []
+        self.tree = array('q',[0])
+        self.count = 0
+        self.mem_key = 0
+        self.owner = object()
+        self.shared = False
+        if offsets != None:
+            self.append_offsets(offsets)
+
+    def _own(self):
+        """ copy the chunk list and the tree if they are shared with a snapshot before we change them """
+        if self.shared:
+            self.chunks = list(self.chunks)
+            self.tree = array('q',self.tree)
+            self.shared = False
+
+    def _own_chunk(self, cidx):
+        """ return chunk cidx for changing, copying it first if it belongs to a snapshot """
+        self._own()
+        chunk = self.chunks[cidx]
+        if chunk.owner is not self.owner:
+            chunk = LineChunk(self.owner,array('q',chunk.offsets),array('i',chunk.lengths),dict(chunk.mem))
+            self.chunks[cidx] = chunk
+        return chunk
+
+    def _key(self, chunk, lineObj):
+        """ store an edited line in the chunk's overlay and return the negative key that marks it """
+        self.mem_key += 1
+        chunk.mem[self.mem_key] = lineObj
+        return -self.mem_key
+
+    def _rebuild(self, cidx = 0):
+        """ rebuild the Fenwick tree of chunk sizes from chunk cidx on after chunks have been split, merged, added or
+        removed there, the nodes before it only sum chunks before it so they are kept """
+        nchunks = len(self.chunks)
+        tree = self.tree
+        del tree[cidx+1:]
+        tree.extend(array('q',[len(chunk.offsets) for chunk in self.chunks[cidx:]]))
+        # the kept nodes that sum into the rebuilt ones are the ones a prefix sum of the first cidx chunks reads
+        node = cidx
+        while node:
+            parent = node + (node & -node)
+            if parent <= nchunks:
+                tree[parent] += tree[node]
+            node -= node & -node
+        for node in range(cidx+1,nchunks+1):
+            parent = node + (node & -node)
+            if parent <= nchunks:
+                tree[parent] += tree[node]
+
+    def _merge(self, cidx):
+        """ merge chunk cidx into a neighbour if they fit in one chunk, returns True if they were merged """
+        size = len(self.chunks[cidx].offsets)
+        for other in [cidx-1,cidx+1]:
+            if other >= 0 and other < len(self.chunks) and size + len(self.chunks[other].offsets) < self.chunk_size*2:
+                first = min(cidx,other)
+                chunk = self._own_chunk(first)
+                source = self.chunks[first+1]
+                chunk.offsets.extend(source.offsets)
+                chunk.lengths.extend(source.lengths)
+                chunk.mem.update(source.mem)
+                del self.chunks[first+1]
+                self._rebuild(first)
+                return True
+        return False
+
+    def _add(self, cidx, delta):
+        """ adjust the size of chunk cidx by delta in the Fenwick tree """
+        tree = self.tree
+        nchunks = len(tree)-1
+        cidx += 1
+        while cidx <= nchunks:
+            tree[cidx] += delta
+            cidx += cidx & -cidx
+
+    def _locate(self, idx):
+        """ return the chunk index and the index within the chunk for line idx """
+        tree = self.tree
+        nchunks = len(tree)-1
+        cidx = 0
+        step = 1
+        while step*2 <= nchunks:
+            step *= 2
+        while step:
+            if cidx+step <= nchunks and tree[cidx+step] <= idx:
+                cidx += step
+                idx -= tree[cidx]
+            step //= 2
+        return (cidx, idx)
+
+    def _index(self, idx):
+        """ normalize a possibly negative index and return the chunk and index within the chunk for it """
+        if idx < 0:
+            idx += self.count
+        if idx < 0 or idx >= self.count:
+            raise IndexError("line index out of range")
+        return self._locate(idx)
+
+    def __len__(self):
+        """ return the number of lines """
+        return self.count
+
+    def __getitem__(self, idx):
+        """ return an EditLine for line idx, unchanged lines are returned as a new FileLine """
+        cidx, lidx = self._index(idx)
+        chunk = self.chunks[cidx]
+        pos = chunk.offsets[lidx]
+        if pos < 0:
+            return chunk.mem[-pos]
+        return FileLine(self.parent,pos,chunk.lengths[lidx])
+
+    def __setitem__(self, idx, lineObj):
+        """ replace line idx with an EditLine """
+        cidx, lidx = self._index(idx)
+        chunk = self._own_chunk(cidx)
+        pos = chunk.offsets[lidx]
+        if pos < 0:
+            del chunk.mem[-pos]
+        if isinstance(lineObj,FileLine):
+            chunk.offsets[lidx] = lineObj.pos
+            chunk.lengths[lidx] = lineObj.len
+        else:
+            chunk.offsets[lidx] = self._key(chunk,lineObj)
+            chunk.lengths[lidx] = -1
+
+    def __delitem__(self, idx):
+        """ delete line idx, a chunk that shrinks below half of chunk_size is merged with a neighbour """
+        cidx, lidx = self._index(idx)
+        chunk = self._own_chunk(cidx)
+        pos = chunk.offsets[lidx]
+        if pos < 0:
+            del chunk.mem[-pos]
+        del chunk.offsets[lidx]
+        del chunk.lengths[lidx]
+        self.count -= 1
+        if len(chunk.offsets) >= self.chunk_size//2 or not self._merge(cidx):
+            self._add(cidx,-1)
+
+    def __iter__(self):
+        """ iterate over the lines as EditLine objects """
+        for chunk in self.chunks:
+            for lidx in range(0,len(chunk.offsets)):
+                pos = chunk.offsets[lidx]
+                if pos < 0:
+                    yield chunk.mem[-pos]
+                else:
+                    yield FileLine(self.parent,pos,chunk.lengths[lidx])
+
+    def insert(self, idx, lineObj):
+        """ insert an EditLine before line idx, a chunk that grows too big is split in half """
+        if idx < 0:
+            idx = max(0,idx+self.count)
+        self._own()
+        if not self.chunks:
+            self.chunks.append(LineChunk(self.owner))
+            self._rebuild()
+        if idx >= self.count:
+            cidx = len(self.chunks)-1
+            lidx = len(self.chunks[cidx].offsets)
+        else:
+            cidx, lidx = self._locate(idx)
+        chunk = self._own_chunk(cidx)
+        if isinstance(lineObj,FileLine):
+            chunk.offsets.insert(lidx,lineObj.pos)
+            chunk.lengths.insert(lidx,lineObj.len)
+        else:
+            chunk.offsets.insert(lidx,self._key(chunk,lineObj))
+            chunk.lengths.insert(lidx,-1)
+        self.count += 1
+        if len(chunk.offsets) >= self.chunk_size*2:
+            half = self.chunk_size
+            offsets = chunk.offsets[half:]
+            mem = {}
+            for pos in offsets:
+                if pos < 0:
+                    mem[-pos] = chunk.mem.pop(-pos)
+            self.chunks.insert(cidx+1,LineChunk(self.owner,offsets,chunk.lengths[half:],mem))
+            del chunk.offsets[half:]
+            del chunk.lengths[half:]
+            self._rebuild(cidx)
+        else:
+            self._add(cidx,1)
+
+    def append_offsets(self, offsets):
+        """ add unchanged lines to the end given an array of their offsets in the working file """
+        if not len(offsets):
+            return
+        self._own()
+        start = 0
+        cidx = max(0,len(self.chunks)-1)
+        if self.chunks:
+            start = max(0,self.chunk_size - len(self.chunks[-1].offsets))
+            if start:
+                chunk = self._own_chunk(len(self.chunks)-1)
+                chunk.lengths.extend(array('i',[-1])*len(offsets[:start]))
+                chunk.offsets.extend(offsets[:start])
+        while start < len(offsets):
+            self.chunks.append(LineChunk(self.owner,offsets[start:start+self.chunk_size]))
+            start += self.chunk_size
+        self._rebuild(cidx)
+        self.count += len(offsets)
+
+    def identity(self, idx):
+        """ return the working file offset of an unchanged line or the negative overlay key of an edited one """
+        cidx, lidx = self._index(idx)
+        return self.chunks[cidx].offsets[lidx]
+
+    def blocks(self):
+        """ yield tuples of an array of the identities of the lines and a dictionary of the edited lines in that array keyed by
+        minus their identity, covering all of the lines in order, offsets of unchanged lines are >= 0 """
+        for chunk in self.chunks:
+            yield (chunk.offsets, chunk.mem)
+
+    def getContent(self, idx):
+        """ return the content of line idx without creating a line object """
+        cidx, lidx = self._index(idx)
+        chunk = self.chunks[cidx]
+        pos = chunk.offsets[lidx]
+        if pos < 0:
+            return chunk.mem[-pos].getContent()
+        return self.parent.readLine(pos)
+
+    def length(self, idx):
+        """ return the expanded length of line idx, computing and caching it if needed """
+        cidx, lidx = self._index(idx)
+        chunk = self.chunks[cidx]
+        pos = chunk.offsets[lidx]
+        if pos < 0:
+            return chunk.mem[-pos].length()
+        length = chunk.lengths[lidx]
+        if length < 0:
+            length = len(self.parent.expand_tabs(self.parent.readLine(pos)))
+            chunk.lengths[lidx] = length
+        return length
+
+    def flush(self):
+        """ forget all of the cached lengths, used when the tab stops change """
+        self._own()
+        for cidx in range(0,len(self.chunks)):
+            chunk = self._own_chunk(cidx)
+            chunk.lengths = array('i',[-1])*len(chunk.offsets)
+
+    def copy(self, parent):
+        """ return a copy of this buffer that reads through a different EditFile """
+        result = RopeLineBuffer(parent)
+        result.chunks = [LineChunk(result.owner,array('q',c.offsets),array('i',c.lengths),dict(c.mem)) for c in self.chunks]
+        result.tree = array('q',self.tree)
+        result.count = self.count
+        result.mem_key = self.mem_key
+        return result
+
+    def snapshot(self, parent):
+        """ return a read only view of the lines as they are now in O(1), the chunk list and tree are shared and both
+        buffers give up ownership of the chunks so whichever one changes a chunk first copies it """
+        result = RopeLineBuffer(parent)
+        result.chunks = self.chunks
+        result.tree = self.tree
+        result.count = self.count
+        result.mem_key = self.mem_key
+        result.shared = True
+        self.shared = True
+        self.owner = object()
+        return result
@@ -0,0 +1,60 @@
+# Copyright 2009 James P Goodwin ped tiny python editor
+""" module that implements a bounded least recently used cache of expanded line content for an EditFile """
+import sys
+import collections
+
+class LineCache:
+    """ cache of tab expanded line content keyed by the identity of the line in its line buffer, the least recently
+    used lines are dropped when the cache grows past max_bytes, hits and misses are counted """
+    default_max_bytes = 4194304
+
+    def __init__(self, max_bytes = None ):
+        """ max_bytes is the memory cap for the cached content, defaults to LineCache.default_max_bytes """
+        if max_bytes == None:
+            max_bytes = LineCache.default_max_bytes
+        self.max_bytes = max_bytes
+        self.lines = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key ):
+        """ return the content for key or None if it isn't cached """
+        content = self.lines.get(key)
+        if content == None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.lines.move_to_end(key)
+        return content
+
+    def put(self, key, content ):
+        """ cache the content for key evicting the least recently used content if we are over the cap """
+        self.invalidate(key)
+        self.lines[key] = content
+        self.bytes += sys.getsizeof(content)
+        while self.bytes > self.max_bytes and self.lines:
+            key, content = self.lines.popitem(False)
+            self.bytes -= sys.getsizeof(content)
+
+    def invalidate(self, key ):
+        """ drop the content for key if it is cached """
+        content = self.lines.pop(key,None)
+        if content != None:
+            self.bytes -= sys.getsizeof(content)
+
+    def clear(self):
+        """ drop all of the cached content, the counters are kept """
+        self.lines.clear()
+        self.bytes = 0
+
+    def set_max_bytes(self, max_bytes ):
+        """ change the memory cap, evicting content if needed """
+        self.max_bytes = max_bytes
+        while self.bytes > self.max_bytes and self.lines:
+            key, content = self.lines.popitem(False)
+            self.bytes -= sys.getsizeof(content)
+
+    def stats(self):
+        """ return a tuple of (hits, misses, number of lines, bytes) """
+        return (self.hits, self.misses, len(self.lines), self.bytes)
@@ -4,20 +4,50 @@ import threading
 import copy
 import curses
 import os
+import re
+import sys
+import bisect
+import heapq
+import inspect
+import gc
+import logging
+from array import array
+import multiprocessing
+import concurrent.futures
+from ped_core import changes
+from ped_core import keymap
+from pygments.lexer import RegexLexer, ExtendedRegexLexer
+from pygments.lexers import find_lexer_class_for_filename, find_lexer_class_by_name, TextLexer
+from pygments.util import ClassNotFound
+from pygments.token import Token
+
+# lexer failures are logged here, nothing is shown unless the application sets up logging since stderr is the screen
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 class Tokens:
-    """ object to act as holder for token list, and to coordinate with token generation thread """
-    def __init__(self):
-        """ no args to constructor """
-        self.tokens = {}
+    """ object to act as holder for token list, and to coordinate with the tokenizer pool, the tokens for each line are
+    packed runs, see pack_tokens, in a list by line and the lexer state at the start of each line is in a list beside
+    it, both are updated in place by the refreshes and shared by all of the views of the EditFile """
+    def __init__(self, lexer = None, key = None ):
+        """ lexer is the lexer for the EditFile these tokens are for, it is used if refresh isn't passed one, key is
+        what the mode picked the lexer by so it can tell when it has to pick again """
+        self.lexer = lexer
+        self.key = key
+        self.tokens = []
+        self.states = []
+        self.pending = None
+        self.window = None
+        self.lexed = 0
         self.modref = -1
-        self.thread = None
+        self.shift_serial = -1
+        self.job = None
         self.lock = threading.Lock()
 
     def __del__(self):
         """ get rid of any lingering references """
         self.tokens = None
-        self.thread = None
+        self.job = None
         self.lock = None
 
     def getTokens(self):
@@ -28,19 +58,92 @@ class Tokens:
         finally:
             self.lock.release()
 
-    def copyTokens(self):
-        """ get the token list if there is one """
+    def setTokens(self,tokens):
+        """ set the token list """
         self.lock.acquire()
         try:
-            return copy.copy(self.tokens)
+            self.tokens = tokens
         finally:
             self.lock.release()
 
-    def setTokens(self,tokens):
-        """ set the token list """
+    def getStates(self):
+        """ get the lexer states at the start of each line """
         self.lock.acquire()
         try:
-            self.tokens = tokens
+            return self.states
+        finally:
+            self.lock.release()
+
+    def copyPending(self):
+        """ get a copy of the lines a cancelled refresh didn't get to """
+        self.lock.acquire()
+        try:
+            if self.pending:
+                return copy.copy(self.pending)
+            return changes.ChangedLines()
+        finally:
+            self.lock.release()
+
+    def getWindow(self):
+        """ get the (modref,first line,end line) of the window published ahead of the rest of the tokens """
+        self.lock.acquire()
+        try:
+            return self.window
+        finally:
+            self.lock.release()
+
+    def publish(self,window = None,pending = None,lexed = 0,modref = -1,shift_serial = -1):
+        """ publish the tokens from a refresh, if window is passed the tokens are only good for those lines of that
+        modref, otherwise the rest of the results of the refresh are set together, modref is -1 if it was cancelled """
+        self.lock.acquire()
+        try:
+            if window:
+                self.window = window
+                return
+            self.pending = pending
+            self.lexed = lexed
+            if modref >= 0:
+                self.modref = modref
+            self.shift_serial = shift_serial
+        finally:
+            self.lock.release()
+            keymap.wakeup()
+
+    def fail(self,workfile):
+        """ publish a refresh that raised an exception, the tokens are dropped and the modref of the snapshot it was
+        lexing is kept so the refresh isn't tried again until the file changes """
+        self.lock.acquire()
+        try:
+            self.tokens = []
+            self.states = []
+            self.pending = None
+            self.window = None
+            self.lexed = 0
+            self.modref = workfile.getModref()
+            self.shift_serial = -1
+        finally:
+            self.lock.release()
+            keymap.wakeup()
+
+    def ready(self,editor):
+        """ true if there are tokens for the lines the editor shows as they are now """
+        modref = editor.getWorkfile().getModref()
+        self.lock.acquire()
+        try:
+            if self.modref == modref:
+                return True
+            if self.window and self.window[0] == modref:
+                first,end = visible_lines(editor)
+                return first >= self.window[1] and end <= self.window[2]
+            return False
+        finally:
+            self.lock.release()
+
+    def getLexed(self):
+        """ get the number of lines lexed by the last refresh """
+        self.lock.acquire()
+        try:
+            return self.lexed
         finally:
             self.lock.release()
 
@@ -60,59 +163,547 @@ class Tokens:
         finally:
             self.lock.release()
 
-    def getThread(self):
-        """ get the reference to the generation thread """
+    def getShiftSerial(self):
+        """ get the serial number of the last line shift in the EditFile's change manager that the tokens follow """
+        self.lock.acquire()
+        try:
+            return self.shift_serial
+        finally:
+            self.lock.release()
+
+    def setShiftSerial(self,shift_serial):
+        """ set the shift serial number for this set of tokens """
         self.lock.acquire()
         try:
-            return self.thread
+            self.shift_serial = shift_serial
         finally:
             self.lock.release()
 
-    def setThread(self,thread):
-        """ set the reference to the generation thread """
+    def getJob(self):
+        """ get the refresh job that is queued or running for these tokens """
         self.lock.acquire()
         try:
-            self.thread = thread
+            return self.job
         finally:
             self.lock.release()
 
-    def refresh(self,editor,lexer):
-        """ refresh the token list based on a new EditFile, does nothing if a thread is already running """
+    def setJob(self,job):
+        """ set the refresh job that is queued or running for these tokens """
         self.lock.acquire()
         try:
-            if self.thread:
+            self.job = job
+        finally:
+            self.lock.release()
+
+    def getLexer(self):
+        """ get the lexer for the EditFile these tokens are for """
+        return self.lexer
+
+    def getKey(self):
+        """ get the key the lexer was picked by """
+        return self.key
+
+    def refresh(self,editor,lexer = None):
+        """ refresh the token list based on a new EditFile, if a refresh is already queued it is moved up if this
+        editor has the focus, the tokens track the lines changed in the EditFile as their own view, the changes are
+        handed to the job with the snapshot so the editor's redraws can't flush them before they are lexed """
+        if lexer == None:
+            lexer = self.lexer
+        priority = 0 if editor.focus else 1
+        self.lock.acquire()
+        try:
+            if self.job:
+                get_tokenizer_pool().prioritize(self.job,priority)
                 return
-            self.thread = threading.Thread(target = gen_tokens, args= (self,editor,lexer))
-            self.thread.start()
-        finally:
-            self.lock.release()
-
-def gen_tokens( tokenobj, editor, lexer ):
-    """ thread worker function, reads and tokenizes the EditFile passed to it stores the list in the Token
-    object provided, updates the modref, closes the EditFile """
-    tokens = tokenobj.copyTokens()
-    workfile = copy.copy(editor.workfile)
-    row = 0
-    while row < workfile.numLines():
-        if (workfile.isLineChanged(editor,row)):
-            line = workfile.getLine(row)+'\n'
-            if line:
-                line_tokens = []
-                for (index,tokentype,value) in lexer.get_tokens_unprocessed(line):
-                    line_tokens.append((tokentype, value, (row,index), (row,index+len(value)), line))
-                tokens[row] = line_tokens
-            elif line in tokens:
-                del tokens[line]
-        row = row + 1
-    for l in list(tokens.keys()):
-        if l >= workfile.numLines():
-            del tokens[l]
-    tokenobj.setTokens(tokens)
-    tokenobj.setModref(workfile.getModref())
-    tokenobj.setThread(None)
+            workfile = editor.getWorkfile()
+            if workfile.change_mgr:
+                workfile.change_mgr.add_view(self)
+            snapshot = workfile.snapshot(self)
+            self.job = TokenizerJob(priority,self,lexer,snapshot,workfile,visible_lines(editor))
+        finally:
+            self.lock.release()
+        get_tokenizer_pool().submit(self.job)
+
+    def detach(self,workfile):
+        """ stop tracking the changes to workfile """
+        if workfile.change_mgr:
+            workfile.change_mgr.remove_view(self)
+
+class TokenizerJob:
+    """ one refresh of a Tokens object waiting for or running in the TokenizerPool """
+    __slots__ = ('priority','tokenobj','lexer','snapshot','live','window')
+
+    def __init__(self, priority, tokenobj, lexer, snapshot, live, window ):
+        """ priority orders the jobs lowest first, the rest are the arguments to gen_tokens """
+        self.priority = priority
+        self.tokenobj = tokenobj
+        self.lexer = lexer
+        self.snapshot = snapshot
+        self.live = live
+        self.window = window
+
+class TokenizerPool:
+    """ pool of worker threads shared by all of the modes that runs the token refreshes for all of the open buffers,
+    jobs are run lowest priority first and in the order they were submitted within a priority, if processes is true
+    the lexing is done in chunks of lines in a pool of processes to get it off of the GIL, the pool keeps counts of
+    the jobs queued, running, completed and cancelled, a job whose lexer raises is logged and counted as cancelled
+    and as failed """
+    default_workers = 2
+    default_processes = False
+
+    def __init__(self, workers = None, processes = None ):
+        """ workers is the most threads and processes to use defaults to TokenizerPool.default_workers, processes
+        defaults to TokenizerPool.default_processes, threads are started as they are needed """
+        if workers == None:
+            workers = TokenizerPool.default_workers
+        if processes == None:
+            processes = TokenizerPool.default_processes
+        self.workers = workers
+        self.queue = []
+        self.seq = 0
+        self.threads = []
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.executor = None
+        if processes:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, job ):
+        """ queue a job, starting another worker thread if all of them are busy """
+        self.lock.acquire()
+        try:
+            heapq.heappush(self.queue,(job.priority,self.seq,job))
+            self.seq += 1
+            self.max_queued = max(self.max_queued,len(self.queue))
+            self.threads = [t for t in self.threads if t.is_alive()]
+            if len(self.threads) < self.workers and self.running+len(self.queue) > len(self.threads):
+                thread = threading.Thread(target = self.worker)
+                thread.daemon = True
+                self.threads.append(thread)
+                thread.start()
+            self.wakeup.notify()
+        finally:
+            self.lock.release()
+
+    def prioritize(self, job, priority ):
+        """ move a queued job up to priority if that is ahead of where it is """
+        self.lock.acquire()
+        try:
+            if priority < job.priority:
+                job.priority = priority
+                self.queue = [(j.priority,seq,j) for p,seq,j in self.queue]
+                heapq.heapify(self.queue)
+        finally:
+            self.lock.release()
+
+    def worker(self):
+        """ worker thread, runs jobs from the queue forever """
+        while True:
+            self.lock.acquire()
+            try:
+                while not self.queue:
+                    self.wakeup.wait()
+                priority,seq,job = heapq.heappop(self.queue)
+                self.running += 1
+            finally:
+                self.lock.release()
+            completed = False
+            error = None
+            try:
+                completed = gen_tokens(job.tokenobj,job.lexer,job.snapshot,job.live,job.window,self.executor)
+            except Exception as e:
+                # one bad lexer mustn't take the worker down with it
+                error = e
+                logger.exception("tokenizer job failed for %s",type(job.lexer).__name__)
+                job.tokenobj.fail(job.snapshot)
+                job.snapshot.close()
+            finally:
+                job.tokenobj.setJob(None)
+                self.lock.acquire()
+                self.running -= 1
+                if completed:
+                    self.completed += 1
+                else:
+                    self.cancelled += 1
+                if error:
+                    self.failed += 1
+                    self.last_error = error
+                self.lock.release()
+
+    def stats(self):
+        """ return a tuple of (jobs queued, jobs running, most jobs ever queued, jobs completed, jobs cancelled) """
+        self.lock.acquire()
+        try:
+            return (len(self.queue),self.running,self.max_queued,self.completed,self.cancelled)
+        finally:
+            self.lock.release()
+
+tokenizer_pool = None
+
+def get_tokenizer_pool():
+    """ return the TokenizerPool shared by all of the modes, it is created the first time it is needed """
+    global tokenizer_pool
+    if tokenizer_pool == None:
+        tokenizer_pool = TokenizerPool()
+    return tokenizer_pool
+
+lexers = {}
+
+def get_lexer( lexer_class ):
+    """ return the instance of lexer_class shared by all of the buffers, the lexers keep no state between lines """
+    lexer = lexers.get(lexer_class)
+    if lexer == None:
+        lexer = lexer_class()
+        lexers[lexer_class] = lexer
+    return lexer
+
+lexer_classes = {}
+
+def find_lexer_class( key, find, name ):
+    """ return the lexer class find(name) finds or None, cached under key since pygments searches all of its lexers
+    and plugins for each lookup """
+    if key not in lexer_classes:
+        try:
+            lexer_classes[key] = find(name)
+        except ClassNotFound:
+            lexer_classes[key] = None
+    return lexer_classes[key]
+
+def detect_lexer( filename, first_line = "" ):
+    """ return the shared lexer for a file by its name, or by the interpreter in its #! line if the name doesn't
+    say, or the plain text lexer if neither does """
+    filename = os.path.basename(re.sub(r"\:\(r.*\)$","",filename or ""))
+    lexer_class = None
+    if filename:
+        lexer_class = find_lexer_class("file:"+filename,find_lexer_class_for_filename,filename)
+    if (lexer_class == None or lexer_class == TextLexer) and first_line.startswith("#!"):
+        interpreter = first_line[2:].split()
+        if interpreter and os.path.basename(interpreter[0]) == "env":
+            interpreter = interpreter[1:]
+        if interpreter:
+            interpreter = os.path.basename(interpreter[0])
+            lexer_class = find_lexer_class("#!"+interpreter,find_lexer_class_by_name,interpreter)
+            if lexer_class == None:
+                interpreter = re.sub(r"[\d.]+$","",interpreter)
+                lexer_class = find_lexer_class("#!"+interpreter,find_lexer_class_by_name,interpreter)
+    if lexer_class == None:
+        lexer_class = TextLexer
+    return get_lexer(lexer_class)
+
+def visible_lines( editor ):
+    """ return the first file line the editor shows and the line after the last one """
+    first = editor.filePos(editor.line,editor.left)[0]
+    last = editor.filePos(max(editor.line,min(editor.line+editor.max_y-2,editor.numLines(True)-1)),editor.left)[0]
+    return (first,last+1)
+
+def shift_tokens( tokens, line, count ):
+    """ move the rows of the token list to follow count lines inserted at line, or -count lines deleted """
+    if count > 0:
+        tokens[line:line] = [None]*count
+    else:
+        del tokens[line:line-count]
+
+def shift_states( states, line, count ):
+    """ move the rows of the lexer state list to follow count lines inserted at line, or -count lines deleted, the
+    state at the start of line is the state at the end of the line before it so it stays put """
+    if count > 0:
+        states[line+1:line+1] = [None]*count
+        if line+count < len(states):
+            states[line+count] = states[line]
+    else:
+        del states[line+1:line+1-count]
+
+def resize( rows, size ):
+    """ grow or shrink the list rows to size rows, new rows are None """
+    if len(rows) < size:
+        rows.extend([None]*(size-len(rows)))
+    else:
+        del rows[size:]
+
+token_type_ids = {}
+token_type_list = []
+token_type_lock = threading.Lock()
+
+def token_type_id( tokentype ):
+    """ return the number that stands for tokentype in packed tokens, new types are added under token_type_lock
+    since the TokenizerPool workers pack tokens at the same time """
+    type_id = token_type_ids.get(tokentype)
+    if type_id == None:
+        token_type_lock.acquire()
+        try:
+            type_id = token_type_ids.get(tokentype)
+            if type_id == None:
+                type_id = len(token_type_list)
+                token_type_list.append(tokentype)
+                token_type_ids[tokentype] = type_id
+        finally:
+            token_type_lock.release()
+    return type_id
+
+def pack_tokens( tokenized, length ):
+    """ pack a line's list of (index,tokentype,value) into an array of (offset,length,type id) runs, one after the
+    other, tokens next to each other of the same type are merged and the runs stop at length, the end of the line """
+    packed = array('i')
+    end = 0
+    type_id = -1
+    for (index,tokentype,value) in tokenized:
+        if index >= length:
+            break
+        t_end = min(length,index+len(value))
+        t_id = token_type_id(tokentype)
+        if t_id == type_id and index == end:
+            packed[-2] += t_end-index
+        else:
+            packed.extend((index,t_end-index,t_id))
+            type_id = t_id
+        end = t_end
+    return packed
+
+def unpack_tokens( packed ):
+    """ return the list of (offset,length,tokentype) runs in a line's packed tokens """
+    return [(packed[idx],packed[idx+1],token_type_list[packed[idx+2]]) for idx in range(0,len(packed),3)]
+
+stack_lexers = {}
+
+def is_stack_lexer( lexer ):
+    """ true if lexer is a RegexLexer whose state stack we can keep between lines, either it uses the RegexLexer
+    get_tokens_unprocessed or its override takes the starting stack too, the answer is kept for each lexer class """
+    lexer_class = type(lexer)
+    result = stack_lexers.get(lexer_class)
+    if result == None:
+        result = False
+        if issubclass(lexer_class,RegexLexer) and not issubclass(lexer_class,ExtendedRegexLexer):
+            get_tokens = lexer_class.get_tokens_unprocessed
+            if get_tokens is RegexLexer.get_tokens_unprocessed:
+                result = True
+            else:
+                try:
+                    params = list(inspect.signature(get_tokens).parameters.values())
+                    result = (len(params) >= 3 or
+                              any([p.kind == inspect.Parameter.VAR_POSITIONAL for p in params]))
+                except (TypeError,ValueError):
+                    result = False
+        stack_lexers[lexer_class] = result
+    return result and hasattr(lexer,"_tokens")
+
+def regex_frame( tokens ):
+    """ return the frame of the RegexLexer get_tokens_unprocessed generator behind the generator tokens, following
+    yield from and the generators an override is looping over, or None if it can't be found """
+    seen = 0
+    while tokens != None and seen < 8:
+        frame = getattr(tokens,"gi_frame",None)
+        if frame == None:
+            return None
+        if frame.f_code is RegexLexer.get_tokens_unprocessed.__code__:
+            return frame
+        inner = tokens.gi_yieldfrom
+        if inner == None:
+            inner = next((value for value in gc.get_referents(tokens) if inspect.isgenerator(value)),None)
+        tokens = inner
+        seen += 1
+    return None
+
+def lex_line( lexer, line, stack, stacks ):
+    """ lex one line starting from the lexer state stack, returns the list of (index,tokentype,value) and the state
+    stack at the end of the line, the line is lexed by the lexer's own get_tokens_unprocessed and the stack is the one
+    the RegexLexer loop behind it keeps, other lexers, including regex lexers whose get_tokens_unprocessed override
+    doesn't take a stack or hides the loop, are lexed a line at a time with no state and an empty state is returned,
+    stacks is used to share equal stacks """
+    if not is_stack_lexer(lexer):
+        return (list(lexer.get_tokens_unprocessed(line)),())
+    tokens = lexer.get_tokens_unprocessed(line,stack)
+    line_tokens = []
+    statestack = None
+    for token in tokens:
+        line_tokens.append(token)
+        # the stack is changed in place except at a newline no rule matches, where the loop starts a new one
+        if statestack == None or token[2] == '\n':
+            frame = regex_frame(tokens)
+            if frame == None or not isinstance(frame.f_locals.get("statestack"),list):
+                # we can't see the state, these tokens are still good but from now on lex this class without state
+                stack_lexers[type(lexer)] = False
+                return (line_tokens,())
+            statestack = frame.f_locals["statestack"]
+    if statestack == None:
+        statestack = stack
+    statestack = tuple(statestack)
+    return (line_tokens,stacks.setdefault(statestack,statestack))
+
+def lex_lines( lexer, lines, stack ):
+    """ lex a run of lines starting from the lexer state stack, returns a list of (start stack, tokens, end stack) for each
+    line, this is what runs in the tokenizer processes """
+    if isinstance(lexer,RegexLexer) and '_tokens' not in type(lexer).__dict__:
+        # the state tables are built when the first lexer of a class is made, unpickling one doesn't do that
+        type(lexer)()
+    stacks = {}
+    result = []
+    for line in lines:
+        tokenized, end_stack = lex_line(lexer,line,stack,stacks)
+        result.append((stack,tokenized,end_stack))
+        stack = end_stack
+    return result
+
+token_types = {}
+
+def canonical_token_type( tokentype ):
+    """ return the pygments token type equal to tokentype, the ones that come back from the tokenizer processes are copies """
+    canonical = token_types.get(tokentype)
+    if canonical == None:
+        canonical = Token
+        for part in tokentype:
+            canonical = getattr(canonical,part)
+        token_types[canonical] = canonical
+    return canonical
+
+max_token_shifts = 64
+max_window_context = 100
+cancel_check_lines = 64
+chunk_lines = 256
+
+def gen_tokens( tokenobj, lexer, workfile, live, window, executor = None ):
+    """ job function run by the TokenizerPool, tokenizes the snapshot of an EditFile passed to it and publishes the tokens in the Tokens
+    object provided, closes the snapshot, the tokens and the lexer state at the start of each line from the last run are
+    moved to follow the lines inserted and deleted since then, lexing restarts at each changed line from its saved state
+    and carries on until the state at the end of a line matches the one saved by the last run, the window of lines
+    (first,end) that is on screen is lexed and published first, the rest is cancelled when live, the EditFile the
+    snapshot came from, has been changed again, the lines it didn't get to are kept for the next run, if executor is
+    passed the lines are lexed chunk_lines at a time in it, returns True if it wasn't cancelled """
+    tokens = tokenobj.getTokens()
+    states = tokenobj.getStates()
+    pending = tokenobj.copyPending()
+    modref = workfile.getModref()
+    nlines = workfile.numLines()
+    relex = nlines
+    if not tokens:
+        relex = 0
+    touched = []
+    if tokens and workfile.change_mgr:
+        shifts = workfile.change_mgr.get_shifts(tokenobj.getShiftSerial())
+        if shifts == None:
+            relex = 0
+        elif len(shifts) > max_token_shifts:
+            relex = min([line for line,count in shifts])
+        else:
+            for line,count in shifts:
+                shift_tokens(tokens,line,count)
+                shift_states(states,line,count)
+                pending.shift(line,count)
+                touched = [t if t < line else (t+count if t >= line-min(count,0) else line) for t in touched]
+                touched.append(line)
+    touched.sort()
+    resize(tokens,nlines)
+    resize(states,nlines+1)
+
+    def next_row( row ):
+        """ the next row at or after row that has to be lexed """
+        if row >= relex:
+            return row
+        next = min(relex,workfile.nextChangedLine(tokenobj,row))
+        idx = bisect.bisect_left(touched,row)
+        if idx < len(touched):
+            next = min(next,touched[idx])
+        pending_row = pending.next_changed(row)
+        if pending_row >= 0:
+            next = min(next,pending_row)
+        return next
+
+    def start_row( row, limit ):
+        """ return the row to start lexing at to get to row, go back at most to limit for a saved state, then guess """
+        if states[row] == None:
+            back = row
+            while back > limit and states[back] == None:
+                back -= 1
+            if states[back] == None:
+                states[row] = ('root',)
+            else:
+                row = back
+        return row
+
+    stacks = {}
+    ahead = {}
+    def lex_row( row ):
+        """ lex row from its saved start state, true if it ends in the state saved for the next row by the last run """
+        line = workfile.getLine(row)
+        if executor:
+            # the chunk lexed ahead is only good while we follow the states it started each line with
+            if row not in ahead or ahead[row][0] != states[row]:
+                ahead.clear()
+                lines = [workfile.getLine(r)+'\n' for r in range(row,min(nlines,row+chunk_lines))]
+                for offset, lexed_line in enumerate(executor.submit(lex_lines,lexer,lines,states[row]).result()):
+                    ahead[row+offset] = lexed_line
+            start_stack, tokenized, end_stack = ahead.pop(row)
+            tokenized = [(index,canonical_token_type(tokentype),value) for (index,tokentype,value) in tokenized]
+            end_stack = stacks.setdefault(end_stack,end_stack)
+        else:
+            tokenized, end_stack = lex_line(lexer,line+'\n',states[row],stacks)
+        tokens[row] = pack_tokens(tokenized,len(line))
+        old_stack = states[row+1]
+        states[row+1] = end_stack
+        return old_stack == end_stack
+
+    lexed = 0
+    first,end = window
+    end = min(end,nlines)
+    row = next_row(first)
+    if row < end:
+        row = start_row(row,max(0,row-max_window_context))
+        while row < end:
+            same = lex_row(row)
+            lexed += 1
+            row += 1
+            if same and row < relex:
+                row = next_row(row)
+        if not same and row == end:
+            # the state changed past the window, the rest of the file picks it up from end
+            bisect.insort(touched,end)
+        tokenobj.publish(window = (modref,first,end))
+
+    cancelled = False
+    check = lexed
+    row = next_row(0)
+    while row < nlines:
+        if lexed >= check:
+            if live.getModref() != modref:
+                cancelled = True
+                break
+            check = lexed + cancel_check_lines
+        row = start_row(row,0)
+        same = lex_row(row)
+        lexed += 1
+        row += 1
+        if same and row < relex:
+            row = next_row(row)
+
+    remaining = None
+    if cancelled:
+        remaining = changes.ChangedLines()
+        remaining.add(row,row)
+        spans = list(zip(pending.starts,pending.ends))
+        if workfile.change_mgr and tokenobj in workfile.change_mgr.views:
+            view = workfile.change_mgr.views[tokenobj]
+            spans += list(zip(view.starts,view.ends))
+        spans += [(t,t) for t in touched]
+        if relex < nlines:
+            spans.append((relex,sys.maxsize))
+        for start_line,end_line in spans:
+            if end_line >= row:
+                remaining.add(max(start_line,row),end_line)
+        modref = -1
+
+    shift_serial = -1
+    if workfile.change_mgr:
+        shift_serial = workfile.change_mgr.serial
+    tokenobj.publish(pending = remaining,lexed = lexed,modref = modref,shift_serial = shift_serial)
     workfile.close()
     del workfile
     workfile = None
+    return not cancelled
 
 def is_token_in( token, list_token_classes ):
     """ return true if token is in the list or is a subclass of anything in the list """
@@ -121,24 +712,102 @@ def is_token_in( token, list_token_classes ):
             return True
     return False
 
-def render( editor, tokens, keywords, strings, comments ):
-    """ using token map (keywords, strings, comments) hilight the tokens in the editor """
-    curses.init_pair(1,curses.COLOR_GREEN,curses.COLOR_BLACK)
-    curses.init_pair(2,curses.COLOR_RED,curses.COLOR_BLACK)
-    curses.init_pair(3,curses.COLOR_CYAN,curses.COLOR_BLACK)
-    curses.init_pair(4,curses.COLOR_WHITE,curses.COLOR_BLACK)
+class TokenAttrs:
+    """ table that maps token types to the attribute class they are drawn with, each mode compiles one from its
+    lists of keyword, string and comment token classes and each token type is only classified once """
+    plain = 0
+    keyword = 1
+    string = 2
+    comment = 3
+
+    def __init__(self, keywords, strings, comments ):
+        """ takes the lists of token classes for keywords, strings and comments, the first list a token is in wins """
+        self.classes = [(keywords,TokenAttrs.keyword),(strings,TokenAttrs.string),(comments,TokenAttrs.comment)]
+        self.table = {}
+        self.ids = {}
+
+    def get(self, token ):
+        """ return the attribute class for a token type """
+        attr_class = self.table.get(token)
+        if attr_class == None:
+            attr_class = TokenAttrs.plain
+            for token_classes, token_class in self.classes:
+                if is_token_in(token,token_classes):
+                    attr_class = token_class
+                    break
+            self.table[token] = attr_class
+        return attr_class
+
+    def get_id(self, type_id ):
+        """ return the attribute class for a token type id from packed tokens """
+        attr_class = self.ids.get(type_id)
+        if attr_class == None:
+            attr_class = self.get(token_type_list[type_id])
+            self.ids[type_id] = attr_class
+        return attr_class
+
+def token_colors():
+    """ return the curses attributes for the plain, keyword, string and comment classes, the color pairs are only
+    initialized when they aren't set up already """
+    if curses.pair_content(1) != (curses.COLOR_GREEN,curses.COLOR_BLACK):
+        curses.init_pair(1,curses.COLOR_GREEN,curses.COLOR_BLACK)
+        curses.init_pair(2,curses.COLOR_RED,curses.COLOR_BLACK)
+        curses.init_pair(3,curses.COLOR_CYAN,curses.COLOR_BLACK)
+        curses.init_pair(4,curses.COLOR_WHITE,curses.COLOR_BLACK)
+    return [curses.color_pair(4),curses.color_pair(3),curses.color_pair(1),curses.color_pair(2)]
+
+def render_runs( editor, sc_line, start, line, line_tokens, token_attrs, colors ):
+    """ draw the part of a line from column start to the right edge of the window on screen line sc_line using its
+    packed tokens, each run of characters with the same attribute is written with one addstr, the gaps between runs
+    and the rest of the row are filled with spaces so the row is written once """
+    end = min(start + editor.max_x,len(line))
+    run_col = start
+    run_end = start
+    run_attr = None
+    for idx in range(0,len(line_tokens),3):
+        t_scol = line_tokens[idx]
+        t_end = t_scol + line_tokens[idx+1]
+        if t_end <= start:
+            continue
+        if t_scol >= end:
+            break
+        t_scol = max(t_scol,start)
+        t_end = min(t_end,end)
+        attr = colors[token_attrs.get_id(line_tokens[idx+2])]
+        if run_attr != None and (attr != run_attr or t_scol != run_end):
+            editor.addstr(sc_line,run_col-start,line[run_col:run_end],run_attr)
+            run_attr = None
+        if run_attr == None:
+            if t_scol > run_end:
+                editor.addstr(sc_line,run_end-start,' '*(t_scol-run_end))
+            run_col = t_scol
+            run_attr = attr
+        run_end = t_end
+    if run_attr != None:
+        editor.addstr(sc_line,run_col-start,line[run_col:run_end],run_attr)
+    if run_end-start < editor.max_x:
+        editor.addstr(sc_line,run_end-start,' '*(editor.max_x-(run_end-start)))
+
+def render_cursor( editor, line, line_tokens, token_attrs, colors, cursor_pos, sc_cursor_line, sc_cursor_pos ):
+    """ redraw the character under the previous cursor position from the packed tokens, returns False if there isn't one """
+    for idx in range(0,len(line_tokens),3):
+        t_scol = line_tokens[idx]
+        if cursor_pos >= t_scol and cursor_pos < t_scol+line_tokens[idx+1]:
+            editor.addstr(sc_cursor_line,sc_cursor_pos,line[cursor_pos],colors[token_attrs.get_id(line_tokens[idx+2])])
+            return True
+    return False
 
-    green = curses.color_pair(1)
-    red = curses.color_pair(2)
-    cyan = curses.color_pair(3)
-    white = curses.color_pair(4)
+def render( editor, tokens, token_attrs ):
+    """ using the TokenAttrs table for the mode hilight the tokens in the editor """
+    colors = token_colors()
 
     if tokens:
         tokens = tokens.getTokens()
     else:
-        tokens = {}
+        tokens = []
     cursor_line,cursor_pos = editor.prevPos()
     sc_cursor_line,sc_cursor_pos = editor.window_pos(cursor_line,cursor_pos)
+    cursor_on_screen = sc_cursor_line > 0 and sc_cursor_line < editor.max_y and sc_cursor_pos >= 0 and sc_cursor_pos < editor.max_x
     start_line = editor.line
     lidx = start_line
     max_sc_line = 1
@@ -147,28 +816,15 @@ def render( editor, tokens, keywords, strings, comments ):
         line_changed = editor.workfile.isLineChanged(editor,f_line)
         is_cursor_line = (f_line == cursor_line)
         if line_changed or is_cursor_line:
-            if f_line in tokens:
+            if f_line < len(tokens) and tokens[f_line] != None:
                 sc_line,sc_pos = editor.window_pos(f_line,f_pos)
-                if line_changed and sc_line > 0:
-                    editor.addstr(sc_line,0,' '*editor.max_x)
-                if is_cursor_line:
-                    editor.addstr(sc_cursor_line,sc_cursor_pos,' ')
                 line_tokens = tokens[f_line]
-                for (t_type, t_text, (t_srow,t_scol), (t_erow,t_ecol), t_line) in line_tokens:
-                    if is_token_in(t_type,keywords):
-                        attr = cyan
-                    elif is_token_in(t_type,strings):
-                        attr = green
-                    elif is_token_in(t_type,comments):
-                        attr = red
-                    else:
-                        attr = white
-                    for ch in t_text:
-                        sc_line,sc_pos = editor.window_pos(t_srow,t_scol)
-                        if sc_line > 0 and sc_line < editor.max_y and sc_pos >= 0 and sc_pos < editor.max_x:
-                            if line_changed or (is_cursor_line and sc_line == sc_cursor_line and sc_pos == sc_cursor_pos):
-                                editor.addstr(sc_line,sc_pos,ch,attr)
-                        t_scol += 1
+                line = editor.workfile.getLine(f_line)
+                if line_changed and sc_line > 0 and sc_line < editor.max_y:
+                    render_runs(editor,sc_line,f_pos,line,line_tokens,token_attrs,colors)
+                if is_cursor_line and cursor_on_screen:
+                    if not render_cursor(editor,line,line_tokens,token_attrs,colors,cursor_pos,sc_cursor_line,sc_cursor_pos):
+                        editor.addstr(sc_cursor_line,sc_cursor_pos,' ')
                 if sc_line > max_sc_line:
                     max_sc_line = sc_line
             else:
@@ -5,7 +5,7 @@ from ped_dialog.message_dialog import message
 import re
 from pygments.lexers import PythonLexer
 from pygments.token import Token
-from ped_core.mode import Tokens, render
+from ped_core.mode import Tokens, render, TokenAttrs, get_lexer
 from ped_core import keytab
 
 def get_tabs(editor):
@@ -53,10 +53,15 @@ def finish(editor):
     wf = editor.getWorkfile()
     if wf:
         if hasattr(wf,"python_mode_tokens"):
+            wf.python_mode_tokens.detach(wf)
             del wf.python_mode_tokens
             wf.python_mode_tokens = None
             delattr(wf,"python_mode_tokens")
 
+token_attrs = TokenAttrs([Token.Operator.Word,Token.Name.Builtin.Pseudo,Token.Keyword,Token.Keyword.Namespace],
+                         [Token.Text,Token.String,Token.Literal.String,Token.Literal.String.Single,Token.Literal.String.Double,Token.Literal.String.Doc],
+                         [Token.Comment,Token.Comment.Hashbang,Token.Comment.Multiline,Token.Comment.Single])
+
 def redraw(editor):
     """ redraw the colorization based on the current token set, regenerate it if needed """
     workfile = editor.getWorkfile()
@@ -70,17 +75,14 @@ def redraw(editor):
     if not tokens:
         return False
 
-    if not tokens.getTokens() or tokens.getModref() != workfile.getModref():
-        tokens.refresh(editor,PythonLexer())
+    if not tokens.ready(editor):
+        tokens.refresh(editor,get_lexer(PythonLexer))
         return False
 
-    render(editor, tokens,
-    [Token.Operator.Word,Token.Name.Builtin.Pseudo,Token.Keyword,Token.Keyword.Namespace],
-    [Token.Text,Token.String,Token.Literal.String,Token.Literal.String.Single,Token.Literal.String.Double,Token.Literal.String.Doc],
-    [Token.Comment,Token.Comment.Hashbang,Token.Comment.Multiline,Token.Comment.Single])
+    render(editor, tokens, token_attrs)
 
     return True
 
-def name():
+def name(editor = None):
     """ hook to return this mode's human readable name """
     return "python_mode"
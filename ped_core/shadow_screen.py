@@ -0,0 +1,93 @@
+# Copyright 2009 James P Goodwin ped tiny python editor
+""" module that implements a shadow copy of the cells last written to a curses window so only the cells that change are written again """
+import time
+
+class ShadowScreen:
+    """ the characters and attributes last written to each cell of a window, rows that aren't known are None,
+    counts the writes, skipped writes, cells and bytes written and the time taken for each frame """
+    def __init__(self, height, width ):
+        """ height and width are the size of the window in cells """
+        self.height = height
+        self.width = width
+        self.text = [None]*height
+        self.attrs = [None]*height
+        self.frames = 0
+        self.writes = 0
+        self.skipped = 0
+        self.cells = 0
+        self.bytes = 0
+        self.frame_start = 0
+        self.frame_time = 0.0
+
+    def size(self):
+        """ return (height,width) of the window this shadows """
+        return (self.height,self.width)
+
+    def clear(self):
+        """ forget what is on the window, used when something else may have drawn over it """
+        self.text = [None]*self.height
+        self.attrs = [None]*self.height
+
+    def update(self, row, col, text, attr ):
+        """ record text written at row, col with attr and return the (start,end) offsets into text of the span that
+        differs from what was there before, returns None if it is all the same, text must fit on the row """
+        n = len(text)
+        cur = self.text[row]
+        if cur == None:
+            self.text[row] = ' '*col + text + ' '*(self.width-col-n)
+            attrs = [None]*self.width
+            attrs[col:col+n] = [attr]*n
+            self.attrs[row] = attrs
+            return (0,n)
+        attrs = self.attrs[row]
+        same_attrs = [attr]*n
+        if cur[col:col+n] == text and attrs[col:col+n] == same_attrs:
+            self.skipped += 1
+            return None
+        first = 0
+        while cur[col+first] == text[first] and attrs[col+first] == attr:
+            first += 1
+        last = n
+        while cur[col+last-1] == text[last-1] and attrs[col+last-1] == attr:
+            last -= 1
+        self.text[row] = cur[:col] + text + cur[col+n:]
+        attrs[col:col+n] = same_attrs
+        return (first,last)
+
+    def forget(self, row ):
+        """ forget what is on one row """
+        if row >= 0 and row < self.height:
+            self.text[row] = None
+            self.attrs[row] = None
+
+    def shift(self, row, count ):
+        """ follow a curses insdelln of count rows at row, the rows that are left blank are forgotten """
+        if count > 0:
+            self.text[row:row] = [None]*count
+            self.attrs[row:row] = [None]*count
+            del self.text[self.height:]
+            del self.attrs[self.height:]
+        elif count < 0:
+            del self.text[row:row-count]
+            del self.attrs[row:row-count]
+            self.text.extend([None]*(self.height-len(self.text)))
+            self.attrs.extend([None]*(self.height-len(self.attrs)))
+
+    def begin_frame(self):
+        """ start timing a frame """
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """ finish a frame and record how long it took """
+        self.frames += 1
+        self.frame_time = time.perf_counter() - self.frame_start
+
+    def count(self, cells, nbytes ):
+        """ count a write of cells cells that took nbytes bytes """
+        self.writes += 1
+        self.cells += cells
+        self.bytes += nbytes
+
+    def stats(self):
+        """ return a tuple of (frames, writes, skipped writes, cells written, bytes written, seconds for the last frame) """
+        return (self.frames, self.writes, self.skipped, self.cells, self.bytes, self.frame_time)
@@ -0,0 +1,82 @@
+# Copyright 2009 James P Goodwin ped tiny python editor
+""" module that implements tab stop tables and linear time tab expansion for the ped editor """
+from array import array
+
+class TabStops:
+    """ precomputed table of the tab stops for one tabs configuration, the tabs list gives explicit stops and
+    after the last one the stops repeat every (last - next to last) columns """
+    def __init__(self, tabs ):
+        """ tabs is the list of tab stops, use get_tab_stops to share tables between files """
+        self.tabs = list(tabs)
+        self.last = self.tabs[-1]
+        if len(self.tabs) > 1:
+            self.incr = max(1,self.tabs[-1]-self.tabs[-2])
+        else:
+            self.incr = max(1,self.tabs[-1])
+        self.next_stops = array('i',[0])*self.last
+        self.prev_stops = array('i',[0])*self.last
+        prev = 0
+        idx = 0
+        for stop in self.tabs:
+            while idx < stop and idx < self.last:
+                self.next_stops[idx] = stop
+                self.prev_stops[idx] = prev
+                idx += 1
+            prev = stop
+
+    def next_stop(self, idx ):
+        """ return the first tab stop after column idx """
+        if idx < self.last:
+            return self.next_stops[idx]
+        return self.last + ((idx-self.last)//self.incr + 1)*self.incr
+
+    def prev_stop(self, idx ):
+        """ return the last tab stop at or before column idx """
+        if idx < self.last:
+            return self.prev_stops[idx]
+        return self.next_stop(idx) - self.incr
+
+    def expand(self, content ):
+        """ expand the tabs in content in one pass, content without tabs is returned as is """
+        if '\t' not in content:
+            return content
+        parts = content.split('\t')
+        expanded = []
+        col = 0
+        for part in parts[:-1]:
+            expanded.append(part)
+            col += len(part)
+            stop = self.next_stop(col)
+            expanded.append(' '*(stop-col))
+            col = stop
+        expanded.append(parts[-1])
+        return ''.join(expanded)
+
+    def column_map(self, content ):
+        """ return an array('i') giving the display column of each character in content, with one extra entry for
+        the display length, so the display column of raw offset i is map[i] and the raw offset of display column c
+        is bisect.bisect_right(map,c)-1 """
+        cols = array('i',range(0,len(content)+1))
+        idx = content.find('\t')
+        shift = 0
+        while idx >= 0:
+            col = idx + shift
+            stop = self.next_stop(col)
+            shift += stop - col - 1
+            nidx = content.find('\t',idx+1)
+            end = nidx if nidx >= 0 else len(content)
+            for pos in range(idx+1,end+1):
+                cols[pos] += shift
+            idx = nidx
+        return cols
+
+tab_stop_tables = {}
+
+def get_tab_stops( tabs ):
+    """ return the shared TabStops table for a tabs configuration """
+    key = tuple(tabs)
+    stops = tab_stop_tables.get(key)
+    if not stops:
+        stops = TabStops(tabs)
+        tab_stop_tables[key] = stops
+    return stops
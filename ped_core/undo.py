@@ -1,47 +1,77 @@
 # Copyright 2009 James P Goodwin ped tiny python editor
 """ undo module for the ped python editor, implements a simple undo mechanism """
 
-import copy
+import os
+import sys
+import json
+import collections
+import itertools
+from array import array
+from ped_core.line_buffer import EditLine, FileLine, MemLine
+
+def arg_size( arg ):
+    """ estimate the bytes held by one argument of an undo action, lines edited in memory hold their text too """
+    size = sys.getsizeof(arg)
+    if isinstance(arg,MemLine):
+        size += sys.getsizeof(arg.getContent())
+    return size
 
 class UndoAction:
     """ represents one undoable action """
-    def __init__(self, func, tpl ):       
+    __slots__ = ('func','tpl','size')
+
+    def __init__(self, func, tpl, charged = () ):
         """ constructed with an undo func which is a function to call on undo
-        and tpl which is a tuple of arguments to pass to the function
-        a shallow copy of the tuple is made preserving the state """
+        and tpl which is a tuple of arguments to pass to the function, the tuple
+        is immutable so it is kept as is, size is an estimate of the bytes held,
+        arguments that are in charged were counted by an earlier action and are shared with it """
         self.func = func
-        self.tpl = copy.copy(tpl)
-
-    def __del__(self):
-        self.func = None
-        self.tpl = None
+        self.tpl = tpl
+        self.size = sys.getsizeof(self) + sys.getsizeof(tpl)
+        for arg in tpl:
+            if not any(arg is c for c in charged):
+                self.size += arg_size(arg)
 
     def undo(self):
-        """ undo this action by invoking the function and passing the tuple 
+        """ undo this action by invoking the function and passing the tuple
         to it """
         self.func(*self.tpl)
 
 class UndoTransaction:
-    """ represents a collection of undo actions that should be undone together 
+    """ represents a collection of undo actions that should be undone together
     as one transaction """
     def __init__(self, manager):
         """ constructed with a reference to the UndoManager that this
         transaction belongs to """
         self.manager = manager
         self.list = []
-
-    def __del__(self):
-        self.manager = None
-        self.list = None
+        self.coalesced = []
+        self.size = 0
+        # number of this transaction in the journal if it was written there when the file was saved
+        self.journal_pos = None
 
     def isEmpty(self):
         """ tests to see if this transaction has no actions in it """
         return not self.list
 
-    def push(self, func, tpl ):
-        """ pushes a new undo action onto this transaction """
+    def isCoalesced(self):
+        """ true if every action in this transaction is a coalescing one, ie it only records cursor state """
+        return len(self.list) == len(self.coalesced)
+
+    def push(self, func, tpl, coalesce = False ):
+        """ pushes a new undo action onto this transaction, if coalesce is true the action only records state
+        that is restored as a whole so only the first one for each func is kept, undoing the transaction
+        applies them oldest last so the later ones would be overwritten anyway """
         if not self.manager.inUndo():
-            self.list.append(UndoAction(func,tpl))
+            if coalesce:
+                if func in self.coalesced:
+                    return
+                self.coalesced.append(func)
+            action = UndoAction(func,tpl,self.manager.charged)
+            self.manager.charged = tpl
+            self.list.append(action)
+            self.size += action.size
+            self.manager.grow(action.size)
 
     def undo(self):
         """ undoes all of the actions in this transaction """
@@ -49,13 +79,199 @@ class UndoTransaction:
             self.list[-1].undo()
             del self.list[-1]
         self.list = []
+        self.coalesced = []
+
+class UndoJournal:
+    """ append only file of the undo transactions that have been spilled out of memory for one EditFile, each
+    record is a line of json, either a save mark ["save",size,mtime] written when the file is saved or a
+    transaction ["undo",[[func name,line,content,changed],...]], transactions are popped by truncating the file,
+    the journal lives next to the backups so undo history survives restarts as long as the file matches
+    the last save mark, once it grows past max_bytes the oldest transactions are dropped """
+    replay_funcs = ["_insertLine","_deleteLine","_replaceLine"]
+    max_bytes = 16777216
+
+    def __init__(self, path, target, size, mtime ):
+        """ path is the journal file, target the EditFile the undo actions are replayed through, size and mtime
+        describe the file on disk now, a journal that doesn't end with a matching save mark is discarded and
+        nothing is written until the first transaction is spilled """
+        self.path = path
+        self.target = target
+        self.offsets = array('q')
+        # number of transactions dropped off the front of the journal, transactions are numbered from the first one written
+        self.base = 0
+        self.saved = 0
+        self.end = 0
+        # offset the file is cut back to before the next write, transactions undone after a save stay on disk till then
+        self.cut = -1
+        mark = None
+        if os.path.exists(path):
+            f = open(path,"rb")
+            while True:
+                pos = f.tell()
+                record = f.readline()
+                if not record.endswith(b"\n"):
+                    break
+                if record.startswith(b'["undo",'):
+                    self.offsets.append(pos)
+                elif record.startswith(b'["save",'):
+                    try:
+                        record = json.loads(record.decode("utf-8"))
+                    except:
+                        break
+                    mark = (record[1],record[2])
+                    self.saved = f.tell()
+                else:
+                    break
+            f.close()
+        if mark != (size,mtime):
+            self.offsets = array('q')
+            self.saved = 0
+        while self.offsets and self.offsets[-1] >= self.saved:
+            self.offsets.pop()
+        if os.path.exists(path):
+            self.truncate(self.saved)
+        self.key = (size,mtime)
+
+    def __len__(self):
+        """ return the number of transactions in the journal """
+        return len(self.offsets)
+
+    def truncate(self, pos ):
+        """ cut the journal file off at pos """
+        f = open(self.path,"ab")
+        f.truncate(pos)
+        f.close()
+        self.end = pos
+
+    def write(self, record ):
+        """ append one record to the journal file, returns the offset it was written at """
+        if self.cut >= 0:
+            self.truncate(self.cut)
+            if self.cut < self.saved:
+                # the save mark went with it, what is left all came before the save
+                self.saved = self.cut
+            self.cut = -1
+        if not self.end:
+            os.makedirs(os.path.dirname(self.path),exist_ok=True)
+        f = open(self.path,"ab")
+        f.write((json.dumps(record)+"\n").encode("utf-8"))
+        f.close()
+        pos = self.end
+        self.end = os.path.getsize(self.path)
+        if self.end > UndoJournal.max_bytes:
+            pos = self.compact(pos)
+        return pos
+
+    def compact(self, pos ):
+        """ drop the oldest transactions until the journal is under half of max_bytes by rewriting the rest of it,
+        a copy of the save mark goes in front when it was dropped too, returns where the record at pos ended up """
+        idx = 0
+        while idx < len(self.offsets) and self.end - self.offsets[idx] > UndoJournal.max_bytes // 2:
+            idx += 1
+        if idx == len(self.offsets):
+            keep = pos
+        else:
+            keep = self.offsets[idx]
+        head = b""
+        if keep >= self.saved:
+            head = (json.dumps(["save",self.key[0],self.key[1]])+"\n").encode("utf-8")
+        shift = len(head) - keep
+        f = open(self.path,"rb")
+        f.seek(keep)
+        tail = f.read()
+        f.close()
+        temp = self.path+".tmp"
+        o = open(temp,"wb")
+        o.write(head)
+        o.write(tail)
+        o.close()
+        os.replace(temp,self.path)
+        self.base += min(idx,len(self.offsets))
+        self.offsets = array('q',[offset+shift for offset in self.offsets[idx:]])
+        self.saved = max(len(head),self.saved+shift)
+        self.end = len(head)+len(tail)
+        return pos+shift
+
+    def mark(self, size, mtime ):
+        """ record that the file was saved with size and mtime, transactions before the mark always leave the file changed """
+        self.key = (size,mtime)
+        self.write(["save",size,mtime])
+        self.saved = self.end
+
+    def append(self, transaction ):
+        """ write a transaction to the journal, only the actions that change the file are kept, returns the number
+        of the transaction or None if it didn't change the file """
+        ops = []
+        for action in transaction.list:
+            name = getattr(action.func,"__name__",None)
+            if name not in UndoJournal.replay_funcs:
+                continue
+            args = action.tpl
+            if name == "_deleteLine":
+                ops.append([name,args[0],None,args[1]])
+            else:
+                content = args[1]
+                if isinstance(content,EditLine):
+                    content = content.getContent()
+                ops.append([name,args[0],content,args[2]])
+        if ops:
+            if not self.end or not self.cut:
+                self.mark(*self.key)
+            pos = self.write(["undo",ops])
+            self.offsets.append(pos)
+            return self.base+len(self.offsets)-1
+        return None
+
+    def discard(self, number ):
+        """ drop transaction number and everything after it, used when it is undone from memory, the file is cut
+        back when the next record is written so until then it still matches the file as it was saved """
+        idx = max(0,number-self.base)
+        if idx < len(self.offsets):
+            self.pop(self.offsets[idx])
+
+    def pop(self, pos ):
+        """ drop the transactions at or after pos """
+        while self.offsets and self.offsets[-1] >= pos:
+            self.offsets.pop()
+        if self.cut < 0 or pos < self.cut:
+            self.cut = pos
+
+    def undo(self):
+        """ pop the last transaction off of the journal and replay it through the target """
+        pos = self.offsets[-1]
+        f = open(self.path,"rb")
+        f.seek(pos)
+        record = json.loads(f.readline().decode("utf-8"))
+        f.close()
+        self.pop(pos)
+        for name, line, content, changed in reversed(record[1]):
+            func = getattr(self.target,name)
+            if pos < self.saved:
+                changed = True
+            if content == None:
+                func(line,changed)
+            else:
+                func(line,MemLine(content),changed)
 
 class UndoManager:
-    """ manager for a list of undo transactions for a given context """
-    def __init__(self):
-        """ construct an UndoManager, no arguments """
-        self.transactions = []
+    """ manager for a list of undo transactions for a given context, the transactions are kept under a
+    memory budget of max_bytes by spilling the oldest ones to the journal, or dropping them if there isn't one,
+    runs of transactions that only record cursor state are coalesced into the oldest one """
+    default_max_bytes = 16777216
+
+    def __init__(self, max_bytes = None ):
+        """ construct an UndoManager, max_bytes defaults to UndoManager.default_max_bytes """
+        if max_bytes == None:
+            max_bytes = UndoManager.default_max_bytes
+        self.transactions = collections.deque()
         self.inundo = False
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.journal = None
+        # number of the oldest transactions that have been through checkpoint, they are already in the journal
+        self.settled = 0
+        # arguments of the last action pushed, an action that shares them isn't charged for them again
+        self.charged = ()
 
     def __del__(self):
         self.transactions = None
@@ -63,29 +279,128 @@ class UndoManager:
     def inUndo(self):
         """ returns true if currently executing an undo, used to prevent recursion during undo """
         return self.inundo
-    
+
     def new_transaction(self):
         """ start a new transaction or return the current empty transaction """
         if not self.transactions or not self.transactions[-1].isEmpty():
+            if len(self.transactions) > 1:
+                last = self.transactions[-1]
+                prev = self.transactions[-2]
+                if last.isCoalesced() and prev.isCoalesced() and last.coalesced == prev.coalesced:
+                    self.transactions.pop()
+                    self.bytes -= last.size
+                    self.settled = min(self.settled,len(self.transactions))
+                    return self.new_transaction()
             self.transactions.append(UndoTransaction(self))
         return self.transactions[-1]
 
     def get_transaction(self):
-        """ return the current transaction if any """
-        if self.transactions:
+        """ return the current transaction, a new one is started if there isn't one or it was already journaled,
+        nothing is recorded during an undo so a transaction that isn't kept is returned then """
+        if self.inundo:
+            return UndoTransaction(self)
+        if self.transactions and self.settled < len(self.transactions):
             return self.transactions[-1]
         else:
             return self.new_transaction()
 
+    def set_journal(self, journal ):
+        """ set the UndoJournal that transactions are spilled to, None to drop them instead """
+        self.journal = journal
+        self.settled = 0
+        for transaction in self.transactions:
+            transaction.journal_pos = None
+
+    def grow(self, size ):
+        """ account for size more bytes held by the current transaction and spill or drop the oldest transactions
+        if that puts us over budget, the current transaction is always kept in memory """
+        self.bytes += size
+        while self.bytes > self.max_bytes and len(self.transactions) > 1:
+            self.drop()
+
+    def drop(self):
+        """ remove the oldest transaction from memory, spilling it to the journal if we have one """
+        transaction = self.transactions.popleft()
+        self.bytes -= transaction.size
+        if self.settled:
+            self.settled -= 1
+        elif self.journal != None:
+            self.journal.append(transaction)
+
+    def checkpoint(self):
+        """ called before the file is saved, the transactions added since the last save have their FileLine arguments
+        replaced with MemLines holding the text since a FileLine points at an offset in the file as it is now,
+        undoing any of them after the save leaves the file changed, they are written to the journal so the history
+        of the saved file survives a restart but stay in memory so undo still restores the cursor """
+        if not self.transactions:
+            return
+        last = self.transactions[-1]
+        skip = 0
+        if last.isCoalesced():
+            # nothing to save in the open transaction yet, it is settled by the next checkpoint
+            skip = 1
+        count = max(0,len(self.transactions) - self.settled - skip)
+        detached = {}
+        for transaction in reversed(list(itertools.islice(reversed(self.transactions),skip,skip+count))):
+            for action in transaction.list:
+                if getattr(action.func,"__name__",None) not in UndoJournal.replay_funcs:
+                    continue
+                args = list(action.tpl)
+                for idx, arg in enumerate(args):
+                    if isinstance(arg,FileLine):
+                        if id(arg) not in detached:
+                            detached[id(arg)] = (arg,MemLine(arg.getContent()))
+                            delta = arg_size(detached[id(arg)][1]) - arg_size(arg)
+                            action.size += delta
+                            transaction.size += delta
+                            self.bytes += delta
+                        args[idx] = detached[id(arg)][1]
+                args[-1] = True
+                action.tpl = tuple(args)
+            if self.journal != None:
+                transaction.journal_pos = self.journal.append(transaction)
+        self.settled += count
+        self.charged = ()
+        if not last.isCoalesced():
+            # edits made after the save go in a transaction of their own
+            self.new_transaction()
+        self.grow(0)
+
+    def set_max_bytes(self, max_bytes ):
+        """ change the memory budget, dropping the oldest transactions if needed """
+        self.max_bytes = max_bytes
+        self.grow(0)
+
+    def size(self):
+        """ return the estimated number of bytes held by the undo transactions """
+        return self.bytes
+
+    def stats(self):
+        """ return a tuple of (number of transactions, number of actions, bytes) """
+        return (len(self.transactions), sum([len(t.list) for t in self.transactions]), self.bytes)
+
     def undo_transaction(self):
-        """ undo the current transaction """
+        """ undo the current transaction, once the transactions in memory are used up they come from the journal """
+        self.charged = ()
         if self.transactions:
             self.inundo = True
-            self.transactions[-1].undo()
-            del self.transactions[-1]
+            transaction = self.transactions.pop()
+            self.bytes -= transaction.size
+            if self.settled > len(self.transactions):
+                self.settled = len(self.transactions)
+                if transaction.journal_pos != None and self.journal != None:
+                    self.journal.discard(transaction.journal_pos)
+            transaction.undo()
+            self.inundo = False
+        elif self.journal != None and len(self.journal):
+            self.inundo = True
+            self.journal.undo()
             self.inundo = False
-        return not self.transactions
+        return not self.transactions and not (self.journal != None and len(self.journal))
 
     def flush_undo(self):
-        """ free the transactions and forget all the undo information """
-        self.transactions = []
+        """ free the transactions in memory, any that were spilled to the journal are kept """
+        self.transactions = collections.deque()
+        self.bytes = 0
+        self.settled = 0
+        self.charged = ()
@@ -0,0 +1,261 @@
+# Copyright 2009 James P Goodwin ped tiny python editor
+""" module that implements the soft wrap index for the ped editor, maps file lines to display rows and back """
+import bisect
+import itertools
+from array import array
+
+class Fenwick:
+    """ binary indexed tree over a list of counts, gives prefix sums, point updates and the search for the entry
+    that contains a given cumulative count in O(log n) """
+    def __init__(self, values ):
+        """ values is the list of counts to start with """
+        n = len(values)
+        tree = [0] + list(values)
+        for i in range(1,n+1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+        self.n = n
+        self.top = 1
+        while self.top*2 <= n:
+            self.top *= 2
+        self.sum = sum(values)
+
+    def add(self, idx, delta ):
+        """ add delta to the count at idx """
+        self.sum += delta
+        i = idx + 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, idx ):
+        """ return the sum of the counts before idx """
+        total = 0
+        i = idx
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def total(self):
+        """ return the sum of all of the counts """
+        return self.sum
+
+    def search(self, target ):
+        """ return (idx, prefix(idx)) for the first idx whose count takes the running sum past target, idx is n if
+        target is at or past the total """
+        pos = 0
+        rem = target
+        step = self.top if self.n else 0
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= rem:
+                pos = nxt
+                rem -= self.tree[nxt]
+            step >>= 1
+        return (pos, target-rem)
+
+class WrapIndex:
+    """ the number of display rows each line of an EditFile wraps to at a given width, the rows are kept in blocks
+    of lines with Fenwick trees over the lines and rows in each block so converting between file lines and display
+    rows, inserting and deleting lines are O(log n), the index is a view of the file's ChangeManager so only lines
+    that change are measured again, files with more than lazy_lines lines are only measured up to the last line
+    that has been looked at and the rest count as one row each """
+    block_size = 512
+    lazy_lines = 100000
+    lazy_chunk = 4096
+
+    def __init__(self, workfile, width ):
+        """ workfile is the EditFile to index, width is the number of columns each display row holds """
+        self.workfile = workfile
+        self.width = max(1,width)
+        self.change_mgr = workfile.change_mgr
+        self.serial = 0
+        if self.change_mgr:
+            self.change_mgr.add_view(self)
+            self.workfile.flushChanges(self)
+            self.serial = self.change_mgr.serial
+        nlines = workfile.numLines()
+        self.nlines = nlines
+        self.frontier = 0
+        self.set_blocks([array('i',[1])*min(WrapIndex.block_size,nlines-start) for start in range(0,nlines,WrapIndex.block_size)])
+        if nlines <= WrapIndex.lazy_lines:
+            self.measure_to(nlines)
+
+    def detach(self):
+        """ stop following the changes to the file """
+        if self.change_mgr:
+            self.change_mgr.remove_view(self)
+            self.change_mgr = None
+
+    def set_blocks(self, blocks ):
+        """ install a new list of blocks and build the trees over them """
+        if not blocks:
+            blocks = [array('i')]
+        self.blocks = blocks
+        self.sums = [None]*len(blocks)
+        self.lines = Fenwick([len(b) for b in blocks])
+        self.rows = Fenwick([sum(b) for b in blocks])
+
+    def rebalance(self):
+        """ split the rows back into even blocks, used when a block grows too big """
+        rows = array('i')
+        for b in self.blocks:
+            rows.extend(b)
+        self.set_blocks([rows[start:start+WrapIndex.block_size] for start in range(0,len(rows),WrapIndex.block_size)])
+
+    def locate(self, line ):
+        """ return (block, offset) of line, the line after the last is the end of the last block """
+        b, prefix = self.lines.search(line)
+        if b >= len(self.blocks):
+            b = len(self.blocks)-1
+            return (b, len(self.blocks[b]))
+        return (b, line-prefix)
+
+    def block_sums(self, b ):
+        """ return the running sums of the rows in block b, they are kept until the block changes """
+        sums = self.sums[b]
+        if sums == None:
+            sums = list(itertools.accumulate(self.blocks[b]))
+            self.sums[b] = sums
+        return sums
+
+    def row_count(self, length ):
+        """ return the number of display rows for a line of length characters """
+        return max(1,(length+self.width-1)//self.width)
+
+    def measure_range(self, start, end ):
+        """ measure the lines from start up to end again and update the trees, returns True if any of them changed """
+        changed = False
+        while start < end:
+            b, off = self.locate(start)
+            block = self.blocks[b]
+            count = min(end-start,len(block)-off)
+            if count <= 0:
+                break
+            new_rows = array('i',[self.row_count(self.workfile.length(line)) for line in range(start,start+count)])
+            old_rows = block[off:off+count]
+            if new_rows != old_rows:
+                block[off:off+count] = new_rows
+                self.rows.add(b,sum(new_rows)-sum(old_rows))
+                self.sums[b] = None
+                changed = True
+            start += count
+        return changed
+
+    def measure_to(self, line ):
+        """ make sure the lines before line are measured """
+        if line > self.frontier:
+            line = min(self.nlines,line)
+            self.measure_range(self.frontier,line)
+            self.frontier = line
+
+    def update(self):
+        """ follow the lines inserted, deleted and changed in the file since the last update, returns None if the
+        index can't follow them and has to be built again, otherwise True if the rows after the changes moved """
+        change_mgr = self.workfile.change_mgr
+        if not change_mgr or change_mgr is not self.change_mgr or self not in change_mgr.views:
+            return None
+        shifts = change_mgr.get_shifts(self.serial)
+        if shifts == None:
+            return None
+        if change_mgr.batch:
+            change_mgr.apply_batch()
+        moved = False
+        for line, count in shifts:
+            if count > 0:
+                self.insert(line,count)
+            else:
+                self.delete(line,-count)
+            moved = True
+        self.serial = change_mgr.serial
+        # lines can be appended or trimmed at the end without a shift
+        nlines = self.workfile.numLines()
+        if nlines > self.nlines:
+            self.insert(self.nlines,nlines-self.nlines)
+            moved = True
+        elif nlines < self.nlines:
+            self.delete(nlines,self.nlines-nlines)
+            moved = True
+        view = change_mgr.views[self]
+        for start, end in zip(view.starts,view.ends):
+            if start >= self.frontier:
+                break
+            if self.measure_range(start,min(end+1,self.frontier)):
+                moved = True
+        change_mgr.flush(self)
+        if self.nlines <= WrapIndex.lazy_lines:
+            self.measure_to(self.nlines)
+        return moved
+
+    def insert(self, line, count ):
+        """ insert count lines at line, they are one row each until they are measured """
+        b, off = self.locate(line)
+        block = self.blocks[b]
+        block[off:off] = array('i',[1])*count
+        self.sums[b] = None
+        self.lines.add(b,count)
+        self.rows.add(b,count)
+        self.nlines += count
+        if line < self.frontier:
+            self.frontier += count
+        if len(block) > 2*WrapIndex.block_size:
+            self.rebalance()
+
+    def delete(self, line, count ):
+        """ delete count lines at line """
+        count = min(count,self.nlines-line)
+        if count <= 0:
+            return
+        if line < self.frontier:
+            self.frontier -= min(count,self.frontier-line)
+        self.nlines -= count
+        while count > 0:
+            b, off = self.locate(line)
+            block = self.blocks[b]
+            take = min(count,len(block)-off)
+            rows = sum(block[off:off+take])
+            del block[off:off+take]
+            self.sums[b] = None
+            self.lines.add(b,-take)
+            self.rows.add(b,-rows)
+            count -= take
+
+    def numLines(self):
+        """ return the number of file lines in the index """
+        return self.nlines
+
+    def numRows(self):
+        """ return the number of display rows """
+        return self.rows.total()
+
+    def lineRows(self, line ):
+        """ return the number of display rows line wraps to """
+        self.measure_to(line+1)
+        b, off = self.locate(line)
+        return self.blocks[b][off]
+
+    def toRow(self, line ):
+        """ return the display row of the start of file line """
+        self.measure_to(line+1)
+        b, off = self.locate(line)
+        return self.rows.prefix(b) + (self.block_sums(b)[off-1] if off else 0)
+
+    def toLine(self, row ):
+        """ return (line, segment) for display row, rows past the end give lines past the end with segment 0 """
+        while True:
+            b, prefix = self.rows.search(row)
+            if b >= len(self.blocks):
+                if self.frontier < self.nlines:
+                    self.measure_to(self.frontier+WrapIndex.lazy_chunk)
+                    continue
+                return (self.nlines + (row - self.rows.total()), 0)
+            sums = self.block_sums(b)
+            off = bisect.bisect_right(sums,row-prefix)
+            line = self.lines.prefix(b) + off
+            if line >= self.frontier:
+                self.measure_to(line+WrapIndex.lazy_chunk)
+                continue
+            return (line, row - prefix - (sums[off-1] if off else 0))
@@ -674,6 +674,9 @@ class PasswordPrompt(Prompt):
 
 class Dialog(Component):
     history = {}
+    # count of the dialogs opened, they draw into their parent's screen memory so editors check this to know
+    # their windows may have been drawn over
+    opened = 0
 
     def __init__(self, parent, name, height, width, children, y = -1, x = -1 ):
         Component.__init__(self,name,0)
@@ -687,6 +690,7 @@ class Dialog(Component):
         else:
             self.win = parent.subwin(height,width,y,x)
 
+        Dialog.opened += 1
         self.win.clear()
         self.win.keypad(1)
         curses.meta(1)
@@ -854,6 +858,8 @@ class Dialog(Component):
             if (not keymap.keypending(self.win)) or force:
                 self.render()
             if not ch_in:
+                if blocking:
+                    keymap.wait_for_input(self.win)
                 ch = self.handle(keymap.get_keyseq(self.win,keymap.getch(self.win)))
             else:
                 ch = self.handle(ch_in)
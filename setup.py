@@ -26,7 +26,7 @@ setup(
         'ide',
     ],
     install_requires=[
-        'Pygments>=2.1',
+        'Pygments>=2.2',
         'paramiko>=2.0.9',
     ],
     scripts=[
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Copyright 2009 James P Goodwin ped tiny python editor
+""" benchmark that compares loading a large file with the old readline based loader against the block newline scanner,
+run it from the top of the source tree with: PYTHONPATH=. python3 tests/bench_load.py [number of lines] """
+import sys
+import os
+import time
+import tempfile
+import mmap
+from array import array
+from ped_core import line_buffer
+from ped_core import editor_common
+
+def legacy_load( filename ):
+    """ the line loop that EditFile.load used to run over a text mode working file, returns the number of lines """
+    ef = editor_common.EditFile()
+    working = open(filename,"r",buffering=1,encoding="utf-8")
+    lines = []
+    pos = 0
+    while True:
+        line = working.readline()
+        if not line:
+            break
+        line = line.rstrip()
+        lines.append(editor_common.FileLine(ef,pos,len(ef.expand_tabs(line))))
+        pos = working.tell()
+    working.close()
+    return len(lines)
+
+def scan_load( filename ):
+    """ find all of the line offsets with the block scanner the way the EditFile and its IndexThread do, returns the number of lines """
+    f = open(filename,"rb")
+    working = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    f.close()
+    offsets = array('q')
+    pos = 0
+    limit = 0
+    size = len(working)
+    while pos < size:
+        limit = min(size,limit+editor_common.EditFile.index_block_size)
+        block, pos = line_buffer.scan_lines(working,pos,limit)
+        offsets.extend(block)
+    working = None
+    return len(offsets)
+
+def bench( name, loader, filename ):
+    """ time one loader and print its rate """
+    start = time.time()
+    nlines = loader(filename)
+    elapsed = time.time() - start
+    print("%-8s %10d lines %8.3f s %12.0f lines/s"%(name,nlines,elapsed,nlines/elapsed))
+    return nlines
+
+if __name__ == '__main__':
+    nlines = 1000000
+    if len(sys.argv) > 1:
+        nlines = int(sys.argv[1])
+    tf = tempfile.NamedTemporaryFile(mode="w",suffix=".txt",delete=False)
+    for idx in range(0,nlines):
+        tf.write("    line %d of the benchmark file\twith a tab\n"%idx)
+    tf.close()
+    try:
+        print("numpy %s"%("enabled" if line_buffer.numpy else "not available"))
+        legacy = bench("legacy",legacy_load,tf.name)
+        scanned = bench("scan",scan_load,tf.name)
+        if line_buffer.numpy:
+            numpy = line_buffer.numpy
+            line_buffer.numpy = None
+            bench("nonumpy",scan_load,tf.name)
+            line_buffer.numpy = numpy
+        assert(legacy == scanned)
+    finally:
+        os.remove(tf.name)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Copyright 2009 James P Goodwin ped tiny python editor
+""" benchmark that compares the curses calls, bytes written and time per frame of the old per character syntax render
+against the span batched render, with and without the shadow screen, run it in a terminal from the top of the source
+tree with: PYTHONPATH=. python3 tests/bench_render.py [frames] """
+import sys
+import os
+import time
+import tempfile
+import curses
+from pygments.lexers import PythonLexer
+from pygments.token import Token
+from ped_core import editor_common
+from ped_core import mode
+from ped_core import python_mode
+from ped_core import shadow_screen
+from ped_core.mode import is_token_in
+
+class CountingWindow:
+    """ wraps a curses window and counts the addstr calls and bytes written to it """
+    def __init__(self, win ):
+        self.win = win
+        self.calls = 0
+        self.bytes = 0
+
+    def addstr(self, row, col, s, attr = curses.A_NORMAL ):
+        self.calls += 1
+        self.bytes += len(s)
+        return self.win.addstr(row,col,s,attr)
+
+    def __getattr__(self, name ):
+        return getattr(self.win,name)
+
+def legacy_render( editor, tokens, keywords, strings, comments ):
+    """ the per character render that mode.render used to be, kept here to compare against """
+    curses.init_pair(1,curses.COLOR_GREEN,curses.COLOR_BLACK)
+    curses.init_pair(2,curses.COLOR_RED,curses.COLOR_BLACK)
+    curses.init_pair(3,curses.COLOR_CYAN,curses.COLOR_BLACK)
+    curses.init_pair(4,curses.COLOR_WHITE,curses.COLOR_BLACK)
+
+    green = curses.color_pair(1)
+    red = curses.color_pair(2)
+    cyan = curses.color_pair(3)
+    white = curses.color_pair(4)
+
+    if tokens:
+        tokens = tokens.getTokens()
+    else:
+        tokens = []
+    cursor_line,cursor_pos = editor.prevPos()
+    sc_cursor_line,sc_cursor_pos = editor.window_pos(cursor_line,cursor_pos)
+    start_line = editor.line
+    lidx = start_line
+    max_sc_line = 1
+    while lidx < start_line+(editor.max_y-1):
+        f_line,f_pos = editor.filePos(lidx,editor.left)
+        line_changed = editor.workfile.isLineChanged(editor,f_line)
+        is_cursor_line = (f_line == cursor_line)
+        if line_changed or is_cursor_line:
+            if f_line < len(tokens) and tokens[f_line] != None:
+                sc_line,sc_pos = editor.window_pos(f_line,f_pos)
+                if line_changed and sc_line > 0:
+                    editor.addstr(sc_line,0,' '*editor.max_x)
+                if is_cursor_line:
+                    editor.addstr(sc_cursor_line,sc_cursor_pos,' ')
+                line = editor.workfile.getLine(f_line)
+                for (t_scol, t_len, t_type) in mode.unpack_tokens(tokens[f_line]):
+                    t_text = line[t_scol:t_scol+t_len]
+                    if is_token_in(t_type,keywords):
+                        attr = cyan
+                    elif is_token_in(t_type,strings):
+                        attr = green
+                    elif is_token_in(t_type,comments):
+                        attr = red
+                    else:
+                        attr = white
+                    for ch in t_text:
+                        sc_line,sc_pos = editor.window_pos(f_line,t_scol)
+                        if sc_line > 0 and sc_line < editor.max_y and sc_pos >= 0 and sc_pos < editor.max_x:
+                            if line_changed or (is_cursor_line and sc_line == sc_cursor_line and sc_pos == sc_cursor_pos):
+                                editor.addstr(sc_line,sc_pos,ch,attr)
+                        t_scol += 1
+                if sc_line > max_sc_line:
+                    max_sc_line = sc_line
+            else:
+                if lidx >= editor.numLines(True):
+                    max_sc_line += 1
+                    editor.addstr(max_sc_line,0,' '*editor.max_x)
+                else:
+                    sc_line,sc_pos = editor.window_pos(f_line,f_pos)
+                    l = editor.getContent(lidx,editor.left+editor.max_x,True,True)
+                    if line_changed and sc_line > 0:
+                        editor.addstr(sc_line,0,l[editor.left:editor.left+editor.max_x])
+                    if is_cursor_line:
+                        editor.addstr(sc_cursor_line,sc_cursor_pos,l[sc_cursor_pos])
+
+                    if sc_line > max_sc_line:
+                        max_sc_line = sc_line
+        else:
+            if lidx >= editor.numLines(True):
+                max_sc_line += 1
+            else:
+                sc_line,sc_pos = editor.window_pos(f_line,f_pos)
+                if sc_line > max_sc_line:
+                    max_sc_line = sc_line
+
+        lidx = lidx + 1
+
+    return True
+
+def bench( name, ed, frames, render, shadow = False, scroll = False ):
+    """ redraw the whole window frames times with render, optionally through a shadow screen and scrolling a line
+    each frame, returns (name, addstr calls per frame, bytes per frame, seconds per frame) """
+    win = ed.scr
+    counter = CountingWindow(win)
+    ed.scr = counter
+    if shadow:
+        ed.shadow = shadow_screen.ShadowScreen(*win.getmaxyx())
+    else:
+        ed.shadow = None
+    start = time.time()
+    for idx in range(0,frames):
+        if scroll:
+            ed.line = idx % 1000
+        ed.invalidate_screen()
+        render()
+        win.refresh()
+    elapsed = time.time() - start
+    ed.scr = win
+    ed.shadow = None
+    ed.line = 0
+    return (name,counter.calls/frames,counter.bytes/frames,elapsed/frames)
+
+def main( stdscr, filename, frames, results ):
+    """ set up an editor on the file, tokenize it and time both renders """
+    ed = editor_common.Editor(stdscr,None,filename)
+    max_y,max_x = stdscr.getmaxyx()
+    ed.setWin(stdscr.subwin(max_y,max_x,0,0))
+    ed.resize()
+    tokens = mode.Tokens()
+    mode.gen_tokens(tokens,PythonLexer(),ed.workfile.snapshot(),ed.workfile,(0,0))
+    results.append(bench("legacy",ed,frames,lambda: legacy_render(ed,tokens,
+        [Token.Operator.Word,Token.Name.Builtin.Pseudo,Token.Keyword,Token.Keyword.Namespace],
+        [Token.Text,Token.String,Token.Literal.String,Token.Literal.String.Single,Token.Literal.String.Double,Token.Literal.String.Doc],
+        [Token.Comment,Token.Comment.Hashbang,Token.Comment.Multiline,Token.Comment.Single])))
+    results.append(bench("spans",ed,frames,lambda: mode.render(ed,tokens,python_mode.token_attrs)))
+    results.append(bench("shadow",ed,frames,lambda: mode.render(ed,tokens,python_mode.token_attrs),True))
+    results.append(bench("scroll",ed,frames,lambda: mode.render(ed,tokens,python_mode.token_attrs),False,True))
+    results.append(bench("scroll+shadow",ed,frames,lambda: mode.render(ed,tokens,python_mode.token_attrs),True,True))
+    ed.close()
+
+if __name__ == '__main__':
+    frames = 200
+    if len(sys.argv) > 1:
+        frames = int(sys.argv[1])
+    tf = tempfile.NamedTemporaryFile(mode="w",suffix=".py",delete=False)
+    for idx in range(0,2000):
+        tf.write("def function_%d( arg, other = 'a string %d' ):\n    # comment for line %d\n    return arg + other * %d\n"%(idx,idx,idx,idx))
+    tf.close()
+    results = []
+    try:
+        curses.wrapper(main,tf.name,frames,results)
+    finally:
+        os.remove(tf.name)
+    for name, calls, nbytes, seconds in results:
+        print("%-14s %10.1f addstr calls/frame %10.1f bytes/frame %10.3f ms/frame"%(name,calls,nbytes,seconds*1000))
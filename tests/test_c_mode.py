@@ -27,7 +27,7 @@ def test_c_mode(testdir,capsys):
             max_y,max_x = stdscr.getmaxyx()
             ed = editor_common.Editor(stdscr,stdscr.subwin(max_y,max_x,0,0),str(testfile))
             validate_screen(ed)
-            assert(ed.mode and ed.mode.name() == "C")
+            assert(ed.mode and ed.mode.name(ed) == "C")
             match_list = [(0,0,18,red),(2,2,48,red),(3,2,6,white),(3,9,15,green),(4,9,1,green),(1,0,3,cyan),(4,2,6,cyan)]
             for line,pos,width,attr in match_list:
                 assert(match_attr(ed.scr,line+1,pos,1,width,attr))
@@ -64,10 +64,22 @@ def test_c_mode(testdir,capsys):
 
             ed = editor_common.Editor(stdscr,stdscr.subwin(max_y,max_x,0,0),str(testfile))
             validate_screen(ed)
-            assert(ed.mode and ed.mode.name() == "C++")
+            assert(ed.mode and ed.mode.name(ed) == "C++")
             match_list = [(0,0,25,red),(2,0,19,red),(5,2,12,white),(5,15,14,green),(6,9,1,green),(4,0,3,cyan),(6,2,6,cyan)]
             for line,pos,width,attr in match_list:
                 assert(match_attr(ed.scr,line+1,pos,1,width,attr))
 
 
         curses.wrapper(main)
+
+def test_c_mode_lexer_follows_filename(testdir):
+    from ped_core import cpp_mode, guess_mode
+    testfile = testdir.makefile(".c", c_rename_test="int main() { return 0; }")
+    ef = editor_common.EditFile(str(testfile))
+    tokens = cpp_mode.get_tokens(ef)
+    assert(tokens.getLexer().name == "C" and cpp_mode.get_tokens(ef) is tokens)
+    ef.setFilename(str(testfile)[:-2]+".cpp")
+    assert(cpp_mode.get_tokens(ef).getLexer().name == "C++")
+    assert(guess_mode.get_tokens(ef).getLexer().name == "C++")
+    ef.setFilename(str(testfile)[:-2]+".py")
+    assert(guess_mode.get_tokens(ef).getLexer().name == "Python")
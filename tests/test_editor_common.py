@@ -9,8 +9,9 @@ import re
 from ped_core import keymap
 from ped_core import keytab
 from ped_core import clipboard
-from ped_test_util import read_str, match_attr, undo_all, window_pos, play_macro, validate_mark, validate_screen, editor_test_suite
+from ped_test_util import read_str, match_attr, undo_all, window_pos, play_macro, validate_mark, validate_screen, editor_test_suite, wait_for_screen
 import subprocess
+import copy
 
 def test_memline():
     m = editor_common.MemLine( "01234567890123456789" )
@@ -126,6 +127,452 @@ def test_EditFile(testdir):
     expanded_string = "01234   56789012        3456789"
     assert(ef.expand_tabs(tabby_string) == expanded_string)
 
+def test_EditFile_mapped(testdir):
+    lines_to_test = ["First line","\tSecond line","Third line   ","Last line"]
+    testfile = testdir.makefile(".txt",*lines_to_test)
+    fn = str(testfile)
+    fd = str(testdir.tmpdir)
+    editor_common.EditFile.get_backup_dir(fd)
+    before = os.listdir(os.path.join(fd,".pedbackup"))
+    ef = editor_common.EditFile()
+    ef.backuproot = fd
+    ef.filename = fn
+    ef.load()
+    assert(os.listdir(os.path.join(fd,".pedbackup")) == before)
+    assert(ef.numLines() == 4)
+    assert(ef.getLine(1) == "    Second line")
+    assert(ef.getLine(2) == "Third line")
+    ef.replaceLine(0,"Changed line")
+    assert(os.listdir(os.path.join(fd,".pedbackup")) == before)
+    ef.save(fn)
+    assert(ef.numLines() == 4)
+    assert([l.rstrip() for l in open(fn,"r")] == ["Changed line","\tSecond line","Third line","Last line"])
+    ef.close()
+
+def edited_lines( lb ):
+    return len([pos for ids, mem in lb.blocks() for pos in ids if pos < 0])
+
+def test_LineBuffer(testdir):
+    lines_to_test = ["line %d\tend"%idx for idx in range(0,1000)]
+    testfile = testdir.makefile(".txt",*lines_to_test)
+    default_line_buffer = editor_common.EditFile.default_line_buffer
+    try:
+        for line_buffer in [editor_common.ArrayLineBuffer, editor_common.RopeLineBuffer]:
+            editor_common.EditFile.default_line_buffer = line_buffer
+            ef = editor_common.EditFile(str(testfile))
+            lb = ef.lines
+            assert(isinstance(lb,line_buffer))
+            assert(len(lb) == 1000 and edited_lines(lb) == 0)
+            assert(isinstance(lb[10],editor_common.FileLine))
+            assert(lb.getContent(10) == "line 10\tend")
+            assert(ef.length(10) == len("line 10 end"))
+            ef.set_tabs([12,24])
+            assert(ef.length(10) == len("line 10     end"))
+            ef.replaceLine(10,"replaced")
+            ef.insertLine(0,"inserted")
+            ef.deleteLine(500)
+            assert(len(lb) == 1000 and edited_lines(lb) == 2)
+            assert(ef.getLine(0) == "inserted")
+            assert(ef.getLine(11) == "replaced")
+            assert(ef.getLine(500) == "line 500    end")
+            cf = copy.copy(ef)
+            ef.undo_mgr.undo_transaction()
+            assert(edited_lines(lb) == 0)
+            assert(ef.getLines() == [ef.expand_tabs(l) for l in lines_to_test])
+            assert(cf.getLine(0) == "inserted" and cf.numLines() == 1000)
+            cf.close()
+            for idx in range(0,2000):
+                ef.insertLine(300,"pasted %d"%idx)
+            assert(ef.numLines() == 3000)
+            assert(ef.getLine(299) == "line 299    end")
+            assert(ef.getLine(300) == "pasted 1999")
+            assert(ef.getLine(2299) == "pasted 0")
+            assert(ef.getLine(2300) == "line 300    end")
+            for idx in range(0,2900):
+                ef.deleteLine(50)
+            assert(ef.numLines() == 100)
+            assert(ef.getLine(49) == "line 49     end")
+            assert(ef.getLine(50) == "line 950    end")
+            if line_buffer == editor_common.RopeLineBuffer:
+                assert(len(lb.chunks) == 1)
+            assert([l.getContent() for l in lb] == lines_to_test[:50]+lines_to_test[950:])
+            ef.close()
+    finally:
+        editor_common.EditFile.default_line_buffer = default_line_buffer
+
+def test_EditFile_snapshot(testdir):
+    lines_to_test = ["line %d of the file"%idx for idx in range(0,5000)]
+    testfile = testdir.makefile(".txt",*lines_to_test)
+    default_line_buffer = editor_common.EditFile.default_line_buffer
+    try:
+        for line_buffer in [editor_common.ArrayLineBuffer, editor_common.RopeLineBuffer]:
+            editor_common.EditFile.default_line_buffer = line_buffer
+            ef = editor_common.EditFile(str(testfile))
+            ef.replaceLine(100,"edited line")
+            sf = ef.snapshot()
+            assert(sf.isReadOnly() and sf.getModref() == ef.getModref())
+            if line_buffer == editor_common.RopeLineBuffer:
+                assert(sf.lines.chunks is ef.lines.chunks)
+            ef.replaceLine(100,"edited again")
+            ef.deleteLine(0)
+            ef.insertLine(4000,"inserted line")
+            if line_buffer == editor_common.RopeLineBuffer:
+                shared = [c for c in ef.lines.chunks if c in sf.lines.chunks]
+                assert(len(shared) == len(ef.lines.chunks)-2)
+            expected = list(lines_to_test)
+            expected[100] = "edited line"
+            assert(sf.numLines() == 5000)
+            assert(sf.getLines() == expected)
+            assert(ef.getLine(99) == "edited again" and ef.getLine(4000) == "inserted line")
+            sf.close()
+            assert(ef.getLine(99) == "edited again")
+            ef.change_mgr.add_view("tokens")
+            ef.change_mgr.add_view("editor")
+            ef.replaceLine(10,"edited for the views")
+            sf = ef.snapshot("tokens")
+            assert(sf.isLineChanged("tokens",10) and list(sf.change_mgr.views) == ["tokens"])
+            assert(not ef.isLineChanged("tokens",10) and ef.isLineChanged("editor",10))
+            sf.close()
+            ef.close()
+    finally:
+        editor_common.EditFile.default_line_buffer = default_line_buffer
+
+def test_EditFile_indexing(testdir):
+    lines_to_test = ["line %d of the file"%idx for idx in range(0,5000)]
+    testfile = testdir.makefile(".txt",*lines_to_test)
+    index_block_size = editor_common.EditFile.index_block_size
+    try:
+        editor_common.EditFile.index_block_size = 256
+        ef = editor_common.EditFile(str(testfile))
+        assert(len(ef.lines) < 5000)
+        assert(ef.getLine(0) == lines_to_test[0])
+        ef.waitForLine(2500)
+        assert(ef.numLines() > 2500)
+        assert(ef.getLine(2500) == lines_to_test[2500])
+        ef.replaceLine(3000,"changed line")
+        assert(ef.getLine(3000) == "changed line")
+        ef.waitForLine(-1)
+        assert(not ef.isIndexing())
+        assert(ef.numLines() == 5000)
+        assert(ef.getLine(4999) == lines_to_test[4999])
+        ef.close()
+        ef = editor_common.EditFile(str(testfile))
+        assert(len(ef.getLines()) == 5000)
+        ef.close()
+    finally:
+        editor_common.EditFile.index_block_size = index_block_size
+
+def test_EditFile_line_cache(testdir):
+    lines_to_test = ["line\t%d"%idx for idx in range(0,100)]
+    testfile = testdir.makefile(".txt",*lines_to_test)
+    ef = editor_common.EditFile(str(testfile))
+    lc = ef.line_cache
+    for idx in range(0,100):
+        assert(ef.getLine(idx) == ef.expand_tabs(lines_to_test[idx]))
+    assert(lc.stats() == (0,100,100,lc.bytes))
+    for idx in range(0,100):
+        assert(ef.getLine(idx,20) == ef.expand_tabs(lines_to_test[idx]).ljust(20))
+    assert(lc.hits == 100 and lc.misses == 100)
+    ef.insertLine(0,"new\tline")
+    assert(ef.getLine(50) == ef.expand_tabs(lines_to_test[49]))
+    assert(lc.hits == 101)
+    ef.replaceLine(50,"replaced")
+    ef.deleteLine(51)
+    assert(len(lc.lines) == 98)
+    assert(ef.getLine(50) == "replaced")
+    assert(ef.getLine(51) == ef.expand_tabs(lines_to_test[51]))
+    ef.set_tabs([8,16])
+    assert(len(lc.lines) == 0)
+    assert(ef.getLine(1) == "line    0")
+    lc.set_max_bytes(lc.bytes*10)
+    for idx in range(0,100):
+        ef.getLine(idx)
+    assert(len(lc.lines) < 15 and lc.bytes <= lc.max_bytes)
+    assert(ef.getLine(99) == ef.expand_tabs(lines_to_test[99]))
+    ef.close()
+
+def test_EditFile_save_ranges(testdir):
+    lines_to_test = ["line %d of the file"%idx for idx in range(0,3000)]
+    testfile = testdir.makefile(".txt",*lines_to_test)
+    fn = str(testfile)
+    for newline in ["\n","\r\n"]:
+        open(fn,"w",newline="").write(newline.join(lines_to_test)+newline)
+        ef = editor_common.EditFile(fn)
+        assert(ef.newline == newline)
+        size = os.path.getsize(fn)
+        expected = list(lines_to_test)
+        ef.replaceLine(1500,"changed line")
+        expected[1500] = "changed line"
+        ef.deleteLine(10)
+        del expected[10]
+        ef.lines[2000], ef.lines[2001] = ef.lines[2001], ef.lines[2000]
+        expected[2000], expected[2001] = expected[2001], expected[2000]
+        ef.save(fn)
+        copied, encoded = ef.getSaveStats()
+        assert(encoded == len("changed line"+newline))
+        assert(copied + encoded == os.path.getsize(fn))
+        assert(copied == size - len(lines_to_test[1500]+newline) - len(lines_to_test[10]+newline))
+        assert(open(fn,"r",newline="").read() == newline.join(expected)+newline)
+        assert(ef.getLines() == expected)
+        ef.close()
+    fd = str(testdir.tmpdir)
+    ef = editor_common.EditFile(fn)
+    ef.backuproot = fd
+    ef.replaceLine(0,"first line")
+    ef.save()
+    backup_path = editor_common.EditFile.make_backup_dir(fn,fd)
+    assert(os.path.dirname(backup_path) in editor_common.EditFile.backup_dirs)
+    assert(open(backup_path,"r").read().startswith(lines_to_test[0]))
+    assert(open(fn,"r",newline="").read().startswith("first line\r\n"))
+    assert(ef.getLine(0) == "first line" and ef.getLines()[1:] == expected[1:])
+    assert(not [f for f in os.listdir(os.path.dirname(fn)) if f.endswith(".sav")])
+    ef.close()
+
+def test_EditFile_undo_journal(testdir):
+    lines_to_test = ["line %d of the file"%idx for idx in range(0,200)]
+    testfile = testdir.makefile(".txt",*lines_to_test)
+    fn = str(testfile)
+    fd = str(testdir.tmpdir)
+    backuproot = editor_common.EditFile.default_backuproot
+    max_bytes = editor_common.undo.UndoJournal.max_bytes
+    editor_common.EditFile.default_backuproot = fd
+    try:
+        ef = editor_common.EditFile(fn)
+        journal = ef.getUndoMgr().journal
+        assert(journal.path == editor_common.EditFile.make_backup_dir(fn,fd)+".undo")
+        ef.getUndoMgr().set_max_bytes(2048)
+        for idx in range(0,100):
+            ef.getUndoMgr().new_transaction()
+            ef.replaceLine(idx,"changed %d"%idx)
+        assert(len(journal) and ef.getUndoStats()[2] <= 2048)
+        ef.getUndoMgr().new_transaction()
+        ef.insertLine(0,"inserted")
+        ef.save()
+        assert(ef.getUndoStats()[0] and len(journal) == 101)
+        assert(not [arg for t in ef.getUndoMgr().transactions for a in t.list for arg in a.tpl if isinstance(arg,editor_common.FileLine)])
+        # edits since the save are written at the next save, undoing ones that were written drops them again
+        ef.getUndoMgr().new_transaction()
+        ef.replaceLine(150,"after save")
+        ef.getUndoMgr().undo_transaction()
+        assert(ef.getLine(150) == "line 149 of the file" and len(journal) == 101)
+        ef.getUndoMgr().undo_transaction()
+        assert(ef.getLine(0) == "changed 0" and ef.isChanged() and len(journal) == 100)
+        ef.insertLine(0,"inserted")
+        ef.save()
+        assert(len(journal) == 101)
+        # undoing past the save doesn't lose the history of the file that was saved
+        ef.getUndoMgr().undo_transaction()
+        ef.getUndoMgr().undo_transaction()
+        assert(ef.getLine(0) == "changed 0" and len(journal) == 100)
+        ef.close()
+        ef = editor_common.EditFile(fn)
+        # saving under another name leaves this file's journal alone
+        other = os.path.join(fd,"other_"+os.path.basename(fn))
+        ef.getUndoMgr().new_transaction()
+        ef.replaceLine(10,"saved as")
+        ef.save(other)
+        assert(ef.getUndoMgr().journal.path == editor_common.EditFile.backup_path(other,fd)+".undo")
+        ef.close()
+        ef = editor_common.EditFile(fn)
+        assert(ef.getLine(0) == "inserted" and not ef.isChanged())
+        assert(len(ef.getUndoMgr().journal) == 101)
+        ef.getUndoMgr().undo_transaction()
+        assert(ef.getLine(0) == "changed 0" and ef.isChanged())
+        while not ef.getUndoMgr().undo_transaction():
+            pass
+        assert(ef.getLines() == lines_to_test)
+        ef.close()
+        open(fn,"a").write("appended line\n")
+        ef = editor_common.EditFile(fn)
+        assert(not len(ef.getUndoMgr().journal))
+        # the journal is kept under max_bytes by dropping the oldest transactions
+        editor_common.undo.UndoJournal.max_bytes = 4096
+        journal = ef.getUndoMgr().journal
+        last = ef.getLine(199)
+        for idx in range(0,200):
+            ef.getUndoMgr().new_transaction()
+            ef.replaceLine(idx,"compacted %d"%idx)
+            if idx % 20 == 19:
+                ef.save()
+        assert(os.path.getsize(journal.path) <= 4096 and 0 < len(journal) < 200)
+        count = len(journal)
+        ef.close()
+        ef = editor_common.EditFile(fn)
+        assert(len(ef.getUndoMgr().journal) == count)
+        ef.getUndoMgr().undo_transaction()
+        assert(ef.getLine(199) == last)
+        ef.close()
+    finally:
+        editor_common.EditFile.default_backuproot = backuproot
+        editor_common.undo.UndoJournal.max_bytes = max_bytes
+
+def test_ChangeManager():
+    cm = editor_common.changes.ChangeManager()
+    cm.add_view("a")
+    cm.add_view("b")
+    assert(not cm.has_changes("a"))
+    for line in range(0,100,10):
+        cm.changed(line,line+2)
+    cm.changed(3,3)
+    assert(len(cm.views["a"]) == 10)
+    assert(cm.is_changed("a",3) and not cm.is_changed("a",4) and cm.is_changed("b",92))
+    assert(cm.next_changed("a",4) == 10 and cm.next_changed("a",93) == -1)
+    assert(list(cm.changed_lines("a",15,35)) == [20,21,22,30,31,32])
+    cm.flush("a")
+    assert(not cm.has_changes("a") and cm.has_changes("b"))
+    cm.start_batch()
+    for line in range(50,40,-1):
+        cm.changed(line,line)
+    assert(not cm.has_changes("a"))
+    cm.end_batch()
+    assert(cm.views["a"].changes()[0].is_equal(editor_common.changes.Change(41,50)))
+    assert(len(cm.views["b"]) == 9)
+    cm.add_view("c")
+    cm.view_changed("c",64,65)
+    assert(cm.is_changed("c",65) and not cm.is_changed("a",65) and not cm.is_changed("b",65))
+    cm.remove_view("c")
+    cc = copy.copy(cm)
+    serial = cm.serial
+    cm.shifted(45,2)
+    cm.shifted(0,-1)
+    assert(cm.get_shifts(serial) == [(45,2),(0,-1)] and cc.get_shifts(serial) == [])
+    assert(cm.views["a"].changes()[0].is_equal(editor_common.changes.Change(40,51)))
+    assert(cm.is_changed("b",2) and not cm.is_changed("b",3) and cm.is_changed("b",91))
+    assert(len(cc.views["a"]) == 1 and cc.is_changed("a",41))
+    for line in range(0,3*editor_common.changes.ChangeManager.max_shifts):
+        cm.shifted(line,1)
+    assert(cm.get_shifts(serial) == None and len(cm.get_shifts(cm.serial-10)) == 10)
+    serial = cm.serial
+    cm.start_batch()
+    for line in range(100,200):
+        cm.shifted(line,1)
+        cm.changed(line,line)
+    for line in range(10):
+        cm.shifted(50,-1)
+    assert(cm.serial == serial+1)
+    cm.end_batch()
+    assert(cm.get_shifts(serial) == [(100,100),(50,-10)])
+    assert(cm.is_changed("b",90) and cm.is_changed("b",189) and not cm.is_changed("b",190))
+    cm.changed()
+    assert(cm.is_changed("a",1000000))
+
+def test_UndoManager():
+    state = [0]
+    def move( pos ):
+        state[0] = pos
+    um = editor_common.undo.UndoManager()
+    for pos in range(0,1000):
+        um.new_transaction()
+        um.get_transaction().push(move,(pos,),True)
+        um.get_transaction().push(move,(pos+1,),True)
+        state[0] = pos+1
+    assert(um.stats()[0] <= 2 and um.stats()[1] <= 2)
+    um.new_transaction()
+    um.get_transaction().push(move,(1000,),True)
+    um.get_transaction().push(state.append,(1,))
+    um.new_transaction()
+    assert(um.stats()[0] == 3 and um.stats()[1] == 3)
+    um.undo_transaction()
+    um.undo_transaction()
+    assert(state[0] == 1000)
+    um.undo_transaction()
+    assert(state[0] == 0)
+    assert(um.size() == 0)
+    um.set_max_bytes(4096)
+    for pos in range(0,1000):
+        um.new_transaction()
+        um.get_transaction().push(state.append,("edit %d"%pos,))
+    assert(um.size() <= 4096 and um.stats()[0] < 1000)
+    um.flush_undo()
+    assert(um.stats() == (0,0,0))
+    # the text of edited lines counts against the budget, arguments shared with the last action only count once
+    um.set_max_bytes(1048576)
+    for pos in range(0,20):
+        um.new_transaction()
+        um.get_transaction().push(state.append,(editor_common.MemLine("x"*262144),))
+    assert(um.size() <= 1048576 and um.stats()[0] <= 4)
+    um.flush_undo()
+    shared = tuple(range(0,1000))
+    um.new_transaction()
+    um.get_transaction().push(state.append,(shared,))
+    size = um.size()
+    um.get_transaction().push(state.append,(shared,))
+    assert(um.size() - size < size/4)
+
+def test_tab_stops():
+    ts = editor_common.tab_stops.get_tab_stops([4,8])
+    assert(ts is editor_common.tab_stops.get_tab_stops((4,8)))
+    assert([ts.next_stop(idx) for idx in [0,3,4,7,8,11,12]] == [4,4,8,8,12,12,16])
+    assert([ts.prev_stop(idx) for idx in [0,3,4,7,8,11,12]] == [0,0,4,4,8,8,12])
+    no_tabs = "no tabs in this line"
+    assert(ts.expand(no_tabs) is no_tabs)
+    assert(ts.expand("\t\ta\tbc\td") == "        a   bc  d")
+    assert(list(ts.column_map("\t\ta\tbc\td")) == [0,4,8,9,12,13,14,16,17])
+    assert(list(ts.column_map("abc")) == [0,1,2,3])
+    assert(ts.expand("x\t"*1000) == "x   "*1000)
+
+def test_shadow_screen():
+    ss = editor_common.shadow_screen.ShadowScreen(3,10)
+    assert(ss.update(0,0,"hello",1) == (0,5))
+    assert(ss.update(0,0,"hello",1) == None)
+    assert(ss.update(0,0,"hallo",1) == (1,2))
+    assert(ss.update(0,3,"lo",2) == (0,2))
+    assert(ss.update(0,0,"hallo     ",1) == (3,10))
+    assert(ss.update(1,2,"abc",1) == (0,3) and ss.text[1] == "  abc     ")
+    ss.shift(0,1)
+    assert(ss.text[0] == None and ss.text[1] == "hallo     " and ss.text[2] == "  abc     ")
+    ss.shift(0,-1)
+    assert(ss.text[0] == "hallo     " and ss.text[1] == "  abc     " and ss.text[2] == None)
+    assert(len(ss.text) == 3 and len(ss.attrs) == 3)
+    ss.forget(1)
+    assert(ss.update(1,2,"abc",1) == (0,3))
+    ss.clear()
+    assert(ss.update(0,0,"hallo",1) == (0,5))
+    assert(ss.stats()[2] == 1)
+
+def test_wrap_index(testdir):
+    def check(ef,wi):
+        row = 0
+        for line in range(0,ef.numLines()):
+            rows = max(1,(ef.length(line)+9)//10)
+            assert(wi.toRow(line) == row and wi.lineRows(line) == rows)
+            for segment in range(0,rows):
+                assert(wi.toLine(row+segment) == (line,segment))
+            row += rows
+        assert(wi.toLine(row+2) == (ef.numLines()+2,0))
+        assert(wi.numRows() == row and wi.numLines() == ef.numLines())
+
+    testfile = testdir.makefile(".txt",**{ "wrap": "\n".join(["x"*((i*7)%45) for i in range(0,3000)])})
+    ef = editor_common.EditFile(str(testfile))
+    wi = editor_common.wrap_index.WrapIndex(ef,10)
+    check(ef,wi)
+    assert(wi.update() == False)
+    ef.replaceLine(5,"y"*25)
+    ef.insertLine(100,"z"*33)
+    ef.deleteLine(2000)
+    for line in range(0,1100):
+        ef.insertLine(1500,"w"*(line%30))
+    assert(wi.update() == True)
+    check(ef,wi)
+    ef.replaceLine(7,"y"*(ef.length(7)+1))
+    assert(wi.update() == False)
+    check(ef,wi)
+    wi.detach()
+    assert(wi not in ef.change_mgr.views)
+
+    lazy_lines = editor_common.wrap_index.WrapIndex.lazy_lines
+    try:
+        editor_common.wrap_index.WrapIndex.lazy_lines = 100
+        wi = editor_common.wrap_index.WrapIndex(ef,10)
+        assert(wi.frontier == 0 and wi.numRows() == ef.numLines())
+        assert(wi.toRow(50) == sum([max(1,(ef.length(line)+9)//10) for line in range(0,50)]))
+        assert(wi.frontier < ef.numLines())
+        check(ef,wi)
+        wi.detach()
+    finally:
+        editor_common.wrap_index.WrapIndex.lazy_lines = lazy_lines
+    ef.close()
+
 def test_Editor_unwrapped(testdir,capsys):
     with capsys.disabled():
         curses.wrapper(editor_test_suite,testdir,False,None)
@@ -134,6 +581,78 @@ def test_Editor_wrapped(testdir,capsys):
     with capsys.disabled():
         curses.wrapper(editor_test_suite,testdir,True,None)
 
+def test_Editor_shadow(testdir,capsys):
+    with capsys.disabled():
+        def main(stdscr,testdir):
+            max_y,max_x = stdscr.getmaxyx()
+            test_file = testdir.makefile(".txt",**{ "shadow": "\n".join(["Line %d of the shadow test"%i for i in range(0,200)])})
+            ed = editor_common.Editor(stdscr,stdscr.subwin(max_y,max_x,0,0),str(test_file))
+            wait_for_screen(ed)
+            validate_screen(ed)
+            # redrawing the whole screen with nothing changed only writes the cursor again
+            frames,writes,skipped,cells,nbytes,seconds = ed.getRenderStats()
+            ed.invalidate_screen()
+            ed.redraw()
+            assert(ed.getRenderStats()[3] == cells+1 and ed.getRenderStats()[0] == frames+1)
+            # changing a line only writes the cells that differ on that line and the status line
+            ed.workfile.replaceLine(5,"Line 5 of the shadow best")
+            wait_for_screen(ed)
+            assert(ed.getRenderStats()[3] - cells < 3*max_x)
+            validate_screen(ed)
+            # after the shadow is dropped everything is written again and the screen still matches
+            ed.invalidate_shadow()
+            ed.invalidate_screen()
+            ed.redraw()
+            assert(ed.getRenderStats()[3] >= cells+(max_y-1)*max_x)
+            validate_screen(ed)
+            # scrolling changes no lines but still has to be drawn
+            ed.redraw()
+            assert(not ed.has_changes())
+            ed.pagedown()
+            assert(ed.has_changes())
+            ed.redraw()
+            assert(not ed.has_changes())
+            validate_screen(ed)
+            ed.close()
+
+        curses.wrapper(main,testdir)
+
+def test_Editor_typeahead(testdir,capsys):
+    with capsys.disabled():
+        def main(stdscr,testdir):
+            max_y,max_x = stdscr.getmaxyx()
+            test_file = testdir.makefile(".txt",**{ "typeahead": "first line\nsecond line\n"})
+            ed = editor_common.Editor(stdscr,stdscr.subwin(max_y,max_x,0,0),str(test_file))
+            wait_for_screen(ed)
+            # a burst of printable keys is inserted by one call in one undo transaction, the key after it is left queued
+            pasted = "pasted text "*8
+            for ch in reversed(pasted+"\n"):
+                curses.ungetch(ord(ch))
+            ed.main(False)
+            assert(ed.getContent(0) == pasted+"first line" and ed.getPos() == len(pasted))
+            assert(keymap.getch(stdscr) == 10)
+            ed.undo()
+            assert(ed.getContent(0) == "first line" and not ed.isChanged())
+            # the run is recorded key by key so it plays back the same
+            keymap.start_recording()
+            for ch in reversed("abc"):
+                curses.ungetch(ord(ch))
+            ed.main(False)
+            keymap.stop_recording()
+            assert(keymap.macro == ['a','b','c'] and ed.getContent(0) == "abcfirst line")
+            ed.close()
+            # an editor that handles keys itself gets them one at a time
+            ro = editor_common.ReadonlyEditor(stdscr,stdscr.subwin(max_y,max_x,0,0),str(test_file))
+            wait_for_screen(ro)
+            for ch in reversed("bc"):
+                curses.ungetch(ord(ch))
+            ro.main(False,ord('a'))
+            assert(not ro.isChanged() and ro.getContent(0) == "first line")
+            assert(keymap.getch(stdscr) == ord('b') and keymap.getch(stdscr) == ord('c'))
+            ro.close()
+
+        curses.wrapper(main,testdir)
+
 def test_StreamEditor(testdir,capsys):
     with capsys.disabled():
         def main(stdscr,testdir):
@@ -172,3 +691,32 @@ def test_StreamEditor(testdir,capsys):
             se.close()
 
         curses.wrapper(main,testdir)
+
+def test_wait_for_input(testdir,capsys):
+    with capsys.disabled():
+        def main(stdscr,testdir):
+            import select
+            # stdscr starts out blocking, checking for a pending key mustn't wait in getch
+            stdscr.nodelay(0)
+            # a key that is already buffered doesn't wait
+            curses.ungetch(ord('a'))
+            keymap.wait_for_input(stdscr,5)
+            assert(keymap.getch(stdscr) == ord('a'))
+            # waiting drains any wakeups, another thread waking us makes the pipe readable
+            keymap.wait_for_input(stdscr,0)
+            wake_r, wake_w = keymap.wake_pipe
+            assert(not select.select([wake_r],[],[],0)[0])
+            import threading
+            threading.Timer(0.1,keymap.wakeup).start()
+            assert(select.select([wake_r],[],[],5)[0])
+            keymap.wait_for_input(stdscr,5)
+            assert(not select.select([wake_r],[],[],0)[0] and not keymap.wake_pending)
+            # a stream being read wakes us up as its lines arrive
+            ef = editor_common.StreamFile("Test Stream",io.StringIO("\n".join(["Line %d"%i for i in range(0,100)])))
+            ef.stream_thread.wait()
+            assert(select.select([wake_r],[],[],0)[0] and ef.numLines() == 100)
+            keymap.wait_for_input(stdscr,5)
+            assert(not select.select([wake_r],[],[],0)[0])
+            assert(keymap.getch(stdscr) < 0)
+
+        curses.wrapper(main,testdir)
@@ -106,6 +106,43 @@ def test_EditorFrame(testdir,capsys):
 
         curses.wrapper(main)
 
+def test_EditorManager_redraw(testdir,capsys):
+    with capsys.disabled():
+        def main(stdscr):
+            test_files = []
+            for idx in range(0,2):
+                lines_to_test = "\n".join([(("File %d line %d "%(idx,r))*20).rstrip() for r in range(0,200)])
+                args = { "test_redraw_%d"%idx: lines_to_test }
+                test_files.append(testdir.makefile(".txt",**args))
+            em = editor_manager.EditorManager(stdscr)
+            em.addEditor(editor_common.Editor(stdscr,None,str(test_files[0])))
+            em.splitFrame(False)
+            em.addEditor(editor_common.Editor(stdscr,None,str(test_files[1])))
+            for f in em.frames:
+                wait_for_screen(f.editor)
+            em.redraw(True)
+            # frames with nothing to draw are skipped
+            assert([f.redraw(False) for f in em.frames] == [False,False])
+            # only the frame whose editor changed is drawn
+            em.frames[1].editor.goto(100,0)
+            assert([f.redraw(False) for f in em.frames] == [False,True])
+            assert([f.redraw(False) for f in em.frames] == [False,False])
+            # scrolling or moving the cursor changes no lines but the frame is still drawn
+            for move in [em.frames[1].editor.pagedown,em.frames[1].editor.pagedown,em.frames[1].editor.cdown]:
+                move()
+                assert([f.redraw(False) for f in em.frames] == [False,True])
+            assert([f.redraw(False) for f in em.frames] == [False,False])
+            # with keys waiting redraws are held off for a while
+            curses.ungetch(ord('a'))
+            em.redraw()
+            assert(not em.redraw_due())
+            em.last_redraw -= editor_manager.EditorManager.pending_redraw_interval
+            assert(em.redraw_due())
+            stdscr.getch()
+            assert(em.redraw_due())
+
+        curses.wrapper(main)
+
 def test_EditorManager(testdir,capsys):
     with capsys.disabled():
         def main(stdscr):
@@ -32,7 +32,7 @@ def test_java_mode(testdir,capsys):
             ed = editor_common.Editor(stdscr,None,str(testfile))
             ed.setWin(stdscr.subwin(ed.max_y,ed.max_x,0,0))
             validate_screen(ed)
-            assert(ed.mode and ed.mode.name() == "java_mode")
+            assert(ed.mode and ed.mode.name(ed) == "java_mode")
             match_list = [(0,0,32,red),(2,0,5,cyan),(4,4,44,red),(8,27,14,green)]
             for line,pos,width,attr in match_list:
                 assert(match_attr(ed.scr,line+1,pos,1,width,attr))
@@ -33,7 +33,7 @@ def test_python_mode(testdir,capsys):
             ed = editor_common.Editor(stdscr,None,str(testfile))
             ed.setWin(stdscr.subwin(ed.max_y,ed.max_x,0,0))
             validate_screen(ed)
-            assert(ed.mode and ed.mode.name() == "python_mode")
+            assert(ed.mode and ed.mode.name(ed) == "python_mode")
             match_list = [(0,0,6,cyan),(4,0,19,red),(6,18,5,green),(11,19,31,red)]
             for line,pos,width,attr in match_list:
                 assert(match_attr(ed.scr,line+1,pos,1,width,attr))
@@ -48,3 +48,233 @@ def test_python_mode(testdir,capsys):
 
 
         curses.wrapper(main)
+
+def test_python_mode_incremental_lex(testdir):
+    from ped_core import mode
+    from pygments.lexers import PythonLexer
+    from pygments.token import String
+    lines_to_test = []
+    for idx in range(0,500):
+        lines_to_test += ['def f%d( x ):'%idx, '    """ docstring', '    line two """', '    return x+%d'%idx]
+    args = { "lex_test":"\n".join(lines_to_test)}
+    testfile = testdir.makefile(".py", **args)
+    ef = editor_common.EditFile(str(testfile))
+    tokens = mode.Tokens()
+    ef.change_mgr.add_view(tokens)
+    lexer = PythonLexer()
+    def lex( window = (0,0), live = ef ):
+        snapshot = ef.snapshot(tokens)
+        mode.gen_tokens(tokens,lexer,snapshot,live,window)
+        return tokens.getLexed()
+    def token_at(row,col):
+        for offset,length,tokentype in mode.unpack_tokens(tokens.getTokens()[row]):
+            if offset <= col < offset+length:
+                return tokentype
+    assert(lex() == len(lines_to_test))
+    assert(token_at(2,4) in String)
+    ef.replaceLine(1001,'    """ changed docstring')
+    assert(lex() == 1)
+    assert(token_at(1002,4) in String)
+    ef.replaceLine(1002,'    line two')
+    assert(lex() == len(lines_to_test)-1002)
+    assert(token_at(1003,4) in String and token_at(1004,0) in String)
+    ef.replaceLine(1002,'    line two """')
+    assert(lex() == len(lines_to_test)-1002 and token_at(1003,4) not in String)
+    ef.insertLine(1002,'    more docstring')
+    assert(lex() == 1 and token_at(1002,4) in String and token_at(1004,4) not in String)
+    ef.deleteLine(1002)
+    assert(lex() == 1 and token_at(1002,4) in String and token_at(1003,4) not in String)
+    ef.insertLine(1004,'    """')
+    assert(lex() == ef.numLines()-1004 and token_at(1005,0) in String)
+    assert(len(tokens.getTokens()) == ef.numLines())
+
+def test_python_mode_window_first(testdir):
+    from ped_core import mode
+    from pygments.lexers import PythonLexer
+    from pygments.token import String, Token
+    lines_to_test = []
+    for idx in range(0,500):
+        lines_to_test += ['def f%d( x ):'%idx, '    """ docstring', '    line two """', '    return x+%d'%idx]
+    args = { "window_test":"\n".join(lines_to_test)}
+    testfile = testdir.makefile(".py", **args)
+    ef = editor_common.EditFile(str(testfile))
+    tokens = mode.Tokens()
+    ef.change_mgr.add_view(tokens)
+    lexer = PythonLexer()
+    class Edited:
+        def getModref(self):
+            return ef.getModref()+1
+    snapshot = ef.snapshot(tokens)
+    mode.gen_tokens(tokens,lexer,snapshot,Edited(),(1500,1550))
+    assert(tokens.getWindow() == (ef.getModref(),1500,1550) and tokens.getModref() == -1)
+    assert([row for row,line_tokens in enumerate(tokens.getTokens()) if line_tokens != None] == list(range(1500,1550)))
+    assert(tokens.copyPending().next_changed(0) == 0)
+    ef.replaceLine(0,'def changed( x ):')
+    snapshot = ef.snapshot(tokens)
+    mode.gen_tokens(tokens,lexer,snapshot,ef,(0,0))
+    assert(tokens.getModref() == ef.getModref() and tokens.copyPending().next_changed(0) == -1)
+    assert(len(tokens.getTokens()) == len(lines_to_test) and tokens.getLexed() == len(lines_to_test))
+    assert(mode.unpack_tokens(tokens.getTokens()[1502])[-1][2] in String)
+    assert(mode.unpack_tokens(tokens.getTokens()[1503]) == [(0,4,Token.Text),(4,6,Token.Keyword),(10,1,Token.Text),(11,1,Token.Name),(12,1,Token.Operator),(13,3,Token.Literal.Number.Integer)])
+
+def test_python_mode_window_state_past_end(testdir):
+    from ped_core import mode
+    from pygments.lexers import PythonLexer
+    from pygments.token import String
+    args = { "window_state_test":"\n".join(['x = %d'%idx for idx in range(0,200)])}
+    testfile = testdir.makefile(".py", **args)
+    ef = editor_common.EditFile(str(testfile))
+    tokens = mode.Tokens()
+    ef.change_mgr.add_view(tokens)
+    lexer = PythonLexer()
+    def lex( window ):
+        snapshot = ef.snapshot(tokens)
+        mode.gen_tokens(tokens,lexer,snapshot,ef,window)
+    lex((0,0))
+    ef.replaceLine(60,'s = """open')
+    lex((50,80))
+    assert(mode.unpack_tokens(tokens.getTokens()[100])[0][2] in String)
+    fresh = mode.Tokens()
+    mode.gen_tokens(fresh,lexer,ef.snapshot(),ef,(0,0))
+    assert(tokens.getTokens() == fresh.getTokens())
+
+def test_tokenizer_pool(testdir):
+    from ped_core import mode
+    from pygments.lexers import PythonLexer
+    import concurrent.futures
+    import multiprocessing
+    import threading
+    import time
+    lines_to_test = []
+    for idx in range(0,2500):
+        lines_to_test += ['def f%d( x ):'%idx, '    """ docstring', '    line two """', '    return x+%d'%idx]
+    big = editor_common.EditFile(str(testdir.makefile(".py", big_test="\n".join(lines_to_test))))
+    small = editor_common.EditFile(str(testdir.makefile(".py", small_test="\n".join(lines_to_test[:40]))))
+    done = []
+    class Recorder(mode.Tokens):
+        def publish(self,window = None,**kwargs):
+            mode.Tokens.publish(self,window,**kwargs)
+            if not window:
+                done.append(self)
+    pool = mode.TokenizerPool(1)
+    pool.workers = 0
+    jobs = []
+    for ef,priority in [(big,1),(small,1),(big,1),(small,2)]:
+        tokens = Recorder()
+        ef.change_mgr.add_view(tokens)
+        snapshot = ef.snapshot(tokens)
+        job = mode.TokenizerJob(priority,tokens,PythonLexer(),snapshot,ef,(0,0))
+        tokens.setJob(job)
+        jobs.append(job)
+        if priority == 2:
+            pool.prioritize(jobs[2],0)
+            pool.workers = 1
+        pool.submit(job)
+    deadline = time.time()+30
+    while pool.stats()[3]+pool.stats()[4] < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert(done == [jobs[2].tokenobj,jobs[0].tokenobj,jobs[1].tokenobj,jobs[3].tokenobj])
+    assert(pool.stats() == (0,0,4,4,0) and not jobs[0].tokenobj.getJob())
+
+    threaded = jobs[2].tokenobj
+    tokens = mode.Tokens()
+    big.change_mgr.add_view(tokens)
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=1,mp_context=multiprocessing.get_context("spawn"))
+    try:
+        assert(mode.gen_tokens(tokens,PythonLexer(),big.snapshot(),big,(5000,5050),executor))
+    finally:
+        executor.shutdown()
+    assert(tokens.getTokens() == threaded.getTokens() and tokens.getLexed() == threaded.getLexed()+50)
+
+    # a lexer that raises fails its job but the worker lives on to run the next one
+    from pygments.lexer import RegexLexer
+    class BrokenLexer(RegexLexer):
+        tokens = { 'root': [] }
+        def get_tokens_unprocessed(self, text):
+            raise ValueError("broken lexer")
+    pool = mode.TokenizerPool(1)
+    jobs = []
+    for lexer in [BrokenLexer(),PythonLexer()]:
+        tokens = mode.Tokens()
+        small.change_mgr.add_view(tokens)
+        job = mode.TokenizerJob(1,tokens,lexer,small.snapshot(),small,(0,0))
+        tokens.setJob(job)
+        jobs.append(job)
+        pool.submit(job)
+    deadline = time.time()+30
+    while pool.stats()[3]+pool.stats()[4] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert(pool.stats()[3:] == (1,1) and pool.failed == 1 and isinstance(pool.last_error,ValueError))
+    assert(jobs[0].tokenobj.getModref() == small.getModref() and jobs[0].tokenobj.getTokens() == [])
+    assert(jobs[1].tokenobj.getModref() == small.getModref() and len(jobs[1].tokenobj.getTokens()) == small.numLines())
+    # worker threads that have died are replaced
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    pool.threads = [dead]
+    tokens = mode.Tokens()
+    job = mode.TokenizerJob(1,tokens,PythonLexer(),small.snapshot(),small,(0,0))
+    tokens.setJob(job)
+    pool.submit(job)
+    deadline = time.time()+30
+    while pool.stats()[3] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert(pool.stats()[3] == 2 and dead not in pool.threads)
+
+    # workers meeting new token types at the same time give each type one id
+    from pygments.token import Token
+    new_types = [getattr(Token.PoolTest,"T%d"%idx) for idx in range(0,200)]
+    ids = []
+    def register():
+        ids.append([mode.token_type_id(t) for t in new_types])
+    threads = [threading.Thread(target=register) for idx in range(0,8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert(all([i == ids[0] for i in ids]) and len(set(ids[0])) == len(new_types))
+    assert([mode.token_type_list[i] for i in ids[0]] == new_types)
+
+def test_detect_lexer():
+    from ped_core import mode
+    from pygments.lexers import PythonLexer, BashLexer, TextLexer
+    lexer = mode.detect_lexer("/tmp/foo.py")
+    assert(isinstance(lexer,PythonLexer) and mode.detect_lexer("bar.py:(r123)") is lexer)
+    assert(mode.lexer_classes["file:foo.py"] == PythonLexer)
+    assert(mode.detect_lexer("script","#!/usr/bin/env python3") is lexer)
+    assert(mode.detect_lexer("script.txt","#!/usr/bin/python3.11 -u") is lexer)
+    assert(isinstance(mode.detect_lexer("run","#!/bin/sh"),BashLexer))
+    assert(isinstance(mode.detect_lexer("notes.zzz"),TextLexer) and isinstance(mode.detect_lexer(None),TextLexer))
+
+def test_lex_line_overrides():
+    from ped_core import mode
+    from pygments.lexer import RegexLexer
+    from pygments.lexers import PythonLexer, LuaLexer
+    from pygments.token import Text, Name
+    class NoStackLexer(RegexLexer):
+        tokens = { 'root': [ (r'\w+', Name), (r'\s+', Text) ] }
+        def get_tokens_unprocessed(self, text):
+            for index, tokentype, value in RegexLexer.get_tokens_unprocessed(self,text):
+                yield index, tokentype, value
+    class StackLexer(NoStackLexer):
+        def get_tokens_unprocessed(self, text, stack=('root',)):
+            for index, tokentype, value in RegexLexer.get_tokens_unprocessed(self,text,stack):
+                yield index, tokentype, value
+    # overrides that can't start from a saved stack are lexed without state instead of failing
+    for lexer_class, stacked in [(PythonLexer,True),(StackLexer,True),(NoStackLexer,False),(LuaLexer,False)]:
+        tokenized, end_stack = mode.lex_line(lexer_class(),"local x = 1\n",('root',),{})
+        assert(mode.is_stack_lexer(lexer_class()) == stacked and (end_stack != ()) == stacked)
+        assert("".join([value for index, tokentype, value in tokenized]) == "local x = 1\n")
+    # the override's own tokens come back and the line is only lexed once
+    class CountingLexer(StackLexer):
+        calls = 0
+        def get_tokens_unprocessed(self, text, stack=('root',)):
+            CountingLexer.calls += 1
+            for index, tokentype, value in StackLexer.get_tokens_unprocessed(self,text,stack):
+                yield index, Name.Builtin if tokentype is Name else tokentype, value
+    tokenized, end_stack = mode.lex_line(CountingLexer(),"local x\n",('root',),{})
+    assert(CountingLexer.calls == 1 and end_stack == ('root',) and tokenized[0] == (0,Name.Builtin,"local"))
+    # the state at the end of the line is the one the lexer's own loop ended in
+    lexer = PythonLexer()
+    tokenized, end_stack = mode.lex_line(lexer,'x = """open\n',('root',),{})
+    assert(end_stack != ('root',) and mode.lex_line(lexer,'still open"""\n',end_stack,{})[1] == ('root',))